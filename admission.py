@@ -0,0 +1,294 @@
+"""
+Admission Control
+Token buckets theo client (API key hoặc IP) tính bằng requests và estimated tokens, hàng đợi giới hạn có deadline
+"""
+
+import hashlib
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, NamedTuple
+
+from token_estimator import estimate_tokens
+
+# Buckets kept in memory. Only idle clients (buckets refilled to full) are dropped to make room, so forgetting one
+# never gives it a fresh allowance; when every tracked client is still refilling, new clients share one bucket
+MAX_CLIENTS = 10000
+OVERFLOW_CLIENT = "overflow"
+
+def estimate_request_tokens(payload: Dict[str, Any]) -> int:
+    """Ước lượng tokens của request: prompt (tokenizer, xem token_estimator.py) + max_tokens cho completion"""
+    return estimate_tokens(payload).total
+
+def parse_networks(values: Iterable[str]) -> tuple:
+    """IPs/CIDRs của proxy.yaml (trusted_proxies) -> networks"""
+    return tuple(ipaddress.ip_network(str(value).strip(), strict=False) for value in values or ())
+
+def _in_networks(address: str, networks: tuple) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+def client_ip(headers: Any, remote_addr: str, trusted_proxies: tuple = ()) -> str:
+    """IP của client: remote_addr; X-Forwarded-For chỉ được dùng khi remote_addr là trusted proxy, và lấy hop
+    ngoài cùng bên phải không phải trusted proxy (các hop bên trái do client tự ghi, giả mạo được)"""
+    address = remote_addr
+    forwarded = headers.get("X-Forwarded-For")
+    if not forwarded or not _in_networks(address, trusted_proxies):
+        return address
+    for hop in reversed(forwarded.split(",")):
+        hop = hop.strip()
+        try:
+            ipaddress.ip_address(hop)
+        except ValueError:
+            break
+        address = hop
+        if not _in_networks(hop, trusted_proxies):
+            break
+    return address
+
+def request_api_key(headers: Any) -> Optional[str]:
+    """API key từ X-API-Key hoặc Authorization: Bearer"""
+    api_key = headers.get("X-API-Key")
+    authorization = headers.get("Authorization") or ""
+    if not api_key and authorization.lower().startswith("bearer "):
+        api_key = authorization[7:].strip()
+    return api_key or None
+
+def client_id(headers: Any, remote_addr: str, key_by: str = "api_key", known_keys: frozenset = frozenset(),
+              trusted_proxies: tuple = ()) -> str:
+    """Client key: API key nếu key_by=api_key và key có trong proxy.yaml (known_keys), không thì IP.
+    Key lạ hoặc không có key tính theo IP, để client không lấy limits mới bằng cách đổi key ngẫu nhiên"""
+    if key_by == "api_key":
+        api_key = request_api_key(headers)
+        if api_key and api_key in known_keys:
+            return f"key:{api_key}"
+    return f"ip:{client_ip(headers, remote_addr, trusted_proxies)}"
+
+def config_client_id(name: str) -> str:
+    """Client trong proxy.yaml (API key hoặc IP) -> id như client_id() trả về"""
+    if name.startswith(("key:", "ip:")):
+        return name
+    return f"ip:{name}" if _looks_like_ip(name) else f"key:{name}"
+
+class ClientResolver:
+    """client_id() với cấu hình từ proxy.yaml (dùng chung cho admission và budget)"""
+
+    def __init__(self, key_by: str = "api_key", known_keys: Iterable[str] = (), trusted_proxies: Iterable[str] = ()):
+        self.key_by = key_by
+        self.known_keys = frozenset(known_keys)
+        self.trusted_proxies = parse_networks(trusted_proxies)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ClientResolver":
+        """Từ toàn bộ proxy.yaml: key_by của admission, API keys trong clients của admission/budget,
+        trusted_proxies (top-level)"""
+        keys = set()
+        for section in ("admission", "budget"):
+            for name in ((config.get(section) or {}).get("clients") or {}):
+                client = config_client_id(str(name))
+                if client.startswith("key:"):
+                    keys.add(client[4:])
+        return cls((config.get("admission") or {}).get("key_by", "api_key"), keys,
+                   config.get("trusted_proxies") or ())
+
+    def resolve(self, headers: Any, remote_addr: str) -> str:
+        return client_id(headers, remote_addr, self.key_by, self.known_keys, self.trusted_proxies)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"key_by": self.key_by, "known_keys": len(self.known_keys),
+                "trusted_proxies": [str(network) for network in self.trusted_proxies]}
+
+def redact_client(client: str) -> str:
+    """Không đưa API key thật vào stats/logs: chỉ giữ hash ngắn"""
+    if client.startswith("key:"):
+        return "key:" + hashlib.sha256(client[4:].encode()).hexdigest()[:12]
+    return client
+
+class TokenBucket:
+    """Bucket refill `rate` units/giây, tối đa `capacity`; reserve() cho phép nợ để tính thời gian chờ"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Lấy `amount` units; trả về số giây phải chờ trước khi dùng (0 nếu có sẵn)"""
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate if self.rate > 0 else math.inf
+
+    def cancel(self, amount: float):
+        """Trả lại reservation bị từ chối"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def full(self, now: float) -> bool:
+        """Đã refill đầy: bỏ bucket này rồi tạo lại (đầy) không thay đổi gì"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class Limits(NamedTuple):
+    requests_per_minute: float
+    tokens_per_minute: float
+    burst_requests: float
+    burst_tokens: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], default: "Limits" = None) -> "Limits":
+        """Limits từ proxy.yaml; field không có thì lấy từ default. Burst mặc định = 1/10 limit mỗi phút"""
+        def per_minute(name: str, fallback: float) -> float:
+            return float(data[name]) if data.get(name) is not None else fallback
+
+        def burst(name: str, per_minute_name: str, rate: float) -> float:
+            if data.get(name) is not None:
+                return max(1.0, float(data[name]))
+            if default is not None and data.get(per_minute_name) is None:
+                return getattr(default, name)
+            return max(1.0, rate / 10)
+
+        rpm = per_minute("requests_per_minute", default.requests_per_minute if default else 600.0)
+        tpm = per_minute("tokens_per_minute", default.tokens_per_minute if default else 200000.0)
+        return cls(rpm, tpm, burst("burst_requests", "requests_per_minute", rpm),
+                   burst("burst_tokens", "tokens_per_minute", tpm))
+
+class Decision(NamedTuple):
+    admitted: bool
+    wait: float
+    retry_after: float = 0.0
+    reason: Optional[str] = None
+
+class _ClientState:
+    __slots__ = ("requests", "tokens")
+
+    def __init__(self, limits: Limits):
+        self.requests = TokenBucket(limits.requests_per_minute / 60.0, limits.burst_requests)
+        self.tokens = TokenBucket(limits.tokens_per_minute / 60.0, limits.burst_tokens)
+
+    def idle(self, now: float) -> bool:
+        return self.requests.full(now) and self.tokens.full(now)
+
+class AdmissionController:
+    """Quyết định admit/queue/reject cho mỗi request trước khi forward tới gateway"""
+
+    def __init__(self, default_limits: Limits, client_limits: Dict[str, Limits] = None, key_by: str = "api_key",
+                 max_queue: int = 256, max_wait: float = 2.0):
+        self.default_limits = default_limits
+        self.client_limits = client_limits or {}
+        self.key_by = key_by
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.clients = OrderedDict()
+        self.queued = 0
+        # Counters for /proxy/stats
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = {"requests": 0, "tokens": 0, "queue_full": 0}
+        self.wait_total = 0.0
+        self.max_queued = 0
+        # Requests from new clients that had to share the overflow bucket (table full of active clients)
+        self.overflowed = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "AdmissionController":
+        """Tạo từ section `admission` của proxy.yaml"""
+        default = Limits.from_dict(config.get("default") or {})
+        clients = {}
+        for name, data in (config.get("clients") or {}).items():
+            # Clients are listed by API key or IP; match the ids produced by client_id()
+            clients[config_client_id(name)] = Limits.from_dict(data or {}, default)
+        queue = config.get("queue") or {}
+        return cls(default, clients, config.get("key_by", "api_key"),
+                   int(queue.get("max_size", 256)), float(queue.get("max_wait_seconds", 2.0)))
+
+    def _state(self, client: str, now: float) -> _ClientState:
+        state = self.clients.get(client)
+        if state is not None:
+            self.clients.move_to_end(client)
+            return state
+        while len(self.clients) >= MAX_CLIENTS:
+            oldest = next(iter(self.clients))
+            if not self.clients[oldest].idle(now):
+                break
+            del self.clients[oldest]
+        # Clients with their own limits in proxy.yaml are always tracked (bounded by the config)
+        if len(self.clients) >= MAX_CLIENTS and client not in self.client_limits:
+            self.overflowed += 1
+            client = OVERFLOW_CLIENT
+            state = self.clients.get(client)
+            if state is not None:
+                self.clients.move_to_end(client)
+                return state
+        state = self.clients[client] = _ClientState(self.client_limits.get(client, self.default_limits))
+        return state
+
+    def reserve(self, client: str, tokens: int) -> Decision:
+        """Reserve 1 request + `tokens` tokens; chờ tối đa max_wait trong hàng đợi, không thì reject"""
+        now = time.monotonic()
+        with self.lock:
+            state = self._state(client, now)
+            request_wait = state.requests.reserve(1, now)
+            # A single request larger than the bucket can never fit; charge at most a full bucket
+            token_cost = min(tokens, state.tokens.capacity)
+            token_wait = state.tokens.reserve(token_cost, now)
+            wait = max(request_wait, token_wait)
+            if wait == 0:
+                self.admitted += 1
+                return Decision(True, 0.0)
+            reason = None
+            if wait > self.max_wait:
+                reason = "requests" if request_wait >= token_wait else "tokens"
+            elif self.queued >= self.max_queue:
+                reason = "queue_full"
+            if reason:
+                state.requests.cancel(1)
+                state.tokens.cancel(token_cost)
+                self.rejected[reason] += 1
+                return Decision(False, 0.0, wait if reason != "queue_full" else self.max_wait, reason)
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            self.delayed += 1
+            self.admitted += 1
+            self.wait_total += wait
+        return Decision(True, wait)
+
+    def admit(self, client: str, tokens: int) -> Decision:
+        """reserve() rồi sleep hết thời gian chờ (nếu được admit)"""
+        decision = self.reserve(client, tokens)
+        if decision.admitted and decision.wait > 0:
+            try:
+                time.sleep(decision.wait)
+            finally:
+                with self.lock:
+                    self.queued -= 1
+        return decision
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "key_by": self.key_by,
+                "clients": len(self.clients),
+                "overflowed": self.overflowed,
+                "admitted": self.admitted,
+                "delayed": self.delayed,
+                "rejected": dict(self.rejected),
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "mean_wait": self.wait_total / self.delayed if self.delayed else 0.0,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait
+            }
+
+def _looks_like_ip(name: str) -> bool:
+    return (name.count(".") == 3 and all(part.isdigit() for part in name.split("."))) or ":" in name
@@ -5,31 +5,26 @@ Phân tích chi phí từ Docker logs hoặc response files
 """
 
 import json
-import re
+import os
 import sys
 import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterable, Iterator
 from collections import defaultdict
 
-# Pricing per 1K tokens (2024)
-PRICING = {
-    "gpt-3.5-turbo": {"input": 0.0005, "output": 0.0015},
-    "gpt-4": {"input": 0.03, "output": 0.06},
-    "gpt-4-turbo": {"input": 0.01, "output": 0.03},
-    "gpt-4o": {"input": 0.005, "output": 0.015}
-}
+from cost_engine import (PRICING, DEFAULT_MODEL, UsageColumns, calculate_cost, endpoint_name, price_token_totals,
+                         warn_unknown_models)
+from latency_histogram import LatencyHistogram
+from log_classifier import classify_line, extract_json_object, parse_nginx_line, NginxRecord, EMPTY_RECORD
+from request_log import iter_records
+from response_cache import CACHE_HIT_VALUES
 
 def parse_log_line(line: str) -> Dict[str, Any]:
     """Parse JSON từ log line"""
-    json_match = re.search(r'\{.*\}', line, re.DOTALL)
-    if not json_match:
-        return None
-    
-    try:
-        return json.loads(json_match.group())
-    except:
-        return None
+    return extract_json_object(line)
 
 def extract_usage_from_response(response_data: Dict[str, Any]) -> Dict[str, Any]:
     """Extract usage từ response data"""
@@ -41,28 +36,299 @@ def extract_usage_from_response(response_data: Dict[str, Any]) -> Dict[str, Any]
             return choice["usage"]
     return None
 
-def calculate_cost(usage: Dict[str, Any], model: str = "gpt-3.5-turbo") -> Dict[str, float]:
-    """Tính toán chi phí"""
-    if model not in PRICING:
-        model = "gpt-3.5-turbo"
+# Per-request breakdown is only printed for small runs; keep at most this many usages in memory
+BREAKDOWN_LIMIT = 20
+# `docker logs` that sends no line for this many seconds is killed (hung daemon or container); 0 = no limit
+DOCKER_LOGS_TIMEOUT = float(os.getenv("DOCKER_LOGS_TIMEOUT", "15"))
+
+class LogSourceError(subprocess.SubprocessError):
+    """Không đọc được log source (docker logs lỗi hoặc treo, file không tồn tại...)"""
+
+def iter_docker_log_lines(container_name: str, tail: Any = 1000, since: str = None,
+                          timestamps: bool = False, timeout: float = DOCKER_LOGS_TIMEOUT) -> Iterator[str]:
+    """Đọc `docker logs` từng dòng trực tiếp từ pipe, không giữ toàn bộ output trong memory; kill docker nếu
+    không có dòng mới sau `timeout` giây"""
+    command = ["docker", "logs", container_name]
+    if since:
+        command += ["--since", since]
+    else:
+        command += ["--tail", str(tail)]
+    if timestamps:
+        command.append("--timestamps")
+    # Container stderr (uvicorn/gunicorn) is relayed on docker's stderr, so merge both streams
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace"
+    )
+    # When the current read started; None while the caller handles a line, so slow callers are not a stall
+    reading = [time.monotonic()]
+    stalled = threading.Event()
+    finished = threading.Event()
+
+    def watchdog():
+        while not finished.wait(min(1.0, timeout)):
+            started = reading[0]
+            if started is not None and time.monotonic() - started > timeout:
+                stalled.set()
+                process.kill()
+                return
+
+    if timeout > 0:
+        threading.Thread(target=watchdog, name="docker-logs-watchdog", daemon=True).start()
+    last_line = ""
+    try:
+        while True:
+            reading[0] = time.monotonic()
+            line = process.stdout.readline()
+            reading[0] = None
+            if not line:
+                break
+            last_line = line.rstrip("\n")
+            yield last_line
+    finally:
+        finished.set()
+        process.stdout.close()
+        if process.poll() is None:
+            # Generator closed early: stop docker instead of leaving it blocked on a full pipe
+            process.kill()
+        returncode = process.wait()
+    if stalled.is_set():
+        raise LogSourceError(f"docker logs {container_name} sent nothing for {timeout:g}s, killed")
+    if returncode != 0:
+        raise LogSourceError(last_line or f"docker logs exited with code {returncode}")
+
+def iter_file_lines(file_path: str) -> Iterator[str]:
+    """Đọc log file từng dòng"""
+    with open(file_path, "r", errors="replace") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+class LogAggregate:
+    """Kết quả phân tích log, cập nhật từng dòng (memory không phụ thuộc số dòng)"""
+
+    def __init__(self):
+        self.total_lines = 0
+        self.has_requests = False
+        self.has_errors = False
+        self.error_types = defaultdict(int)
+        self.api_requests = 0
+        self.successful_requests = 0
+        self.failed_requests = 0
+        self.usage_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # model -> [requests, prompt_tokens, completion_tokens]; priced once at report time
+        self.tokens_by_model = {}
+        self.sample_usages = []
+
+    def add_usage(self, usage: Dict[str, Any], model: str):
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        self.usage_count += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        totals = self.tokens_by_model.get(model)
+        if totals is None:
+            totals = self.tokens_by_model[model] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += completion_tokens
+        if len(self.sample_usages) < BREAKDOWN_LIMIT:
+            self.sample_usages.append(usage)
+
+    @property
+    def total_cost(self) -> float:
+        return sum(price_token_totals(prompt, completion, model)
+                   for model, (_, prompt, completion) in self.tokens_by_model.items())
+
+    def merge(self, other: "LogAggregate"):
+        """Cộng dồn aggregate khác vào aggregate này"""
+        self.total_lines += other.total_lines
+        self.has_requests = self.has_requests or other.has_requests
+        self.has_errors = self.has_errors or other.has_errors
+        for error_type, count in other.error_types.items():
+            self.error_types[error_type] += count
+        self.api_requests += other.api_requests
+        self.successful_requests += other.successful_requests
+        self.failed_requests += other.failed_requests
+        self.usage_count += other.usage_count
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        for model, (requests, prompt, completion) in other.tokens_by_model.items():
+            totals = self.tokens_by_model.setdefault(model, [0, 0, 0])
+            totals[0] += requests
+            totals[1] += prompt
+            totals[2] += completion
+        self.sample_usages.extend(other.sample_usages[:BREAKDOWN_LIMIT - len(self.sample_usages)])
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = dict(self.__dict__)
+        data["total_cost"] = self.total_cost
+        data["error_types"] = dict(self.error_types)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LogAggregate":
+        aggregate = cls()
+        for key, value in data.items():
+            if key in aggregate.__dict__:
+                setattr(aggregate, key, value)
+        aggregate.error_types = defaultdict(int, data.get("error_types", {}))
+        if "tokens_by_model" in data:
+            aggregate.tokens_by_model = {model: list(totals) for model, totals in data["tokens_by_model"].items()}
+        elif aggregate.usage_count:
+            # State written before per-model totals: attribute everything to the default model
+            aggregate.tokens_by_model = {
+                DEFAULT_MODEL: [aggregate.usage_count, aggregate.prompt_tokens, aggregate.completion_tokens]
+            }
+        return aggregate
+
+def scan_log_lines(lines: Iterable[str], model: str = "gpt-3.5-turbo", aggregate: LogAggregate = None) -> LogAggregate:
+    """Phân tích log từng dòng và cộng dồn vào aggregate"""
+    if aggregate is None:
+        aggregate = LogAggregate()
     
-    prompt_tokens = usage.get("prompt_tokens", 0)
-    completion_tokens = usage.get("completion_tokens", 0)
-    total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
+    for line in lines:
+        aggregate.total_lines += 1
+        record = classify_line(line)
+        if record is EMPTY_RECORD:
+            continue
+        
+        if record.is_request:
+            aggregate.has_requests = True
+        if record.path and '/invocations' in record.path:
+            aggregate.api_requests += 1
+            if record.status == 200:
+                aggregate.successful_requests += 1
+            elif record.status and record.status >= 400:
+                aggregate.failed_requests += 1
+        
+        if record.is_error:
+            aggregate.has_errors = True
+            if record.error_class:
+                aggregate.error_types[record.error_class] += 1
+        
+        if record.usage:
+            aggregate.add_usage(record.usage, model)
     
-    input_cost = (prompt_tokens / 1000) * PRICING[model]["input"]
-    output_cost = (completion_tokens / 1000) * PRICING[model]["output"]
-    total_cost = input_cost + output_cost
+    return aggregate
+
+def report_log_aggregate(aggregate: LogAggregate, model: str = "gpt-3.5-turbo", show_stats: bool = True):
+    """In request statistics và cost summary từ aggregate"""
+    # Show request statistics even if no usage data
+    if show_stats and not aggregate.usage_count:
+        print("\n" + "=" * 70)
+        print("Request Statistics")
+        print("=" * 70)
+        print(f"Lines analyzed: {aggregate.total_lines:,}")
+        if aggregate.has_requests:
+            print("✓ Gateway has received requests (detected in logs)")
+            if aggregate.api_requests:
+                print(f"  API Requests: {aggregate.api_requests}")
+                if aggregate.successful_requests:
+                    print(f"  Successful: {aggregate.successful_requests}")
+                if aggregate.failed_requests:
+                    print(f"  Failed: {aggregate.failed_requests}")
+        else:
+            print("⚠ No requests detected in logs")
+            print("  Note: If access logging is enabled, requests should appear here")
+            print("  If you ran evaluate_gateway.py, check for gateway_results.json file")
+        
+        if aggregate.has_errors:
+            print(f"\n⚠ Errors detected in logs:")
+            for error_type, count in aggregate.error_types.items():
+                print(f"  - {error_type}: {count} occurrence(s)")
+            
+            if "quota_exceeded" in aggregate.error_types:
+                print("\n💡 Quota Exceeded Error:")
+                print("  This means your OpenAI API key has reached its usage limit.")
+                print("  Solutions:")
+                print("    1. Check billing: https://platform.openai.com/account/billing")
+                print("    2. Add payment method if needed")
+                print("    3. Wait for quota reset (usually monthly)")
+                print("    4. Use a different API key with available quota")
+                print("\n  Note: Gateway is working correctly. The issue is with OpenAI API access.")
+        
+        print("\n⚠ No usage data found in logs.")
+        print("Note: MLflow Gateway doesn't log request details to stdout.")
+        print("Usage data only appears after successful API calls with valid responses.")
+        if os.path.exists(REQUEST_LOG_FILE):
+            print(f"\n💡 gateway_proxy.py request log found: python3 analyze_costs.py --request-log {REQUEST_LOG_FILE}")
+        
+        # Auto-detect and suggest results file
+        results_files = ["gateway_results.json", "results.json"]
+        found_file = None
+        for rf in results_files:
+            if os.path.exists(rf):
+                found_file = rf
+                break
+        
+        if found_file:
+            print(f"\n💡 Found results file: {found_file}")
+            print(f"  Analyzing from results file instead...")
+            print("")
+            # Auto-analyze from results file
+            analyze_response_file(found_file, model)
+            return
+        else:
+            print("\nTo get usage data:")
+            print("  1. Ensure your OpenAI API key has available quota")
+            print("  2. Run evaluation: python3 evaluate_gateway.py")
+            print("  3. Then analyze from results file:")
+            print("     python3 analyze_costs.py --response-file gateway_results.json")
+        return
     
-    return {
-        "prompt_tokens": prompt_tokens,
-        "completion_tokens": completion_tokens,
-        "total_tokens": total_tokens,
-        "input_cost": input_cost,
-        "output_cost": output_cost,
-        "total_cost": total_cost,
-        "model": model
-    }
+    if not aggregate.usage_count:
+        return
+    
+    # Calculate costs
+    total_prompt = aggregate.prompt_tokens
+    total_completion = aggregate.completion_tokens
+    total_tokens = total_prompt + total_completion
+    total_cost = aggregate.total_cost
+    
+    print(f"\n{'=' * 70}")
+    print("Cost Summary")
+    print(f"{'=' * 70}")
+    print(f"Lines analyzed: {aggregate.total_lines:,}")
+    print(f"Total Requests: {aggregate.usage_count}")
+    print(f"Total Prompt Tokens: {total_prompt:,}")
+    print(f"Total Completion Tokens: {total_completion:,}")
+    print(f"Total Tokens: {total_tokens:,}")
+    print(f"Total Cost: ${total_cost:.6f}")
+    print(f"Average Cost per Request: ${total_cost / aggregate.usage_count:.6f}")
+    
+    # Incremental state can span runs with different --model
+    if len(aggregate.tokens_by_model) > 1:
+        print_cost_groups({
+            name: {
+                "requests": requests,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "total_cost": price_token_totals(prompt, completion, name)
+            }
+            for name, (requests, prompt, completion) in aggregate.tokens_by_model.items()
+        }, "Model")
+    
+    # Per-request breakdown (if <= 20 requests)
+    if aggregate.usage_count <= BREAKDOWN_LIMIT:
+        print(f"\n{'=' * 70}")
+        print("Per-Request Breakdown")
+        print(f"{'=' * 70}")
+        columns = UsageColumns()
+        for usage in aggregate.sample_usages:
+            columns.append_usage(usage, model)
+        costs = columns.compute_costs()["total_cost"]
+        for i, (usage, cost) in enumerate(zip(aggregate.sample_usages, costs), 1):
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+            total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
+            print(f"\nRequest {i}:")
+            print(f"  Tokens: {total_tokens} (prompt: {prompt_tokens}, completion: {completion_tokens})")
+            print(f"  Cost: ${cost:.6f}")
 
 def analyze_docker_logs(container_name: str = "mlflow-gateway", model: str = "gpt-3.5-turbo", tail: int = 1000, show_stats: bool = True):
     """Phân tích costs từ Docker logs"""
@@ -74,189 +340,417 @@ def analyze_docker_logs(container_name: str = "mlflow-gateway", model: str = "gp
     print("=" * 70)
     
     try:
-        result = subprocess.run(
-            ["docker", "logs", container_name, "--tail", str(tail)],
-            capture_output=True,
-            text=True,
-            timeout=15
-        )
-        
-        if result.returncode != 0:
-            print(f"✗ Error getting logs: {result.stderr}")
+        aggregate = scan_log_lines(iter_docker_log_lines(container_name, tail), model)
+    except LogSourceError as e:
+        print(f"✗ Error getting logs: {e}")
+        return
+    except FileNotFoundError:
+        print("✗ Error: Docker not found")
+        return
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    report_log_aggregate(aggregate, model, show_stats)
+
+def analyze_log_file(file_path: str, model: str = "gpt-3.5-turbo", show_stats: bool = True):
+    """Phân tích costs từ log file (vd. output của `docker compose logs`)"""
+    print("=" * 70)
+    print("MLflow Gateway Cost Analysis")
+    print(f"Log file: {file_path}")
+    print(f"Model: {model}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+    
+    try:
+        aggregate = scan_log_lines(iter_file_lines(file_path), model)
+    except FileNotFoundError:
+        print(f"✗ File not found: {file_path}")
+        return
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+    
+    report_log_aggregate(aggregate, model, show_stats)
+
+def list_containers_by_label(label: str) -> List[str]:
+    """Tên các container đang chạy có label (vd. com.docker.compose.service=mlflow-gateway)"""
+    result = subprocess.run(
+        ["docker", "ps", "--filter", f"label={label}", "--format", "{{.Names}}"],
+        capture_output=True,
+        text=True,
+        timeout=15
+    )
+    if result.returncode != 0:
+        raise LogSourceError(result.stderr.strip() or f"docker ps exited with code {result.returncode}")
+    return sorted(name for name in result.stdout.split() if name)
+
+def _scan_container_worker(container_name: str, model: str, tail: int) -> Dict[str, Any]:
+    """Chạy trong worker process: đọc và phân tích logs của một container"""
+    try:
+        aggregate = scan_log_lines(iter_docker_log_lines(container_name, tail), model)
+        return {"container": container_name, "aggregate": aggregate.to_dict()}
+    except FileNotFoundError:
+        return {"container": container_name, "error": "Docker not found"}
+    except Exception as e:
+        return {"container": container_name, "error": str(e)}
+
+def analyze_containers(containers: List[str], model: str = "gpt-3.5-turbo", tail: int = 1000,
+                       show_stats: bool = True, workers: int = None):
+    """Phân tích logs của nhiều gateway replicas song song, gộp kết quả và so sánh giữa các replicas"""
+    print("=" * 70)
+    print("MLflow Gateway Cost Analysis (multi-container)")
+    print(f"Containers: {', '.join(containers)}")
+    print(f"Model: {model}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    workers = workers or min(len(containers), os.cpu_count() or 1)
+    # Parsing is CPU-bound, so use processes rather than threads to scan replicas in parallel
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(_scan_container_worker, containers,
+                                 [model] * len(containers), [tail] * len(containers)))
+
+    merged = LogAggregate()
+    replicas = []
+    for outcome in outcomes:
+        if "error" in outcome:
+            print(f"✗ {outcome['container']}: {outcome['error']}")
+            continue
+        aggregate = LogAggregate.from_dict(outcome["aggregate"])
+        replicas.append((outcome["container"], aggregate))
+        merged.merge(aggregate)
+
+    if not replicas:
+        print("\n✗ No container logs could be read")
+        return
+
+    total_requests = sum(agg.api_requests or agg.usage_count for _, agg in replicas)
+    print(f"\n{'=' * 70}")
+    print("Per-Replica Breakdown")
+    print(f"{'=' * 70}")
+    print(f"{'Container':<32} {'Lines':>9} {'API Req':>8} {'Usage':>7} {'Tokens':>10} {'Cost':>11} {'Share':>6}")
+    for name, agg in replicas:
+        requests_count = agg.api_requests or agg.usage_count
+        share = f"{requests_count / total_requests * 100:.1f}%" if total_requests else "-"
+        print(f"{name[:32]:<32} {agg.total_lines:>9,} {agg.api_requests:>8,} {agg.usage_count:>7,} "
+              f"{agg.prompt_tokens + agg.completion_tokens:>10,} {'$' + format(agg.total_cost, '.6f'):>11} {share:>6}")
+        if agg.error_types:
+            errors = ", ".join(f"{error_type}: {count}" for error_type, count in agg.error_types.items())
+            print(f"{'':<32} errors: {errors}")
+
+    counts = [agg.api_requests or agg.usage_count for _, agg in replicas]
+    if len(replicas) > 1 and min(counts) > 0:
+        imbalance = max(counts) / min(counts)
+        print(f"\nLoad imbalance (max/min requests): {imbalance:.2f}x")
+        if imbalance > 1.5:
+            print("⚠ Requests are unevenly spread across replicas")
+    elif len(replicas) > 1 and max(counts) > 0:
+        print("\n⚠ Some replicas received no requests")
+
+    print("\nAll replicas:")
+    report_log_aggregate(merged, model, show_stats)
+
+# Incremental mode: checkpoint + running aggregates per log source
+STATE_FILE = os.getenv("ANALYZE_STATE_FILE", "analyze_costs_state.json")
+STATE_VERSION = 1
+
+def load_state(state_file: str) -> Dict[str, Any]:
+    """Đọc state file của incremental mode (checkpoint và aggregate theo từng source)"""
+    if not os.path.exists(state_file):
+        return {"version": STATE_VERSION, "sources": {}}
+    with open(state_file, "r") as f:
+        state = json.load(f)
+    if state.get("version") != STATE_VERSION:
+        raise ValueError(f"Unsupported state file version: {state.get('version')}")
+    return state
+
+def save_state(state: Dict[str, Any], state_file: str):
+    """Ghi state file atomically để cron job bị kill giữa chừng không làm hỏng state"""
+    state["updated_at"] = datetime.now().isoformat()
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+def normalize_docker_timestamp(timestamp: str) -> str:
+    """Chuẩn hóa RFC3339Nano của docker (phần lẻ 9 chữ số) để so sánh được dạng string"""
+    if "." not in timestamp:
+        return timestamp.replace("Z", ".000000000Z")
+    seconds, fraction = timestamp.split(".", 1)
+    digits = fraction.rstrip("Z")
+    return f"{seconds}.{digits[:9].ljust(9, '0')}Z"
+
+def iter_new_docker_lines(container_name: str, checkpoint: Dict[str, Any]) -> Iterator[str]:
+    """Chỉ đọc các dòng mới hơn checkpoint["last_timestamp"] và cập nhật checkpoint theo từng dòng"""
+    last_timestamp = checkpoint.get("last_timestamp")
+    # First run reads everything docker still has so the running totals start complete
+    lines = iter_docker_log_lines(container_name, tail="all", since=last_timestamp, timestamps=True)
+    for line in lines:
+        timestamp, _, message = line.partition(" ")
+        timestamp = normalize_docker_timestamp(timestamp)
+        # --since is inclusive; skip lines already counted at the checkpoint timestamp
+        if last_timestamp and timestamp <= last_timestamp:
+            continue
+        checkpoint["last_timestamp"] = timestamp
+        yield message
+
+def iter_new_file_lines(file_path: str, checkpoint: Dict[str, Any]) -> Iterator[str]:
+    """Đọc file từ byte offset đã lưu; bắt đầu lại từ đầu nếu file bị rotate hoặc truncate"""
+    stat = os.stat(file_path)
+    offset = checkpoint.get("offset", 0)
+    if checkpoint.get("inode") != stat.st_ino or stat.st_size < offset:
+        offset = 0
+    checkpoint["inode"] = stat.st_ino
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                # Line still being written; pick it up on the next run
+                break
+            offset += len(raw_line)
+            checkpoint["offset"] = offset
+            yield raw_line.decode("utf-8", errors="replace").rstrip("\n")
+
+def analyze_incremental(container_name: str = "mlflow-gateway", model: str = "gpt-3.5-turbo",
+                        state_file: str = STATE_FILE, log_file: str = None, show_stats: bool = True):
+    """Chỉ phân tích dòng log mới kể từ lần chạy trước và cộng vào running totals trong state file;
+    container_name có thể là danh sách replicas (phân cách bằng dấu phẩy), mỗi container một checkpoint"""
+    if log_file:
+        sources = [(f"file:{os.path.abspath(log_file)}", None)]
+    else:
+        sources = [(f"container:{name}", name) for name in container_name.split(",") if name]
+    print("=" * 70)
+    print("MLflow Gateway Cost Analysis (incremental)")
+    print(f"Source: {', '.join(source for source, _ in sources)}")
+    print(f"State file: {state_file}")
+    print(f"Model: {model}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    try:
+        state = load_state(state_file)
+    except (ValueError, OSError) as e:
+        print(f"✗ Error reading state file: {e}")
+        return
+
+    totals = LogAggregate()
+    new_lines = new_usages = 0
+    for source, container in sources:
+        entry = state["sources"].get(source, {"checkpoint": {}, "aggregate": {}})
+        checkpoint = dict(entry["checkpoint"])
+        if container is None:
+            lines = iter_new_file_lines(log_file, checkpoint)
+        else:
+            lines = iter_new_docker_lines(container, checkpoint)
+
+        try:
+            new = scan_log_lines(lines, model)
+        except LogSourceError as e:
+            print(f"✗ Error getting logs ({source}): {e}")
             return
-        
-        logs = result.stdout
-        usages = []
-        request_stats = {
-            "total_lines": len(logs.split('\n')),
-            "has_requests": False,
-            "has_errors": False,
-            "error_types": defaultdict(int)
-        }
-        
-        # Parse logs
-        for line in logs.split('\n'):
-            # Check for access log format (gunicorn/nginx)
-            # Gunicorn access log: IP - - [timestamp] "METHOD /path HTTP/1.1" status bytes
-            # Nginx access log: IP - user [timestamp] "request" status bytes
-            if re.search(r'^\d+\.\d+\.\d+\.\d+.*"([A-Z]+|GET|POST|PUT|DELETE).*"', line):
-                request_stats["has_requests"] = True
-                # Try to extract request details
-                method_match = re.search(r'"([A-Z]+)\s+([^\s]+)', line)
-                status_match = re.search(r'"\s+(\d{3})\s+', line)
-                if method_match:
-                    method = method_match.group(1)
-                    path = method_match.group(2)
-                    if '/gateway/chat/invocations' in path or '/invocations' in path:
-                        request_stats["api_requests"] = request_stats.get("api_requests", 0) + 1
-                        if status_match:
-                            status = int(status_match.group(1))
-                            if status == 200:
-                                request_stats["successful_requests"] = request_stats.get("successful_requests", 0) + 1
-                            elif status >= 400:
-                                request_stats["failed_requests"] = request_stats.get("failed_requests", 0) + 1
-            
-            # Check for request indicators (MLflow Gateway may not log these, but check anyway)
-            elif any(kw in line.lower() for kw in ['invocations', 'post', 'gateway/chat', 'request', 'http', 'uvicorn', 'gunicorn']):
-                # More lenient check - uvicorn/gunicorn logs indicate server is handling requests
-                if 'uvicorn' in line.lower() or 'gunicorn' in line.lower():
-                    # Server logs indicate it's running, but not necessarily requests
-                    pass
-                else:
-                    request_stats["has_requests"] = True
-            
-            # Check for errors
-            if any(kw in line.lower() for kw in ['error', 'failed', 'exception', 'quota', 'exceeded', '401', '429', '500']):
-                request_stats["has_errors"] = True
-                if "quota" in line.lower() or "exceeded" in line.lower():
-                    request_stats["error_types"]["quota_exceeded"] += 1
-                elif "401" in line or "unauthorized" in line.lower():
-                    request_stats["error_types"]["unauthorized"] += 1
-                elif "429" in line or "rate limit" in line.lower():
-                    request_stats["error_types"]["rate_limit"] += 1
-            
-            # Parse usage data
-            if any(kw in line.lower() for kw in ['usage', 'token', 'prompt_tokens', 'completion_tokens']):
-                data = parse_log_line(line)
-                if data:
-                    usage = extract_usage_from_response(data)
-                    if usage:
-                        usages.append(usage)
-                else:
-                    # Regex fallback
-                    prompt_match = re.search(r'["\']?prompt_tokens["\']?\s*[:=]\s*(\d+)', line, re.IGNORECASE)
-                    completion_match = re.search(r'["\']?completion_tokens["\']?\s*[:=]\s*(\d+)', line, re.IGNORECASE)
-                    
-                    if prompt_match or completion_match:
-                        usage_data = {
-                            "prompt_tokens": int(prompt_match.group(1)) if prompt_match else 0,
-                            "completion_tokens": int(completion_match.group(1)) if completion_match else 0
-                        }
-                        usage_data["total_tokens"] = usage_data["prompt_tokens"] + usage_data["completion_tokens"]
-                        if usage_data["total_tokens"] > 0:
-                            usages.append(usage_data)
-        
-        # Show request statistics even if no usage data
-        if show_stats and not usages:
-            print("\n" + "=" * 70)
-            print("Request Statistics")
-            print("=" * 70)
-            if request_stats["has_requests"]:
-                print("✓ Gateway has received requests (detected in logs)")
-                if "api_requests" in request_stats:
-                    print(f"  API Requests: {request_stats['api_requests']}")
-                    if "successful_requests" in request_stats:
-                        print(f"  Successful: {request_stats['successful_requests']}")
-                    if "failed_requests" in request_stats:
-                        print(f"  Failed: {request_stats['failed_requests']}")
-            else:
-                print("⚠ No requests detected in logs")
-                print("  Note: If access logging is enabled, requests should appear here")
-                print("  If you ran evaluate_gateway.py, check for gateway_results.json file")
-            
-            if request_stats["has_errors"]:
-                print(f"\n⚠ Errors detected in logs:")
-                for error_type, count in request_stats["error_types"].items():
-                    print(f"  - {error_type}: {count} occurrence(s)")
-                
-                if "quota_exceeded" in request_stats["error_types"]:
-                    print("\n💡 Quota Exceeded Error:")
-                    print("  This means your OpenAI API key has reached its usage limit.")
-                    print("  Solutions:")
-                    print("    1. Check billing: https://platform.openai.com/account/billing")
-                    print("    2. Add payment method if needed")
-                    print("    3. Wait for quota reset (usually monthly)")
-                    print("    4. Use a different API key with available quota")
-                    print("\n  Note: Gateway is working correctly. The issue is with OpenAI API access.")
-            
-            print("\n⚠ No usage data found in logs.")
-            print("Note: MLflow Gateway doesn't log request details to stdout.")
-            print("Usage data only appears after successful API calls with valid responses.")
-            
-            # Auto-detect and suggest results file
-            import os
-            results_files = ["gateway_results.json", "results.json"]
-            found_file = None
-            for rf in results_files:
-                if os.path.exists(rf):
-                    found_file = rf
-                    break
-            
-            if found_file:
-                print(f"\n💡 Found results file: {found_file}")
-                print(f"  Analyzing from results file instead...")
-                print("")
-                # Auto-analyze from results file
-                analyze_response_file(found_file, model)
-                return
-            else:
-                print("\nTo get usage data:")
-                print("  1. Ensure your OpenAI API key has available quota")
-                print("  2. Run evaluation: python3 evaluate_gateway.py")
-                print("  3. Then analyze from results file:")
-                print("     python3 analyze_costs.py --response-file gateway_results.json")
+        except FileNotFoundError:
+            print(f"✗ File not found: {log_file}" if container is None else "✗ Error: Docker not found")
             return
-        
-        # Calculate costs
-        total_prompt = sum(u.get("prompt_tokens", 0) for u in usages)
-        total_completion = sum(u.get("completion_tokens", 0) for u in usages)
-        total_tokens = total_prompt + total_completion
-        total_cost = sum(calculate_cost(u, model)["total_cost"] for u in usages)
-        
-        print(f"\n{'=' * 70}")
-        print("Cost Summary")
-        print(f"{'=' * 70}")
-        print(f"Total Requests: {len(usages)}")
-        print(f"Total Prompt Tokens: {total_prompt:,}")
-        print(f"Total Completion Tokens: {total_completion:,}")
-        print(f"Total Tokens: {total_tokens:,}")
-        print(f"Total Cost: ${total_cost:.6f}")
-        print(f"Average Cost per Request: ${total_cost / len(usages):.6f}")
-        
-        # Per-request breakdown (if <= 20 requests)
-        if len(usages) <= 20:
-            print(f"\n{'=' * 70}")
-            print("Per-Request Breakdown")
-            print(f"{'=' * 70}")
-            for i, usage in enumerate(usages, 1):
-                cost = calculate_cost(usage, model)
-                print(f"\nRequest {i}:")
-                print(f"  Tokens: {cost['total_tokens']} (prompt: {cost['prompt_tokens']}, completion: {cost['completion_tokens']})")
-                print(f"  Cost: ${cost['total_cost']:.6f}")
-        
-    except subprocess.TimeoutExpired:
-        print("✗ Error: Timeout getting logs")
+        except Exception as e:
+            print(f"✗ Error ({source}): {e}")
+            return
+
+        aggregate = LogAggregate.from_dict(entry["aggregate"])
+        aggregate.merge(new)
+        state["sources"][source] = {"checkpoint": checkpoint, "aggregate": aggregate.to_dict()}
+        # Saved after each source, so a failure on a later replica keeps the earlier checkpoints
+        save_state(state, state_file)
+        totals.merge(aggregate)
+        new_lines += new.total_lines
+        new_usages += new.usage_count
+
+        if len(sources) > 1:
+            print(f"{source}: {new.total_lines:,} new line(s), {new.usage_count} new request(s) with usage")
+        if checkpoint.get("last_timestamp"):
+            print(f"Checkpoint ({source}): {checkpoint['last_timestamp']}")
+        elif "offset" in checkpoint:
+            print(f"Checkpoint ({source}): byte offset {checkpoint['offset']:,}")
+
+    print(f"New lines: {new_lines:,} (new requests with usage: {new_usages})")
+    print("\nRunning totals:")
+    report_log_aggregate(totals, model, show_stats)
+
+# Default container name of the nginx load balancer (docker-compose.prod.yml)
+NGINX_CONTAINER = "mlflow-gateway-nginx"
+# Only the busiest path/status groups are printed
+NGINX_GROUP_LIMIT = 20
+NGINX_TIMINGS = [
+    ("rt", "Request time (rt)"),
+    ("uct", "Upstream connect (uct)"),
+    ("uht", "Upstream header (uht)"),
+    ("urt", "Upstream response (urt)"),
+    ("overhead", "Nginx overhead (rt - urt)")
+]
+
+class NginxTimingGroup:
+    """Latency histograms của một nhóm requests (theo path/status)"""
+
+    def __init__(self):
+        self.count = 0
+        self.no_upstream = 0
+        self.histograms = {name: LatencyHistogram() for name, _ in NGINX_TIMINGS}
+
+    def add(self, record: NginxRecord):
+        self.count += 1
+        self.histograms["rt"].record(record.request_time)
+        if record.upstream_connect_time is not None:
+            self.histograms["uct"].record(record.upstream_connect_time)
+        if record.upstream_header_time is not None:
+            self.histograms["uht"].record(record.upstream_header_time)
+        if record.upstream_response_time is None:
+            # Answered by nginx itself (e.g. 502 with every upstream down)
+            self.no_upstream += 1
+            return
+        self.histograms["urt"].record(record.upstream_response_time)
+        self.histograms["overhead"].record(max(0.0, record.request_time - record.upstream_response_time))
+
+class NginxAggregate:
+    """Upstream timing metrics từ nginx access log, cộng dồn từng dòng"""
+
+    def __init__(self):
+        self.total_lines = 0
+        self.parsed_lines = 0
+        self.overall = NginxTimingGroup()
+        self.groups = {}
+
+    def add(self, record: NginxRecord):
+        self.parsed_lines += 1
+        self.overall.add(record)
+        key = (record.path, record.status)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = NginxTimingGroup()
+        group.add(record)
+
+def scan_nginx_lines(lines: Iterable[str], aggregate: NginxAggregate = None) -> NginxAggregate:
+    """Parse nginx access log (format `detailed`) từng dòng"""
+    if aggregate is None:
+        aggregate = NginxAggregate()
+    for line in lines:
+        aggregate.total_lines += 1
+        record = parse_nginx_line(line)
+        if record is not None:
+            aggregate.add(record)
+    return aggregate
+
+def _format_ms(value: float) -> str:
+    return f"{value * 1000:.1f}ms" if value is not None else "-"
+
+def _print_timing_group(group: NginxTimingGroup):
+    for name, label in NGINX_TIMINGS:
+        histogram = group.histograms[name]
+        if not histogram.count:
+            continue
+        print(f"  {label:<27} p50 {_format_ms(histogram.percentile(50)):>9}  "
+              f"p90 {_format_ms(histogram.percentile(90)):>9}  "
+              f"p99 {_format_ms(histogram.percentile(99)):>9}  "
+              f"max {_format_ms(histogram.max):>9}")
+    if group.no_upstream:
+        print(f"  No upstream: {group.no_upstream} request(s) answered by nginx")
+
+def report_nginx_aggregate(aggregate: NginxAggregate):
+    """In upstream timing percentiles tổng và theo path/status"""
+    print(f"\n{'=' * 70}")
+    print("Nginx Upstream Timing")
+    print(f"{'=' * 70}")
+    print(f"Lines analyzed: {aggregate.total_lines:,}")
+    print(f"Access log entries: {aggregate.parsed_lines:,}")
+    if not aggregate.parsed_lines:
+        print("\n⚠ No nginx `detailed` access log lines found")
+        print("  Check that nginx.conf uses: access_log /dev/stdout detailed;")
+        print(f"  and that you are reading the nginx container (default: {NGINX_CONTAINER})")
+        return
+
+    print("\nAll requests:")
+    _print_timing_group(aggregate.overall)
+
+    groups = sorted(aggregate.groups.items(), key=lambda item: item[1].count, reverse=True)
+    print(f"\n{'=' * 70}")
+    print("By Path and Status")
+    print(f"{'=' * 70}")
+    for (path, status), group in groups[:NGINX_GROUP_LIMIT]:
+        print(f"\n{path}  [{status}]  {group.count:,} request(s)")
+        _print_timing_group(group)
+    if len(groups) > NGINX_GROUP_LIMIT:
+        print(f"\n... {len(groups) - NGINX_GROUP_LIMIT} more path/status group(s) not shown")
+
+    print("\nReading the numbers:")
+    print("  - High uct: slow TCP connect to gateway workers (worker backlog or no keepalive reuse)")
+    print("  - High uht with urt close to uht: time spent in the gateway/provider before responding")
+    print("  - High overhead (rt - urt): time spent in nginx itself (client I/O, proxy queueing)")
+
+def analyze_nginx_logs(container_name: str = NGINX_CONTAINER, tail: int = 1000, log_file: str = None):
+    """Phân tích upstream timing từ nginx access log (file, hoặc một/nhiều containers phân cách bằng dấu phẩy)"""
+    print("=" * 70)
+    print("MLflow Gateway Nginx Timing Analysis")
+    if log_file:
+        print(f"Log file: {log_file}")
+    else:
+        print(f"Container: {container_name}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    if log_file:
+        sources = [iter_file_lines(log_file)]
+    else:
+        sources = [iter_docker_log_lines(name, tail) for name in container_name.split(",") if name]
+    aggregate = NginxAggregate()
+    try:
+        # Generators: each container's logs are only read when its turn comes
+        for lines in sources:
+            scan_nginx_lines(lines, aggregate)
+    except LogSourceError as e:
+        print(f"✗ Error getting logs: {e}")
+        return
     except FileNotFoundError:
-        print("✗ Error: Docker not found")
+        print(f"✗ File not found: {log_file}" if log_file else "✗ Error: Docker not found")
+        return
     except Exception as e:
         print(f"✗ Error: {e}")
+        return
+
+    report_nginx_aggregate(aggregate)
 
-def analyze_response_file(file_path: str, model: str = "gpt-3.5-turbo"):
-    """Phân tích costs từ response file (JSON)"""
+def print_cost_groups(groups: Dict[str, Dict[str, Any]], title: str):
+    """In bảng requests/tokens/cost theo nhóm (model hoặc endpoint)"""
+    print(f"\n{'=' * 70}")
+    print(f"Cost by {title}")
+    print(f"{'=' * 70}")
+    print(f"{title:<24} {'Requests':>9} {'Prompt':>10} {'Completion':>11} {'Cost':>11}")
+    for name, group in sorted(groups.items(), key=lambda item: -item[1]["total_cost"]):
+        print(f"{name:<24} {group['requests']:>9,} {group['prompt_tokens']:>10,} {group['completion_tokens']:>11,} "
+              f"{'$' + format(group['total_cost'], '.6f'):>11}")
+
+def print_latency_groups(groups: Dict[str, Dict[str, Any]], title: str):
+    """In latency percentiles và số requests lỗi theo nhóm ({name: {"histogram", "failed"}})"""
+    print(f"\n{'=' * 70}")
+    print(f"Latency by {title}")
+    print(f"{'=' * 70}")
+    print(f"{title:<24} {'OK':>7} {'Failed':>7} {'p50':>9} {'p90':>9} {'p99':>9}")
+    for name, group in sorted(groups.items()):
+        summary = group["histogram"].summary()
+        percentiles = " ".join(f"{_format_ms(summary[key]) if summary['count'] else '-':>9}"
+                               for key in ("p50", "p90", "p99"))
+        print(f"{name:<24} {summary['count']:>7,} {group['failed']:>7,} {percentiles}")
+
+def analyze_response_file(file_path: str, model: str = None):
+    """Phân tích costs từ response file (JSON); model=None thì tính giá theo model trong từng response"""
     try:
         with open(file_path, 'r') as f:
             data = json.load(f)
         
+        endpoint_latency = {}
+        columns = UsageColumns()
+        saved = UsageColumns()
+        cache_hits = 0
+        coalesced = 0
+        
         # Handle evaluate_gateway.py output format
         if isinstance(data, dict) and "results" in data:
             # This is from evaluate_gateway.py
@@ -279,15 +773,30 @@ def analyze_response_file(file_path: str, model: str = "gpt-3.5-turbo"):
                 print("  - Network connectivity issues")
             
             # Extract usages from results
-            usages = []
             for result in results:
-                if isinstance(result, dict):
-                    if result.get("success") and "usage" in result:
-                        usages.append(result["usage"])
-                    elif result.get("success") and "response" in result:
-                        usage = extract_usage_from_response(result["response"])
-                        if usage:
-                            usages.append(usage)
+                if isinstance(result, dict) and result.get("success"):
+                    response = result.get("response") if isinstance(result.get("response"), dict) else {}
+                    usage = result["usage"] if "usage" in result else extract_usage_from_response(response)
+                    if not usage:
+                        continue
+                    # Same rule as the request log: cache hits and coalesced followers cost nothing upstream
+                    free = result.get("cache") in CACHE_HIT_VALUES or result.get("coalesced")
+                    if result.get("cache") in CACHE_HIT_VALUES:
+                        cache_hits += 1
+                    elif result.get("coalesced"):
+                        coalesced += 1
+                    (saved if free else columns).append_usage(
+                        usage, model or response.get("model") or DEFAULT_MODEL,
+                        result.get("endpoint") or endpoint_name(result.get("path", "")))
+            
+            # Latency per endpoint (per backend when requests went through a proxy route)
+            for result in results:
+                if isinstance(result, dict) and result.get("endpoint"):
+                    group = endpoint_latency.setdefault(result["endpoint"], {"histogram": LatencyHistogram(), "failed": 0})
+                    if result.get("success") and result.get("response_time"):
+                        group["histogram"].record(result["response_time"])
+                    elif not result.get("success"):
+                        group["failed"] += 1
         else:
             # Handle other formats
             if isinstance(data, list):
@@ -297,14 +806,13 @@ def analyze_response_file(file_path: str, model: str = "gpt-3.5-turbo"):
             else:
                 responses = [data]
             
-            usages = []
             for response in responses:
                 if isinstance(response, dict):
                     usage = extract_usage_from_response(response)
                     if usage:
-                        usages.append(usage)
+                        columns.append_usage(usage, model or response.get("model") or DEFAULT_MODEL)
         
-        if not usages:
+        if not len(columns) and not len(saved):
             print("\n⚠ No usage data found in file")
             print("Usage data only appears in successful API responses.")
             print("\nTo get usage data:")
@@ -313,22 +821,31 @@ def analyze_response_file(file_path: str, model: str = "gpt-3.5-turbo"):
             print("  3. Check the results file for successful requests")
             return
         
-        # Calculate and display
-        total_prompt = sum(u.get("prompt_tokens", 0) for u in usages)
-        total_completion = sum(u.get("completion_tokens", 0) for u in usages)
-        total_tokens = total_prompt + total_completion
-        total_cost = sum(calculate_cost(u, model)["total_cost"] for u in usages)
+        # Calculate and display (priced once for the whole batch)
+        totals = columns.totals()
+        total_cost = totals["total_cost"]
         
         print("=" * 70)
         print("Cost Analysis from Response File")
         print("=" * 70)
-        print(f"Total Requests: {len(usages)}")
-        print(f"Total Prompt Tokens: {total_prompt:,}")
-        print(f"Total Completion Tokens: {total_completion:,}")
-        print(f"Total Tokens: {total_tokens:,}")
+        print(f"Billed Requests: {totals['requests']}")
+        print(f"Total Prompt Tokens: {totals['prompt_tokens']:,}")
+        print(f"Total Completion Tokens: {totals['completion_tokens']:,}")
+        print(f"Total Tokens: {totals['total_tokens']:,}")
         print(f"Total Cost: ${total_cost:.6f}")
-        if len(usages) > 0:
-            print(f"Average Cost per Request: ${total_cost / len(usages):.6f}")
+        if totals["requests"]:
+            print(f"Average Cost per Request: ${total_cost / totals['requests']:.6f}")
+        if len(saved):
+            saved_totals = saved.totals()
+            print(f"Served without upstream call: {saved_totals['requests']:,} "
+                  f"(cache hits: {cache_hits:,}, coalesced: {coalesced:,}), saved ${saved_totals['total_cost']:.6f}")
+        
+        for column, title in (("model", "Model"), ("endpoint", "Endpoint")):
+            groups = columns.group_by(column)
+            if len(groups) > 1:
+                print_cost_groups(groups, title)
+        if len(endpoint_latency) > 1:
+            print_latency_groups(endpoint_latency, "Endpoint")
         
     except FileNotFoundError:
         print(f"✗ File not found: {file_path}")
@@ -339,29 +856,349 @@ def analyze_response_file(file_path: str, model: str = "gpt-3.5-turbo"):
     except Exception as e:
         print(f"✗ Error: {e}")
 
+# Default gateway_proxy.py request log on the mlflow-gateway-logs volume (./logs on the host)
+REQUEST_LOG_FILE = os.getenv("REQUEST_LOG_FILE", "logs/requests.jsonl")
+
+def analyze_request_log(file_path: str = REQUEST_LOG_FILE, model: str = None, since: str = None):
+    """Fast path: đọc request log JSON của gateway_proxy.py (kể cả file đã rotate), không cần regex/classifier"""
+    print("=" * 70)
+    print("MLflow Gateway Cost Analysis (request log)")
+    print(f"Request log: {file_path}")
+    if since:
+        print(f"Since: {since}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    billed = UsageColumns()
+    saved = UsageColumns()
+    endpoint_latency = {}
+    statuses = defaultdict(int)
+    total = 0
+    cache_hits = 0
+    coalesced = 0
+    usage_unknown = 0
+    try:
+        for record in iter_records(file_path):
+            # ISO timestamps compare correctly as strings
+            if since and record.get("ts", "") < since:
+                continue
+            total += 1
+            status = record.get("status") or 0
+            statuses[f"{status // 100}xx" if status else "no response"] += 1
+            endpoint = record.get("backend") or record.get("endpoint") or "other"
+            group = endpoint_latency.setdefault(endpoint, {"histogram": LatencyHistogram(), "failed": 0})
+            if status == 200:
+                group["histogram"].record(record.get("latency") or 0.0)
+            elif status >= 400 or not status:
+                group["failed"] += 1
+            if record.get("usage") == "unknown":
+                usage_unknown += 1
+            if "prompt_tokens" not in record:
+                continue
+            # Cache hits and coalesced followers never reached the provider: their tokens are savings, not spend
+            free = record.get("cache") in CACHE_HIT_VALUES or record.get("coalesced")
+            if record.get("cache") in CACHE_HIT_VALUES:
+                cache_hits += 1
+            elif record.get("coalesced"):
+                coalesced += 1
+            (saved if free else billed).append(record["prompt_tokens"], record.get("completion_tokens", 0),
+                                               model or record.get("model") or DEFAULT_MODEL, endpoint)
+    except FileNotFoundError:
+        print(f"✗ File not found: {file_path}")
+        print("  Start gateway_proxy.py with --request-log (or REQUEST_LOG_FILE) to write it")
+        return
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        return
+
+    print(f"Requests logged: {total:,}")
+    for status, count in sorted(statuses.items()):
+        print(f"  {status}: {count:,}")
+    if usage_unknown:
+        print(f"⚠ {usage_unknown:,} streamed requests without usage (not included in cost; "
+              f"send stream_options.include_usage to have it reported)")
+    if not len(billed) and not len(saved):
+        print("\n⚠ No usage data in request log")
+        return
+
+    totals = billed.totals()
+    print(f"\n{'=' * 70}")
+    print("Cost Summary")
+    print(f"{'=' * 70}")
+    print(f"Billed Requests: {totals['requests']:,}")
+    print(f"Total Prompt Tokens: {totals['prompt_tokens']:,}")
+    print(f"Total Completion Tokens: {totals['completion_tokens']:,}")
+    print(f"Total Tokens: {totals['total_tokens']:,}")
+    print(f"Total Cost: ${totals['total_cost']:.6f}")
+    if totals["requests"]:
+        print(f"Average Cost per Request: ${totals['total_cost'] / totals['requests']:.6f}")
+    if len(saved):
+        saved_totals = saved.totals()
+        print(f"Served without upstream call: {saved_totals['requests']:,} "
+              f"(cache hits: {cache_hits:,}, coalesced: {coalesced:,}), saved ${saved_totals['total_cost']:.6f}")
+
+    for column, title in (("model", "Model"), ("endpoint", "Endpoint")):
+        groups = billed.group_by(column)
+        if len(groups) > 1:
+            print_cost_groups(groups, title)
+    if endpoint_latency:
+        print_latency_groups(endpoint_latency, "Endpoint")
+
+def analyze_results_store(store_path: str, model: str = None, run: str = None, since: str = None):
+    """Phân tích từ results store (results_store.py): chỉ mmap các cột tokens/model/endpoint/latency"""
+    from results_store import ResultsStore, parse_since
+    print("=" * 70)
+    print("MLflow Gateway Cost Analysis (results store)")
+    print(f"Store: {store_path}")
+    if run:
+        print(f"Run: {run}")
+    if since:
+        print(f"Since: {since} UTC")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    if not os.path.exists(os.path.join(store_path, "meta.json")):
+        print(f"✗ No results store at {store_path}")
+        print("  Create one with: python3 results_store.py convert gateway_results.json --store " + store_path)
+        return
+    try:
+        store = ResultsStore(store_path)
+        since_ts = parse_since(since) if since else None
+        if run is not None and run not in store.runs():
+            print(f"✗ Unknown run '{run}'. Runs: {', '.join(store.runs())}")
+            return
+        data = store.select(("success", "latency", "endpoint"), run, since_ts)
+        columns = store.usage_columns(run, since_ts, model)
+    except (ValueError, OSError) as e:
+        print(f"✗ Error: {e}")
+        return
+
+    requests_total = len(data["success"])
+    successful = sum(1 for success in data["success"] if success)
+    print(f"Rows: {requests_total:,} (store total: {len(store):,}, runs: {len(store.runs())})")
+    print(f"Successful: {successful:,}")
+    print(f"Failed: {requests_total - successful:,}")
+
+    if len(columns):
+        totals = columns.totals()
+        print(f"\n{'=' * 70}")
+        print("Cost Summary")
+        print(f"{'=' * 70}")
+        print(f"Billed Requests: {totals['requests']:,}")
+        print(f"Total Prompt Tokens: {int(totals['prompt_tokens']):,}")
+        print(f"Total Completion Tokens: {int(totals['completion_tokens']):,}")
+        print(f"Total Tokens: {int(totals['total_tokens']):,}")
+        print(f"Total Cost: ${totals['total_cost']:.6f}")
+        print(f"Average Cost per Request: ${totals['total_cost'] / totals['requests']:.6f}")
+        for column, title in (("model", "Model"), ("endpoint", "Endpoint")):
+            groups = {name: group for name, group in columns.group_by(column).items() if group["requests"]}
+            if len(groups) > 1:
+                print_cost_groups(groups, title)
+    else:
+        print("\n⚠ No billed usage in the selected rows")
+
+    endpoints = store.decode("endpoint")
+    endpoint_latency = {}
+    for success, latency, endpoint in zip(data["success"], data["latency"], data["endpoint"]):
+        group = endpoint_latency.setdefault(endpoints[endpoint], {"histogram": LatencyHistogram(), "failed": 0})
+        if success:
+            group["histogram"].record(float(latency))
+        else:
+            group["failed"] += 1
+    if endpoint_latency:
+        print_latency_groups(endpoint_latency, "Endpoint")
+
+def load_proxy_stats(source: str) -> Dict[str, Any]:
+    """Stats của gateway_proxy.py: từ URL (/proxy/stats) hoặc stats file"""
+    if source.startswith(("http://", "https://")):
+        import urllib.request
+        with urllib.request.urlopen(source, timeout=10) as response:
+            data = json.load(response)
+    else:
+        with open(source, 'r') as f:
+            data = json.load(f)
+    return data if isinstance(data, dict) else {}
+
+def report_cache_stats(stats: Dict[str, Any], title: str = "Response Cache Savings"):
+    """In hit/miss và tokens, cost, latency tiết kiệm được nhờ response cache (hoặc semantic cache)"""
+    saved = {
+        name: {
+            "requests": hits,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_cost": price_token_totals(prompt, completion, name)
+        }
+        for name, (hits, prompt, completion) in stats.get("saved_by_model", {}).items()
+    }
+    hits = stats.get("hits", 0)
+    
+    print(f"\n{'=' * 70}")
+    print(title)
+    print(f"{'=' * 70}")
+    if "threshold" in stats:
+        mean = stats.get("mean_similarity")
+        print(f"Hits: {hits:,} (similarity >= {stats['threshold']:g}"
+              f"{f', mean {mean:.3f}' if mean is not None else ''})")
+        print(f"Misses: {stats.get('misses', 0):,} (near misses below threshold: {stats.get('near_misses', 0):,}, "
+              f"key terms differ: {stats.get('term_rejections', 0):,})")
+    else:
+        print(f"Hits: {hits:,} (memory: {stats.get('memory_hits', 0):,}, disk: {stats.get('disk_hits', 0):,})")
+        print(f"Misses: {stats.get('misses', 0):,}")
+    print(f"Hit Rate: {stats.get('hit_rate', 0.0) * 100:.1f}%")
+    print(f"Entries: {stats.get('entries', 0):,} ({stats.get('bytes', 0) / 1024 / 1024:.1f}MB), "
+          f"evictions: {stats.get('evictions', 0):,}, expirations: {stats.get('expirations', 0):,}")
+    print(f"Tokens Saved: {sum(g['prompt_tokens'] + g['completion_tokens'] for g in saved.values()):,}")
+    print(f"Cost Saved: ${sum(g['total_cost'] for g in saved.values()):.6f}")
+    if hits:
+        latency_saved = stats.get("latency_saved", 0.0)
+        print(f"Upstream Latency Saved: {latency_saved:.1f}s total, {latency_saved / hits * 1000:.0f}ms per hit")
+    if len(saved) > 1:
+        print_cost_groups(saved, "Model")
+
+def report_routing_stats(stats: Dict[str, Any]):
+    """In latency, lỗi và cost theo backend của mỗi logical route"""
+    for route, backends in stats.get("routes", {}).items():
+        print(f"\n{'=' * 70}")
+        print(f"Route /gateway/{route}/invocations")
+        print(f"{'=' * 70}")
+        print(f"{'Backend':<20} {'Requests':>9} {'Errors':>7} {'Quota':>6} {'EWMA':>9} {'p50':>9} {'p99':>9} {'Cost':>11}")
+        for backend in backends:
+            latency = backend.get("latency", {})
+            has_latency = latency.get("count", 0) > 0
+            state = " (cooldown)" if backend.get("cooling_down") else ""
+            print(f"{backend['endpoint']:<20} {backend['requests']:>9,} {backend['errors']:>7,} "
+                  f"{backend['quota_errors']:>6,} {_format_ms(backend.get('ewma_latency')):>9} "
+                  f"{_format_ms(latency['p50']) if has_latency else '-':>9} "
+                  f"{_format_ms(latency['p99']) if has_latency else '-':>9} "
+                  f"{'$' + format(backend.get('total_cost', 0.0), '.6f'):>11}{state}")
+
+def report_budget_stats(stats: Dict[str, Any]):
+    """In spend so với limit của mỗi rolling window, requests bị từ chối và độ chính xác của ước lượng"""
+    print(f"\n{'=' * 70}")
+    print("Spend Budget")
+    print(f"{'=' * 70}")
+    rejected = stats.get("rejected", {})
+    print(f"Allowed: {stats.get('allowed', 0):,}, rejected: {rejected.get('global', 0):,} (global), "
+          f"{rejected.get('client', 0):,} (per client)")
+    for window, data in stats.get("global", {}).items():
+        used = data["spent"] / data["limit"] * 100 if data["limit"] else 0.0
+        print(f"  Global per {window:<6} ${data['spent']:.6f} / ${data['limit']:g} ({used:.1f}%)")
+    if stats.get("settled"):
+        estimated, actual = stats.get("estimated_usd", 0.0), stats.get("actual_usd", 0.0)
+        # Estimates reserve max_tokens, so they should stay above the actual cost
+        ratio = f" ({estimated / actual:.2f}x actual)" if actual else ""
+        print(f"Settled requests: {stats['settled']:,}, estimated ${estimated:.6f}{ratio}, actual ${actual:.6f}")
+    top = stats.get("top_clients") or []
+    if top:
+        print(f"\n{'Client':<20} {'Window':<8} {'Spent':>12} {'Limit':>10}")
+        for client in top:
+            for window, data in client["windows"].items():
+                print(f"{client['client']:<20} {window:<8} {'$' + format(data['spent'], '.6f'):>12} "
+                      f"{'$' + format(data['limit'], 'g'):>10}")
+
+def report_proxy_stats(source: str, sections: Iterable[str] = ("cache", "semantic_cache", "budget", "routing")):
+    """Report từ stats của gateway_proxy.py: cache savings và/hoặc per-backend routing"""
+    try:
+        stats = load_proxy_stats(source)
+    except (OSError, ValueError) as e:
+        print(f"✗ Could not load proxy stats from {source}: {e}")
+        return
+    # Older stats files hold only the cache section
+    if "cache" not in stats and "hits" in stats:
+        stats = {"cache": stats}
+    for section in sections:
+        if not stats.get(section):
+            # The semantic cache and the budget are opt-in, so their absence is not worth a warning
+            if section not in ("semantic_cache", "budget"):
+                print(f"⚠ {section} is disabled in {source}")
+        elif section == "cache":
+            report_cache_stats(stats["cache"])
+        elif section == "semantic_cache":
+            report_cache_stats(stats["semantic_cache"], "Semantic Cache Savings")
+        elif section == "budget":
+            report_budget_stats(stats["budget"])
+        elif section == "routing":
+            report_routing_stats(stats["routing"])
+
 def main():
     import argparse
     
     parser = argparse.ArgumentParser(description="Analyze MLflow Gateway costs")
-    parser.add_argument("--container", default="mlflow-gateway", help="Docker container name")
-    parser.add_argument("--model", default="gpt-3.5-turbo", help="Model for pricing")
+    parser.add_argument("--container",
+                        help="Docker container name, or comma-separated list of replicas "
+                             "(default: mlflow-gateway, or mlflow-gateway-nginx with --nginx)")
+    parser.add_argument("--label", help="Analyze all running containers with this label, "
+                                        "e.g. com.docker.compose.service=mlflow-gateway")
+    parser.add_argument("--workers", type=int, help="Worker processes for multi-container analysis")
+    parser.add_argument("--model", help="Model for pricing (default: gpt-3.5-turbo; "
+                                        "--response-file uses each response's model)")
     parser.add_argument("--log-file", help="Path to log file")
     parser.add_argument("--response-file", help="Path to response JSON file (from evaluate_gateway.py)")
+    parser.add_argument("--request-log", nargs="?", const=REQUEST_LOG_FILE,
+                        help=f"gateway_proxy.py JSON request log, including rotated files (default: {REQUEST_LOG_FILE})")
+    parser.add_argument("--store", help="Columnar results store directory (results_store.py)")
+    parser.add_argument("--run", help="With --store: only this run label")
+    parser.add_argument("--since", help="With --request-log/--store: only requests at or after this UTC time, "
+                                        "e.g. 2024-06-01 or 2024-06-01T12:00")
     parser.add_argument("--tail", type=int, default=1000, help="Number of log lines to analyze")
     parser.add_argument("--no-stats", action="store_true", help="Don't show request statistics when no usage data")
+    parser.add_argument("--nginx", action="store_true",
+                        help="Parse nginx `detailed` access log and report upstream timing percentiles")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only analyze lines added since the last run and keep running totals in --state-file")
+    parser.add_argument("--state-file", default=STATE_FILE, help="State file for --incremental")
+    parser.add_argument("--cache-stats",
+                        help="gateway_proxy.py stats file or URL (e.g. http://localhost:5100/proxy/stats) "
+                             "to report response (and semantic) cache savings")
+    parser.add_argument("--proxy-stats",
+                        help="gateway_proxy.py stats file or URL: cache savings, spend budget, plus per-backend "
+                             "latency and cost of routed requests")
     
     args = parser.parse_args()
+    model = args.model or DEFAULT_MODEL
     
-    if args.response_file:
+    proxy_source = args.proxy_stats or args.cache_stats
+    proxy_sections = ("cache", "semantic_cache", "budget", "routing") if args.proxy_stats else ("cache", "semantic_cache")
+    if proxy_source and not (args.nginx or args.incremental or args.response_file or args.log_file
+                                 or args.request_log or args.store or args.container or args.label):
+        report_proxy_stats(proxy_source, proxy_sections)
+        return
+    
+    if args.nginx:
+        analyze_nginx_logs(args.container or NGINX_CONTAINER, args.tail, args.log_file)
+    elif args.incremental:
+        analyze_incremental(args.container or "mlflow-gateway", model, args.state_file,
+                            args.log_file, show_stats=not args.no_stats)
+    elif args.store:
+        analyze_results_store(args.store, args.model, args.run, args.since)
+    elif args.request_log:
+        analyze_request_log(args.request_log, args.model, args.since)
+    elif args.response_file:
         analyze_response_file(args.response_file, args.model)
     elif args.log_file:
-        # Read from log file
-        with open(args.log_file, 'r') as f:
-            logs = f.read()
-        # Similar parsing logic...
-        print("Log file analysis not fully implemented. Use --container instead.")
+        analyze_log_file(args.log_file, model, show_stats=not args.no_stats)
     else:
-        analyze_docker_logs(args.container, args.model, args.tail, show_stats=not args.no_stats)
+        containers = [name for name in (args.container or "mlflow-gateway").split(",") if name]
+        if args.label:
+            try:
+                containers = list_containers_by_label(args.label)
+            except (LogSourceError, subprocess.TimeoutExpired) as e:
+                print(f"✗ Error listing containers: {e}")
+                sys.exit(1)
+            except FileNotFoundError:
+                print("✗ Error: Docker not found")
+                sys.exit(1)
+            if not containers:
+                print(f"✗ No running containers with label {args.label}")
+                sys.exit(1)
+        if len(containers) > 1 or args.label:
+            analyze_containers(containers, model, args.tail, show_stats=not args.no_stats, workers=args.workers)
+        else:
+            analyze_docker_logs(containers[0], model, args.tail, show_stats=not args.no_stats)
+    
+    if proxy_source:
+        report_proxy_stats(proxy_source, proxy_sections)
+    warn_unknown_models()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Replica Autoscaler
+Điều chỉnh số replicas của mlflow-gateway (docker compose up --scale) theo p95 latency và số requests in-flight,
+đọc từ /metrics của gateway_proxy.py hoặc nginx access log; hysteresis và cooldown để số replicas không dao động
+"""
+
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from latency_histogram import LatencyHistogram
+from log_classifier import parse_nginx_line
+
+# Configuration (CLI flags override these)
+AUTOSCALE_METRICS_URL = os.getenv("AUTOSCALE_METRICS_URL", "http://localhost:5100/metrics")
+AUTOSCALE_COMPOSE_FILE = os.getenv("AUTOSCALE_COMPOSE_FILE", "docker-compose.prod.yml")
+AUTOSCALE_SERVICE = os.getenv("AUTOSCALE_SERVICE", "mlflow-gateway")
+AUTOSCALE_MIN_REPLICAS = int(os.getenv("AUTOSCALE_MIN_REPLICAS", "1"))
+AUTOSCALE_MAX_REPLICAS = int(os.getenv("AUTOSCALE_MAX_REPLICAS", "6"))
+AUTOSCALE_INTERVAL = float(os.getenv("AUTOSCALE_INTERVAL", "15"))
+# Scale up when p95 (seconds) goes above this; scale down only well below it (SCALE_DOWN_RATIO)
+AUTOSCALE_TARGET_P95 = float(os.getenv("AUTOSCALE_TARGET_P95", "2.0"))
+# Average concurrent requests one replica (entrypoint.sh: --workers 4) should carry
+AUTOSCALE_TARGET_IN_FLIGHT = float(os.getenv("AUTOSCALE_TARGET_IN_FLIGHT", "8"))
+SCALE_DOWN_RATIO = 0.5
+# Consecutive samples that must agree before scaling (up reacts faster than down)
+UP_SAMPLES = 2
+DOWN_SAMPLES = 4
+# New replicas need ~40s (healthcheck start_period) before they help, so give them time to show up in p95
+UP_COOLDOWN = 60.0
+DOWN_COOLDOWN = 300.0
+MAX_STEP = 2
+NGINX_CONTAINER = "mlflow-gateway-nginx"
+# Only gateway traffic counts; health checks and scrapes are not load
+_IGNORED_PATHS = ("/health", "/metrics", "/proxy/stats")
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+class Sample(NamedTuple):
+    """Tải đo được trong một interval"""
+    interval: float
+    requests: int
+    p95: Optional[float]
+    # Average concurrency over the interval (Little's law: total request time / interval)
+    in_flight: float
+
+def parse_prometheus_text(text: str) -> List[Tuple[str, Dict[str, str], float]]:
+    """(name, labels, value) của mỗi sample trong text exposition format"""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        try:
+            number = float(value)
+        except ValueError:
+            continue
+        samples.append((name, dict(_LABEL_RE.findall(labels or "")), number))
+    return samples
+
+def bucket_percentile(buckets: List[Tuple[float, float]], p: float) -> Optional[float]:
+    """Percentile p (0-100) từ cumulative histogram buckets [(le, count)], nội suy tuyến tính trong bucket"""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = buckets[-1][1] * p / 100.0
+    lower, below = 0.0, 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if math.isinf(bound):
+                # Beyond the largest finite bucket: its bound is the best estimate available
+                return lower
+            width = cumulative - below
+            return lower + (bound - lower) * ((rank - below) / width if width else 1.0)
+        lower, below = bound, cumulative
+    return lower
+
+class MetricsSource:
+    """Delta giữa hai lần scrape /metrics của gateway_proxy.py (gateway_request_duration_seconds)"""
+
+    def __init__(self, url: str = AUTOSCALE_METRICS_URL, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.previous = None
+
+    def scrape(self) -> Tuple[float, Dict[float, float], float, float, float]:
+        """(time, cumulative buckets theo le, sum, count) của các gateway endpoints, và in-flight hiện tại"""
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        buckets: Dict[float, float] = {}
+        total = count = 0.0
+        in_flight = 0.0
+        for name, labels, value in parse_prometheus_text(response.text):
+            if name == "gateway_requests_in_flight":
+                # The scrape itself is one of the requests in flight
+                in_flight = max(0.0, value - 1)
+                continue
+            if not name.startswith("gateway_request_duration_seconds_"):
+                continue
+            if labels.get("endpoint") in ("health", "metrics", "proxy/stats", "other"):
+                continue
+            if name.endswith("_bucket"):
+                bound = float(labels["le"])
+                buckets[bound] = buckets.get(bound, 0.0) + value
+            elif name.endswith("_sum"):
+                total += value
+            elif name.endswith("_count"):
+                count += value
+        return time.time(), buckets, total, count, in_flight
+
+    def poll(self) -> Optional[Sample]:
+        """Sample kể từ lần poll trước (None ở lần đầu: chưa có baseline)"""
+        current = self.scrape()
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return None
+        interval = current[0] - previous[0]
+        # A proxy restart resets the counters; start over from the new baseline
+        if current[3] < previous[3]:
+            return None
+        delta = [(bound, count - previous[1].get(bound, 0.0)) for bound, count in sorted(current[1].items())]
+        # Durations only reach the histogram when requests finish, so requests longer than the interval
+        # would read as idle; the live gauge covers them
+        average = (current[2] - previous[2]) / interval if interval > 0 else 0.0
+        return Sample(interval, int(current[3] - previous[3]), bucket_percentile(delta, 95),
+                      max(average, current[4]))
+
+class NginxLogSource:
+    """Requests mới trong nginx access log (format `detailed`) từ container hoặc file, p95 của urt (hoặc rt)"""
+
+    def __init__(self, container: str = None, log_file: str = None, timing: str = "urt"):
+        self.container = container
+        self.log_file = log_file
+        self.timing = timing
+        # Start at the end: history says nothing about the current load
+        if log_file:
+            stat = os.stat(log_file)
+            self.checkpoint = {"inode": stat.st_ino, "offset": stat.st_size}
+        else:
+            now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+            self.checkpoint = {"last_timestamp": f"{now}.000000000Z"}
+        self.last_poll = None
+
+    def poll(self) -> Optional[Sample]:
+        """Sample từ các dòng mới kể từ lần poll trước (None ở lần đầu: chưa có baseline)"""
+        from analyze_costs import iter_new_docker_lines, iter_new_file_lines
+        lines = (iter_new_file_lines(self.log_file, self.checkpoint) if self.log_file
+                 else iter_new_docker_lines(self.container, self.checkpoint))
+        histogram = LatencyHistogram()
+        busy = 0.0
+        for line in lines:
+            record = parse_nginx_line(line)
+            if record is None or record.path in _IGNORED_PATHS:
+                continue
+            upstream = record.upstream_response_time
+            histogram.record(upstream if self.timing == "urt" and upstream is not None else record.request_time)
+            busy += record.request_time
+        now = time.time()
+        previous, self.last_poll = self.last_poll, now
+        if previous is None:
+            return None
+        interval = now - previous
+        return Sample(interval, histogram.count, histogram.percentile(95), busy / interval if interval > 0 else 0.0)
+
+class ScaleDecision(NamedTuple):
+    replicas: int
+    reason: str
+
+class ScalingPolicy:
+    """Quyết định số replicas: scale up khi p95 hoặc in-flight/replica vượt target, scale down khi cả hai thấp hơn
+    nhiều (SCALE_DOWN_RATIO); giữa hai ngưỡng thì giữ nguyên (hysteresis)"""
+
+    def __init__(self, min_replicas: int = AUTOSCALE_MIN_REPLICAS, max_replicas: int = AUTOSCALE_MAX_REPLICAS,
+                 target_p95: float = AUTOSCALE_TARGET_P95, target_in_flight: float = AUTOSCALE_TARGET_IN_FLIGHT,
+                 scale_down_ratio: float = SCALE_DOWN_RATIO, up_samples: int = UP_SAMPLES,
+                 down_samples: int = DOWN_SAMPLES, up_cooldown: float = UP_COOLDOWN,
+                 down_cooldown: float = DOWN_COOLDOWN, max_step: int = MAX_STEP):
+        if not 1 <= min_replicas <= max_replicas:
+            raise ValueError(f"need 1 <= min replicas ({min_replicas}) <= max replicas ({max_replicas})")
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.target_p95 = target_p95
+        self.target_in_flight = target_in_flight
+        self.scale_down_ratio = scale_down_ratio
+        self.up_samples = up_samples
+        self.down_samples = down_samples
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.max_step = max_step
+        self.over = 0
+        self.under = 0
+        self.last_scaled = 0.0
+
+    def evaluate(self, replicas: int, sample: Sample, now: float = None) -> Optional[ScaleDecision]:
+        """ScaleDecision nếu cần đổi số replicas, None nếu giữ nguyên"""
+        now = time.time() if now is None else now
+        if replicas < self.min_replicas or replicas > self.max_replicas:
+            target = min(max(replicas, self.min_replicas), self.max_replicas)
+            return self._scaled(target, now, f"outside bounds {self.min_replicas}-{self.max_replicas}")
+
+        capacity = self.target_in_flight * replicas
+        slow = sample.p95 is not None and sample.p95 > self.target_p95
+        busy = sample.in_flight > capacity
+        if slow or busy:
+            self.over += 1
+            self.under = 0
+        elif ((sample.p95 is None or sample.p95 < self.target_p95 * self.scale_down_ratio)
+              and sample.in_flight < self.target_in_flight * (replicas - 1) * self.scale_down_ratio):
+            # Even one replica fewer would stay well under the in-flight target
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+            return None
+
+        since_scaled = now - self.last_scaled
+        if self.over >= self.up_samples and replicas < self.max_replicas and since_scaled >= self.up_cooldown:
+            needed = math.ceil(sample.in_flight / self.target_in_flight) if self.target_in_flight > 0 else replicas
+            target = min(self.max_replicas, replicas + self.max_step, max(replicas + 1, needed))
+            reasons = []
+            if slow:
+                reasons.append(f"p95 {sample.p95:.2f}s > {self.target_p95:g}s")
+            if busy:
+                reasons.append(f"in-flight {sample.in_flight:.1f} > {capacity:g}")
+            return self._scaled(target, now, ", ".join(reasons))
+        if self.under >= self.down_samples and replicas > self.min_replicas and since_scaled >= self.down_cooldown:
+            return self._scaled(replicas - 1, now,
+                                f"in-flight {sample.in_flight:.1f} and p95 "
+                                f"{'-' if sample.p95 is None else format(sample.p95, '.2f') + 's'} "
+                                f"low for {self.under} samples")
+        return None
+
+    def _scaled(self, replicas: int, now: float, reason: str) -> ScaleDecision:
+        self.over = self.under = 0
+        self.last_scaled = now
+        return ScaleDecision(replicas, reason)
+
+class ComposeScaler:
+    """docker compose up --scale cho một service; reload nginx để nginx resolve lại danh sách replicas"""
+
+    def __init__(self, compose_file: str = AUTOSCALE_COMPOSE_FILE, service: str = AUTOSCALE_SERVICE,
+                 nginx_container: str = NGINX_CONTAINER, timeout: float = 300.0):
+        self.compose_file = compose_file
+        self.service = service
+        self.nginx_container = nginx_container
+        self.timeout = timeout
+
+    def _compose(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["docker", "compose", "-f", self.compose_file, *args],
+                              capture_output=True, text=True, timeout=self.timeout, check=True)
+
+    def replicas(self) -> int:
+        result = self._compose("ps", "-q", "--status", "running", self.service)
+        return sum(1 for line in result.stdout.splitlines() if line.strip())
+
+    def scale(self, replicas: int):
+        # --wait returns once the new replicas pass their healthcheck, so nginx only learns about ready ones
+        self._compose("up", "-d", "--no-deps", "--no-recreate", "--wait", "--scale",
+                      f"{self.service}={replicas}", self.service)
+        if self.nginx_container:
+            # nginx resolves `server mlflow-gateway:5000` when the config is loaded
+            subprocess.run(["docker", "exec", self.nginx_container, "nginx", "-s", "reload"],
+                           capture_output=True, text=True, timeout=30, check=True)
+
+class DryRunScaler:
+    """Chỉ ghi lại quyết định (test với mock upstream, không cần Docker)"""
+
+    def __init__(self, replicas: int = 1):
+        self.current = replicas
+
+    def replicas(self) -> int:
+        return self.current
+
+    def scale(self, replicas: int):
+        self.current = replicas
+
+def run(source: Any, policy: ScalingPolicy, scaler: Any, interval: float = AUTOSCALE_INTERVAL,
+        iterations: int = 0) -> List[Dict[str, Any]]:
+    """Vòng điều khiển: poll → evaluate → scale; trả về các lần scale (iterations 0 = chạy mãi)"""
+    history = []
+    count = 0
+    while not iterations or count < iterations:
+        count += 1
+        try:
+            sample = source.poll()
+            replicas = scaler.replicas()
+        except (requests.exceptions.RequestException, subprocess.SubprocessError, OSError) as e:
+            print(f"⚠ {datetime.now().strftime('%H:%M:%S')} could not read load or replicas: {e}")
+            sample = None
+        if sample is not None:
+            decision = policy.evaluate(replicas, sample)
+            p95 = f"{sample.p95:.2f}s" if sample.p95 is not None else "-"
+            line = (f"{datetime.now().strftime('%H:%M:%S')} replicas={replicas} requests={sample.requests} "
+                    f"p95={p95} in-flight={sample.in_flight:.1f}")
+            if decision is None:
+                print(line)
+            else:
+                print(f"{line} → scale to {decision.replicas} ({decision.reason})")
+                sys.stdout.flush()
+                try:
+                    scaler.scale(decision.replicas)
+                except (subprocess.SubprocessError, OSError) as e:
+                    stderr = getattr(e, "stderr", None)
+                    print(f"✗ Scaling to {decision.replicas} failed: {(stderr or str(e)).strip()}")
+                else:
+                    history.append({"ts": time.time(), "from": replicas, "to": decision.replicas,
+                                    "reason": decision.reason})
+            sys.stdout.flush()
+        if not iterations or count < iterations:
+            time.sleep(interval)
+    return history
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scale mlflow-gateway replicas with p95 latency and in-flight load")
+    parser.add_argument("--metrics", default=AUTOSCALE_METRICS_URL,
+                        help="gateway_proxy.py /metrics URL (default load signal)")
+    parser.add_argument("--nginx-container", help="Read load from this nginx container's access log instead")
+    parser.add_argument("--nginx-log", help="Read load from this nginx access log file instead")
+    parser.add_argument("--timing", choices=("urt", "rt"), default="urt",
+                        help="Nginx latency for p95: upstream response time (urt) or request time (rt)")
+    parser.add_argument("--compose-file", default=AUTOSCALE_COMPOSE_FILE, help="Compose file of the stack")
+    parser.add_argument("--service", default=AUTOSCALE_SERVICE, help="Service to scale")
+    parser.add_argument("--nginx-reload", default=NGINX_CONTAINER,
+                        help="Nginx container to reload after scaling ('' = none)")
+    parser.add_argument("--min-replicas", type=int, default=AUTOSCALE_MIN_REPLICAS)
+    parser.add_argument("--max-replicas", type=int, default=AUTOSCALE_MAX_REPLICAS)
+    parser.add_argument("--target-p95", type=float, default=AUTOSCALE_TARGET_P95,
+                        help="Scale up above this p95 latency, in seconds")
+    parser.add_argument("--target-in-flight", type=float, default=AUTOSCALE_TARGET_IN_FLIGHT,
+                        help="Scale up above this many concurrent requests per replica")
+    parser.add_argument("--scale-down-ratio", type=float, default=SCALE_DOWN_RATIO,
+                        help="Scale down only when p95 and in-flight (with one replica fewer) are below "
+                             "this fraction of their targets")
+    parser.add_argument("--up-samples", type=int, default=UP_SAMPLES, help="Consecutive samples before scaling up")
+    parser.add_argument("--down-samples", type=int, default=DOWN_SAMPLES,
+                        help="Consecutive samples before scaling down")
+    parser.add_argument("--up-cooldown", type=float, default=UP_COOLDOWN, help="Seconds after scaling before scaling up")
+    parser.add_argument("--down-cooldown", type=float, default=DOWN_COOLDOWN,
+                        help="Seconds after scaling before scaling down")
+    parser.add_argument("--max-step", type=int, default=MAX_STEP, help="Max replicas added at once")
+    parser.add_argument("--interval", type=float, default=AUTOSCALE_INTERVAL, help="Seconds between samples")
+    parser.add_argument("--iterations", type=int, default=0, help="Stop after this many samples (0 = run forever)")
+    parser.add_argument("--dry-run", action="store_true", help="Print decisions without calling docker")
+    parser.add_argument("--replicas", type=int, default=1, help="With --dry-run: starting replica count")
+
+    args = parser.parse_args()
+    try:
+        policy = ScalingPolicy(args.min_replicas, args.max_replicas, args.target_p95, args.target_in_flight,
+                               args.scale_down_ratio, args.up_samples, args.down_samples, args.up_cooldown,
+                               args.down_cooldown, args.max_step)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    if args.nginx_log or args.nginx_container:
+        try:
+            source = NginxLogSource(args.nginx_container, args.nginx_log, args.timing)
+        except FileNotFoundError:
+            print(f"✗ File not found: {args.nginx_log}")
+            sys.exit(1)
+        signal = f"nginx {args.nginx_log or args.nginx_container} ({args.timing})"
+    else:
+        source = MetricsSource(args.metrics)
+        signal = args.metrics
+    scaler = DryRunScaler(args.replicas) if args.dry_run else ComposeScaler(
+        args.compose_file, args.service, args.nginx_reload)
+
+    print("=" * 70)
+    print("MLflow Gateway Autoscaler" + (" (dry run)" if args.dry_run else ""))
+    print(f"Load signal: {signal}")
+    print(f"Service: {args.service} ({args.compose_file}), replicas {args.min_replicas}-{args.max_replicas}")
+    print(f"Targets: p95 <= {args.target_p95:g}s, in-flight <= {args.target_in_flight:g}/replica, "
+          f"scale down below {args.scale_down_ratio:g}x")
+    print(f"Hysteresis: {args.up_samples} sample(s) up / {args.down_samples} down, "
+          f"cooldown {args.up_cooldown:g}s up / {args.down_cooldown:g}s down, every {args.interval:g}s")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+    sys.stdout.flush()
+
+    try:
+        history = run(source, policy, scaler, args.interval, args.iterations)
+    except KeyboardInterrupt:
+        print("\n⚠ Autoscaler stopped by user")
+        return
+    print(f"\n✓ {len(history)} scaling action(s), final replicas: {scaler.replicas()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Batch Client
+Chạy hàng nghìn prompts từ một file JSONL qua gateway: giới hạn số requests in-flight, rate limit theo endpoint
+(provider), tự chờ và thử lại khi bị 429/503, ghi results ra JSONL ngay khi xong và chạy tiếp được sau khi bị dừng
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, List, NamedTuple, Set, Tuple
+
+from admission import TokenBucket, estimate_request_tokens
+from cost_engine import DEFAULT_MODEL, endpoint_name, price_token_totals
+from evaluate_gateway import ENDPOINT, GATEWAY_URL, GatewayEvaluator, create_session
+from replay import ResultWriter
+from response_cache import CACHE_HIT_VALUES
+from router import is_quota_error
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "5"))
+# Failures where the provider did not run the completion, so another attempt cannot bill twice; connection errors
+# before the request was sent are retried too
+RETRY_STATUSES = (429, 503)
+# Opt-in (--retry-unsafe): the request may already have reached the provider and been billed (timeouts are 0)
+UNSAFE_RETRY_STATUSES = (0, 500, 502, 504)
+BATCH_RETRY_UNSAFE = os.getenv("BATCH_RETRY_UNSAFE", "false").lower() in ("1", "true", "yes")
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+PROGRESS_INTERVAL = 10.0
+# Payload fields the client sets itself
+_ITEM_FIELDS = ("id", "prompt", "system", "endpoint")
+
+class BatchItem(NamedTuple):
+    id: str
+    path: str
+    payload: Dict[str, Any]
+
+def item_path(endpoint: Any, default_path: str) -> str:
+    """`endpoint` của một dòng: tên (chat-anthropic) hoặc path đầy đủ"""
+    if not endpoint:
+        return default_path
+    endpoint = str(endpoint)
+    return endpoint if endpoint.startswith("/") else f"/gateway/{endpoint}/invocations"
+
+def iter_batch_items(lines: Iterable[str], default_path: str = ENDPOINT) -> Iterator[BatchItem]:
+    """Mỗi dòng: {"id", "messages" | "prompt" (+ "system"), "endpoint"?, temperature, max_tokens, ...};
+    id mặc định là số dòng, để resume nhận ra dòng đã chạy"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            print(f"⚠ Line {number}: invalid JSON, skipped")
+            continue
+        if not isinstance(record, dict):
+            continue
+        messages = record.get("messages")
+        if not isinstance(messages, list):
+            if not isinstance(record.get("prompt"), str):
+                print(f"⚠ Line {number}: no messages or prompt, skipped")
+                continue
+            messages = [{"role": "user", "content": record["prompt"]}]
+            if isinstance(record.get("system"), str):
+                messages.insert(0, {"role": "system", "content": record["system"]})
+        payload = {name: value for name, value in record.items() if name not in _ITEM_FIELDS}
+        payload["messages"] = messages
+        item_id = str(record["id"]) if record.get("id") is not None else f"line-{number}"
+        yield BatchItem(item_id, item_path(record.get("endpoint"), default_path), payload)
+
+def load_completed(output_path: str) -> Set[str]:
+    """Ids đã thành công trong output của lần chạy trước (dòng lỗi hoặc ghi dở thì chạy lại)"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("success") and record.get("id") is not None:
+                completed.add(str(record["id"]))
+    return completed
+
+def parse_rate(spec: str) -> Tuple[str, float, float]:
+    """ENDPOINT=RPM[:TPM], vd. chat=3500:90000 → (endpoint, requests/phút, tokens/phút; 0 = không giới hạn)"""
+    endpoint, _, limits = spec.partition("=")
+    rpm, _, tpm = limits.partition(":")
+    if not endpoint or not rpm:
+        raise ValueError(f"invalid rate '{spec}', expected ENDPOINT=RPM[:TPM]")
+    return endpoint, float(rpm), float(tpm or 0)
+
+class ProviderGate:
+    """Rate limit phía client theo endpoint: token buckets (requests, tokens) và pause chung sau 429"""
+
+    def __init__(self, rates: Dict[str, Tuple[float, float]] = None):
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        for endpoint, (rpm, tpm) in (rates or {}).items():
+            # Burst of one second's worth keeps the start of a batch from tripping the provider limit
+            self.buckets[endpoint] = (
+                TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0)) if rpm > 0 else None,
+                TokenBucket(tpm / 60.0, max(1.0, tpm / 60.0)) if tpm > 0 else None
+            )
+        self.paused_until: Dict[str, float] = {}
+        self.waited = 0.0
+
+    def acquire(self, endpoint: str, tokens: int):
+        """Chờ tới khi endpoint cho phép gửi thêm một request ~tokens (reservation được tính ngay)"""
+        now = time.monotonic()
+        with self.lock:
+            wait = self.paused_until.get(endpoint, 0.0) - now
+            requests_bucket, tokens_bucket = self.buckets.get(endpoint, (None, None))
+            if requests_bucket is not None:
+                wait = max(wait, requests_bucket.reserve(1, now))
+            if tokens_bucket is not None:
+                # A request larger than the bucket would never fit; let it through at the refill rate
+                wait = max(wait, tokens_bucket.reserve(min(tokens, tokens_bucket.capacity), now))
+            if wait > 0:
+                self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def settle(self, endpoint: str, estimated: int, actual: int):
+        """Điều chỉnh token bucket theo usage thật khi response về"""
+        tokens_bucket = self.buckets.get(endpoint, (None, None))[1]
+        if tokens_bucket is None or actual == estimated:
+            return
+        with self.lock:
+            if actual < estimated:
+                tokens_bucket.cancel(estimated - actual)
+            else:
+                tokens_bucket.reserve(actual - estimated, time.monotonic())
+
+    def pause(self, endpoint: str, seconds: float):
+        """Provider báo rate limit: mọi request tới endpoint chờ ít nhất `seconds`"""
+        with self.lock:
+            until = time.monotonic() + seconds
+            self.paused_until[endpoint] = max(self.paused_until.get(endpoint, 0.0), until)
+
+class BatchStats:
+    """Tổng của batch, cập nhật theo từng item"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.statuses: Dict[int, int] = {}
+        self.tokens_by_model: Dict[str, List[int]] = {}
+
+    def add(self, result: Dict[str, Any]):
+        with self.lock:
+            status = result.get("status_code", 0)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if result.get("success"):
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            usage = result.get("usage")
+            if usage and result.get("cache") not in CACHE_HIT_VALUES and not result.get("coalesced"):
+                model = (result.get("response") or {}).get("model") or DEFAULT_MODEL
+                totals = self.tokens_by_model.setdefault(model, [0, 0, 0])
+                totals[0] += 1
+                totals[1] += usage.get("prompt_tokens", 0) or 0
+                totals[2] += usage.get("completion_tokens", 0) or 0
+
+    def count_retry(self, status: int):
+        with self.lock:
+            self.retries += 1
+            if status == 429:
+                self.rate_limited += 1
+
+    @property
+    def done(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def total_cost(self) -> float:
+        return sum(price_token_totals(prompt, completion, model)
+                   for model, (_, prompt, completion) in self.tokens_by_model.items())
+
+def should_retry(result: Dict[str, Any], retry_unsafe: bool = False) -> bool:
+    """Có gửi lại được không: 429/503 và lỗi kết nối trước khi gửi; 5xx khác và timeout chỉ khi retry_unsafe"""
+    status = result.get("status_code", 0)
+    if status in RETRY_STATUSES or (status == 0 and result.get("not_sent")):
+        return True
+    return retry_unsafe and status in UNSAFE_RETRY_STATUSES
+
+def retry_delay(attempt: int, result: Dict[str, Any]) -> float:
+    """Retry-After của response nếu có, không thì exponential backoff có jitter"""
+    if result.get("retry_after"):
+        return float(result["retry_after"])
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def run_batch(evaluator: GatewayEvaluator, items: Iterable[BatchItem], writer: ResultWriter,
+              gate: ProviderGate = None, concurrency: int = BATCH_CONCURRENCY,
+              max_attempts: int = BATCH_MAX_ATTEMPTS, completed: Set[str] = None,
+              progress_interval: float = PROGRESS_INTERVAL, retry_unsafe: bool = BATCH_RETRY_UNSAFE) -> Dict[str, Any]:
+    """Gửi các items (tối đa `concurrency` in-flight), bỏ qua ids trong `completed`; mỗi result một dòng JSON"""
+    gate = gate or ProviderGate()
+    completed = completed or set()
+    stats = BatchStats()
+    slots = threading.BoundedSemaphore(concurrency)
+    skipped = 0
+    start = time.monotonic()
+    last_progress = start
+
+    def send(item: BatchItem):
+        try:
+            endpoint = endpoint_name(item.path)
+            payload = item.payload
+            extra = {name: value for name, value in payload.items()
+                     if name not in ("messages", "temperature", "max_tokens")}
+            estimated = estimate_request_tokens(payload)
+            for attempt in range(1, max_attempts + 1):
+                gate.acquire(endpoint, estimated)
+                result = evaluator.send_request(payload["messages"], payload.get("temperature"),
+                                                payload.get("max_tokens"), None, item.path, extra)
+                status = result.get("status_code", 0)
+                if result.get("success") or not should_retry(result, retry_unsafe) or attempt == max_attempts:
+                    break
+                # Out of quota stays out of quota; retrying only burns attempts
+                if is_quota_error(status, str(result.get("error", "")).encode()):
+                    break
+                stats.count_retry(status)
+                delay = retry_delay(attempt, result)
+                if status == 429:
+                    # Slow the whole endpoint down, not just this item
+                    gate.pause(endpoint, delay)
+                else:
+                    time.sleep(delay)
+            usage = result.get("usage") or {}
+            if usage:
+                gate.settle(endpoint, estimated,
+                            (usage.get("prompt_tokens", 0) or 0) + (usage.get("completion_tokens", 0) or 0))
+            result["id"] = item.id
+            result["attempts"] = attempt
+            stats.add(result)
+            writer.write(result)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for item in items:
+            if item.id in completed:
+                skipped += 1
+                continue
+            # Input is read only as fast as requests complete, so huge files stay out of memory
+            slots.acquire()
+            pool.submit(send, item)
+            now = time.monotonic()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                print(f"  {datetime.now().strftime('%H:%M:%S')} done {stats.done:,} "
+                      f"(ok {stats.succeeded:,}, failed {stats.failed:,}), "
+                      f"{stats.done / (now - start):.1f} req/s, retries {stats.retries:,}")
+                sys.stdout.flush()
+
+    elapsed = time.monotonic() - start
+    return {
+        "total_requests": stats.done,
+        "successful": stats.succeeded,
+        "failed": stats.failed,
+        "skipped": skipped,
+        "retries": stats.retries,
+        "rate_limited": stats.rate_limited,
+        "rate_limit_wait": gate.waited,
+        "status_codes": stats.statuses,
+        "elapsed": elapsed,
+        "throughput": stats.done / elapsed if elapsed > 0 else 0.0,
+        "total_cost": stats.total_cost,
+        "latency": evaluator.histogram.summary()
+    }
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the gateway")
+    parser.add_argument("input", help="JSONL: one {\"id\", \"messages\" or \"prompt\", ...} per line ('-' = stdin)")
+    parser.add_argument("--output", default="batch_results.jsonl",
+                        help="Results, one JSON line per prompt, appended as they finish")
+    parser.add_argument("--url", default=GATEWAY_URL, help="Gateway (or gateway_proxy.py) URL")
+    parser.add_argument("--endpoint", default=ENDPOINT, help="Path for lines without an `endpoint` field")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Max requests in flight")
+    parser.add_argument("--rate", action="append", default=[], metavar="ENDPOINT=RPM[:TPM]",
+                        help="Client-side limit per endpoint (provider), e.g. chat=3500:90000 (repeatable)")
+    parser.add_argument("--max-attempts", type=int, default=BATCH_MAX_ATTEMPTS,
+                        help="Attempts per prompt on 429/503 and connection errors")
+    parser.add_argument("--retry-unsafe", action="store_true", default=BATCH_RETRY_UNSAFE,
+                        help="Also retry timeouts and 500/502/504 (the provider may bill the same prompt twice)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore results already in --output and run every prompt again")
+
+    args = parser.parse_args()
+    if args.concurrency < 1 or args.max_attempts < 1:
+        print("✗ --concurrency and --max-attempts must be >= 1")
+        sys.exit(1)
+    try:
+        rates = {endpoint: (rpm, tpm) for endpoint, rpm, tpm in map(parse_rate, args.rate)}
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    completed = set() if args.restart else load_completed(args.output)
+    session = create_session(args.concurrency)
+    evaluator = GatewayEvaluator(args.url, session=session, endpoint=args.endpoint, keep_results=False)
+
+    print("=" * 70)
+    print("MLflow Gateway Batch")
+    print(f"Input: {args.input}")
+    print(f"Gateway URL: {args.url}")
+    print(f"Max in-flight: {args.concurrency}, attempts: {args.max_attempts}"
+          + (" (also on timeouts and 500/502/504)" if args.retry_unsafe else ""))
+    for endpoint, (rpm, tpm) in rates.items():
+        print(f"Rate {endpoint}: {rpm:g} req/min" + (f", {tpm:g} tokens/min" if tpm else ""))
+    print(f"Output: {args.output}" + (f" (resuming, {len(completed):,} already done)" if completed else ""))
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+    sys.stdout.flush()
+
+    if not evaluator.check_health():
+        print("\n✗ Gateway health check failed. Exiting.")
+        sys.exit(1)
+
+    try:
+        source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    except OSError as e:
+        print(f"✗ Could not open {args.input}: {e}")
+        sys.exit(1)
+    try:
+        writer = ResultWriter(args.output, flush_every=1, append=not args.restart, keep_content=True)
+    except OSError as e:
+        print(f"✗ Could not open {args.output}: {e}")
+        sys.exit(1)
+    try:
+        summary = run_batch(evaluator, iter_batch_items(source, args.endpoint), writer, ProviderGate(rates),
+                            args.concurrency, args.max_attempts, completed, retry_unsafe=args.retry_unsafe)
+    except KeyboardInterrupt:
+        print("\n\n⚠ Batch interrupted; run the same command again to resume")
+        sys.exit(1)
+    finally:
+        writer.close()
+        if source is not sys.stdin:
+            source.close()
+
+    print(f"\n{'=' * 70}")
+    print("Batch Summary")
+    print(f"{'=' * 70}")
+    print(f"Prompts sent: {summary['total_requests']:,} (skipped, already done: {summary['skipped']:,})")
+    print(f"Successful: {summary['successful']:,}")
+    print(f"Failed: {summary['failed']:,}")
+    print(f"Retries: {summary['retries']:,} (rate limited: {summary['rate_limited']:,})")
+    print(f"Waited for rate limits: {summary['rate_limit_wait']:.1f}s (summed over workers)")
+    print(f"Elapsed: {summary['elapsed']:.2f}s, throughput: {summary['throughput']:.2f} req/s")
+    print("Status Codes:")
+    for status, count in sorted(summary["status_codes"].items()):
+        print(f"  {status if status else 'error'}: {count:,}")
+    print(f"Total Cost: ${summary['total_cost']:.6f}")
+    evaluator.print_latency_report()
+    print(f"\n✓ Results saved to {args.output}")
+    if summary["failed"]:
+        print("  Failed prompts are retried when the same command runs again")
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
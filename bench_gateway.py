@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Gateway Benchmark Suite
+Dựng stack docker-compose.mock.yml (1 instance trực tiếp, 1 instance sau nginx, N replicas sau nginx) với mock
+upstream cố định, chạy các workload profiles (small, long_context, streaming, burst), ghi throughput, latency
+percentiles và CPU/RSS mỗi container, so với baseline file và exit 1 khi vượt regression thresholds
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from autoscaler import NGINX_CONTAINER
+from evaluate_gateway import ENDPOINT, GatewayEvaluator, create_session
+from token_estimator import count_message_tokens
+
+# Configuration (CLI flags override these)
+BENCH_COMPOSE_FILE = os.getenv("BENCH_COMPOSE_FILE", "docker-compose.mock.yml")
+BENCH_SERVICE = os.getenv("BENCH_SERVICE", "mlflow-gateway")
+BENCH_BASELINE = os.getenv("BENCH_BASELINE", "bench_baseline.json")
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "bench_results.json")
+BENCH_REPLICAS = int(os.getenv("BENCH_REPLICAS", "3"))
+# Seconds of untimed traffic before each topology's profiles (worker startup, nginx keepalive pool)
+BENCH_WARMUP = float(os.getenv("BENCH_WARMUP", "5"))
+# Seconds between `docker stats` samples
+BENCH_STATS_INTERVAL = float(os.getenv("BENCH_STATS_INTERVAL", "2"))
+# Mock upstream profile: fixed latency and token counts so runs differ only by the gateway stack
+BENCH_MOCK_ENV = {
+    "MOCK_LATENCY_DIST": "fixed",
+    "MOCK_LATENCY_MS": os.getenv("BENCH_MOCK_LATENCY_MS", "100"),
+    "MOCK_TOKEN_LATENCY_MS": os.getenv("BENCH_MOCK_TOKEN_LATENCY_MS", "2"),
+    "MOCK_COMPLETION_TOKENS_MIN": os.getenv("BENCH_MOCK_COMPLETION_TOKENS", "100"),
+    "MOCK_COMPLETION_TOKENS_MAX": os.getenv("BENCH_MOCK_COMPLETION_TOKENS", "100"),
+    "MOCK_ERROR_RATE": "0",
+    "MOCK_RATE_LIMIT_RATE": "0",
+    "MOCK_QUOTA_ERROR_RATE": "0"
+}
+# Default regression thresholds (relative to the baseline; the baseline file can override them)
+DEFAULT_THRESHOLDS = {
+    # Max drop in throughput, percent
+    "throughput_drop": 10.0,
+    # Max increase of p50/p90/p99 latency (and TTFT for streaming), percent
+    "latency_increase": 20.0,
+    # Max increase of the error rate, absolute (0.01 = 1 percentage point)
+    "error_rate_increase": 0.01,
+    # Max increase of mean CPU and peak RSS per container, percent
+    "cpu_increase": 25.0,
+    "rss_increase": 25.0
+}
+# Changes below these absolute amounts never count as regressions (timer and sampling noise)
+LATENCY_SLACK = 0.005
+CPU_SLACK = 5.0
+RSS_SLACK = 16 * 1024 * 1024
+LATENCY_KEYS = ("p50", "p90", "p99")
+
+_MEMORY_UNITS = {"b": 1, "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4,
+                 "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4}
+_WORDS = ("gateway latency request model token cost cache replica nginx worker stream budget prompt "
+          "context reply limit queue memory shard").split()
+
+class Topology(NamedTuple):
+    name: str
+    description: str
+    replicas: int
+    # Services started (their dependencies come up too); nginx only when traffic goes through it
+    services: Tuple[str, ...]
+    url: str
+
+class Profile(NamedTuple):
+    name: str
+    description: str
+    concurrency: int
+    duration: float
+    # Approximate tokens of shared context sent before the question (0 = short prompt only)
+    context_tokens: int
+    max_tokens: int
+    stream: bool = False
+    # Burst profiles: `burst_size` identical requests at once, `rounds` times (duration unused)
+    burst_size: int = 0
+    rounds: int = 0
+
+def default_topologies(replicas: int = BENCH_REPLICAS) -> Dict[str, Topology]:
+    return {
+        "single": Topology("single", "1 gateway instance, direct (no nginx)", 1,
+                           ("mock-openai", BENCH_SERVICE), "http://localhost:5001"),
+        "nginx": Topology("nginx", "1 gateway instance behind nginx", 1,
+                          ("mock-openai", BENCH_SERVICE, "nginx"), "http://localhost:5000"),
+        "scaled": Topology("scaled", f"{replicas} gateway replicas behind nginx", replicas,
+                           ("mock-openai", BENCH_SERVICE, "nginx"), "http://localhost:5000")
+    }
+
+PROFILES = {
+    "small": Profile("small", "Short prompts, 16 in flight", 16, 30.0, 0, 64),
+    "long_context": Profile("long_context", "~8k-token shared context, 8 in flight", 8, 30.0, 8000, 256),
+    "streaming": Profile("streaming", "stream: true, 16 in flight (TTFT)", 16, 30.0, 0, 256, stream=True),
+    "burst": Profile("burst", "64 concurrent arrivals, 10 rounds", 64, 0.0, 0, 64, burst_size=64, rounds=10)
+}
+
+def build_test_cases(profile: Profile, count: int = 8, seed: int = 7) -> List[Dict[str, Any]]:
+    """Test cases cố định (seed) cho profile: câu hỏi ngắn, thêm context dài nếu context_tokens > 0"""
+    rng = random.Random(seed)
+    context = ""
+    if profile.context_tokens:
+        # Common English words are ~1 token each
+        context = " ".join(rng.choice(_WORDS) for _ in range(profile.context_tokens))
+    cases = []
+    for i in range(count):
+        question = f"Question {i}: summarize the {rng.choice(_WORDS)} trade-offs in two sentences."
+        messages = [{"role": "user", "content": question}]
+        if context:
+            messages.insert(0, {"role": "system", "content": f"Reference document:\n{context}"})
+        cases.append({"name": f"{profile.name}-{i}", "messages": messages, "temperature": 0.7,
+                      "max_tokens": profile.max_tokens})
+    return cases
+
+def parse_percent(value: str) -> float:
+    """'12.34%' -> 12.34"""
+    try:
+        return float(value.strip().rstrip("%"))
+    except ValueError:
+        return 0.0
+
+def parse_memory(value: str) -> int:
+    """'123.4MiB / 2GiB' -> bytes đang dùng"""
+    used = value.split("/")[0].strip().lower()
+    number = used.rstrip("abcdefghijklmnopqrstuvwxyz")
+    unit = used[len(number):].strip() or "b"
+    try:
+        return int(float(number) * _MEMORY_UNITS.get(unit, 1))
+    except ValueError:
+        return 0
+
+class ContainerStats:
+    """Lấy mẫu `docker stats` trong background thread: CPU % (mean, max) và RSS (mean, max) mỗi container"""
+
+    def __init__(self, containers: List[str], interval: float = BENCH_STATS_INTERVAL):
+        self.containers = containers
+        self.interval = interval
+        # name -> [samples, cpu sum, cpu max, rss sum, rss max]
+        self.samples: Dict[str, List[float]] = {}
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        result = subprocess.run(["docker", "stats", "--no-stream", "--format", "{{json .}}", *self.containers],
+                                capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            self.errors += 1
+            return
+        for line in result.stdout.splitlines():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            cpu, rss = parse_percent(row.get("CPUPerc", "")), parse_memory(row.get("MemUsage", ""))
+            stats = self.samples.setdefault(row.get("Name") or row.get("Container", "?"), [0, 0.0, 0.0, 0, 0])
+            stats[0] += 1
+            stats[1] += cpu
+            stats[2] = max(stats[2], cpu)
+            stats[3] += rss
+            stats[4] = max(stats[4], rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except (OSError, subprocess.SubprocessError):
+                self.errors += 1
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self.containers:
+            self._thread = threading.Thread(target=self._run, name="bench-docker-stats", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> Dict[str, Dict[str, float]]:
+        """Dừng sampling; trả về {container: {cpu_mean, cpu_max, rss_mean, rss_max, samples}}"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        return {
+            name: {"samples": count, "cpu_mean": cpu_sum / count, "cpu_max": cpu_max,
+                   "rss_mean": int(rss_sum / count), "rss_max": int(rss_max)}
+            for name, (count, cpu_sum, cpu_max, rss_sum, rss_max) in sorted(self.samples.items()) if count
+        }
+
+class ComposeStack:
+    """docker compose up/down cho một topology; reload nginx sau khi scale"""
+
+    def __init__(self, compose_file: str = BENCH_COMPOSE_FILE, service: str = BENCH_SERVICE,
+                 nginx_container: str = NGINX_CONTAINER, timeout: float = 600.0):
+        self.compose_file = compose_file
+        self.service = service
+        self.nginx_container = nginx_container
+        self.timeout = timeout
+        # The compose file reads the mock profile from ${MOCK_...}
+        self.env = dict(os.environ, **BENCH_MOCK_ENV)
+
+    def _compose(self, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["docker", "compose", "-f", self.compose_file, *args], env=self.env,
+                              capture_output=True, text=True, timeout=self.timeout, check=True)
+
+    def up(self, topology: Topology):
+        # --wait returns once the healthchecks pass (gateway workers are up)
+        self._compose("up", "-d", "--build", "--wait", "--scale", f"{self.service}={topology.replicas}",
+                      *topology.services)
+        if "nginx" in topology.services:
+            # nginx resolves `server mlflow-gateway:5000` when the config is loaded
+            subprocess.run(["docker", "exec", self.nginx_container, "nginx", "-s", "reload"],
+                           capture_output=True, text=True, timeout=30, check=True)
+
+    def down(self):
+        self._compose("down", "--remove-orphans")
+
+    def containers(self) -> List[str]:
+        result = self._compose("ps", "-q")
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+def warm_up(url: str, seconds: float, concurrency: int = 4):
+    """Traffic không tính trước khi đo (không in gì)"""
+    if seconds <= 0:
+        return
+    evaluator = GatewayEvaluator(url, session=create_session(concurrency), keep_results=False)
+    deadline = time.monotonic() + seconds
+    messages = [{"role": "user", "content": "warm-up"}]
+
+    def worker():
+        while time.monotonic() < deadline:
+            evaluator.send_request(messages, 0.7, 16)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def run_profile(url: str, profile: Profile, keep_alive: bool = True, endpoint: str = ENDPOINT) -> Dict[str, Any]:
+    """Chạy một profile bằng GatewayEvaluator; trả về throughput, error rate và latency percentiles"""
+    cases = build_test_cases(profile)
+    session = create_session(max(profile.concurrency, profile.burst_size), keep_alive)
+    evaluator = GatewayEvaluator(url, session=session, stream=profile.stream, endpoint=endpoint)
+    start = time.monotonic()
+    if profile.burst_size:
+        summary = evaluator.run_burst(cases, profile.burst_size, profile.rounds)
+    else:
+        summary = evaluator.run_load(cases, profile.concurrency, None, profile.duration)
+    elapsed = time.monotonic() - start
+    total = summary["total_requests"]
+    latency = summary["latency"]
+    result = {
+        "requests": total,
+        "failed": summary["failed"],
+        "error_rate": summary["failed"] / total if total else 1.0,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed > 0 else 0.0,
+        "latency": {key: latency.get(key) for key in ("mean",) + LATENCY_KEYS + ("max",)},
+        "prompt_tokens": count_message_tokens(cases[0]["messages"])
+    }
+    if profile.stream:
+        ttft = evaluator.stream_summary()["ttft"]
+        result["ttft"] = {key: ttft.get(key) for key in LATENCY_KEYS}
+    return result
+
+def _git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+class Regression(NamedTuple):
+    run: str
+    metric: str
+    baseline: float
+    current: float
+    limit: str
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], thresholds: Dict[str, float]) -> List[Regression]:
+    """Các metrics của `results` tệ hơn baseline quá thresholds (runs không có trong baseline thì bỏ qua)"""
+    regressions = []
+    for run, current in results.get("runs", {}).items():
+        base = baseline.get("runs", {}).get(run)
+        if base is None:
+            continue
+        drop = thresholds["throughput_drop"]
+        if base["throughput"] and current["throughput"] < base["throughput"] * (1 - drop / 100):
+            regressions.append(Regression(run, "throughput", base["throughput"], current["throughput"],
+                                          f"-{drop:g}%"))
+        if current["error_rate"] > base["error_rate"] + thresholds["error_rate_increase"]:
+            regressions.append(Regression(run, "error_rate", base["error_rate"], current["error_rate"],
+                                          f"+{thresholds['error_rate_increase']:g}"))
+        increase = thresholds["latency_increase"]
+        for group in ("latency", "ttft"):
+            for key in LATENCY_KEYS:
+                before = (base.get(group) or {}).get(key)
+                after = (current.get(group) or {}).get(key)
+                if before is None or after is None:
+                    continue
+                if after > before * (1 + increase / 100) and after - before > LATENCY_SLACK:
+                    regressions.append(Regression(run, f"{group}.{key}", before, after, f"+{increase:g}%"))
+        for name, stats in (current.get("containers") or {}).items():
+            before = (base.get("containers") or {}).get(name)
+            if before is None:
+                continue
+            for metric, threshold, slack in (("cpu_mean", "cpu_increase", CPU_SLACK),
+                                             ("rss_max", "rss_increase", RSS_SLACK)):
+                limit = thresholds[threshold]
+                if stats[metric] > before[metric] * (1 + limit / 100) and stats[metric] - before[metric] > slack:
+                    regressions.append(Regression(run, f"{name}.{metric}", before[metric], stats[metric],
+                                                  f"+{limit:g}%"))
+    return regressions
+
+def _format_value(metric: str, value: float) -> str:
+    if metric.startswith(("latency.", "ttft.")):
+        return f"{value * 1000:.1f}ms"
+    if metric.endswith("rss_max"):
+        return f"{value / 1024 / 1024:.1f}MiB"
+    if metric.endswith("cpu_mean"):
+        return f"{value:.1f}%"
+    if metric == "error_rate":
+        return f"{value * 100:.2f}%"
+    return f"{value:.2f} req/s"
+
+def print_summary(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    """Bảng kết quả mỗi run (topology/profile), kèm thay đổi throughput và p99 so với baseline"""
+    print(f"\n{'=' * 70}")
+    print("Benchmark Summary")
+    print(f"{'=' * 70}")
+    print(f"{'Run':<24} {'Req/s':>8} {'Errors':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'vs baseline':>16}")
+    for run, data in results["runs"].items():
+        latency = data["latency"]
+        percentiles = " ".join(f"{latency[key] * 1000:>7.1f}ms" if latency.get(key) is not None else f"{'-':>9}"
+                               for key in LATENCY_KEYS)
+        # Throughput and p99 change
+        change = ""
+        base = (baseline or {}).get("runs", {}).get(run)
+        if base and base["throughput"] and base["latency"].get("p99") and latency.get("p99"):
+            change = (f"{(data['throughput'] / base['throughput'] - 1) * 100:+.0f}% / "
+                      f"{(latency['p99'] / base['latency']['p99'] - 1) * 100:+.0f}%")
+        print(f"{run:<24} {data['throughput']:>8.2f} {data['error_rate'] * 100:>6.1f}% {percentiles} {change:>16}")
+        for name, stats in (data.get("containers") or {}).items():
+            print(f"  {name:<40} CPU {stats['cpu_mean']:>6.1f}% (max {stats['cpu_max']:.1f}%), "
+                  f"RSS {stats['rss_max'] / 1024 / 1024:>7.1f}MiB")
+
+def write_json(path: str, data: Dict[str, Any]):
+    """Ghi JSON atomic (tmp + rename)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def run_suite(topologies: List[Topology], profiles: List[Profile], stack: Optional[ComposeStack],
+              warmup: float = BENCH_WARMUP, keep_alive: bool = True, keep_up: bool = False,
+              stats_interval: float = BENCH_STATS_INTERVAL) -> Dict[str, Any]:
+    """Mỗi topology: up, warm-up, từng profile (kèm docker stats), down; stack None = URL có sẵn, không Docker"""
+    results = {
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "revision": _git_revision(),
+        "settings": {
+            "mock": BENCH_MOCK_ENV if stack is not None else None,
+            "gateway_workers": os.getenv("GATEWAY_WORKERS"),
+            "keep_alive": keep_alive,
+            "warmup": warmup,
+            "topologies": {t.name: {"replicas": t.replicas, "url": t.url, "services": list(t.services)}
+                           for t in topologies},
+            "profiles": {p.name: p._asdict() for p in profiles}
+        },
+        "runs": {}
+    }
+    for topology in topologies:
+        print(f"\n{'#' * 70}")
+        print(f"Topology: {topology.name} ({topology.description}) → {topology.url}")
+        print(f"{'#' * 70}")
+        containers = []
+        if stack is not None:
+            try:
+                stack.up(topology)
+                containers = stack.containers()
+            except (OSError, subprocess.SubprocessError) as e:
+                detail = getattr(e, "stderr", "") or ""
+                print(f"✗ Could not start {topology.name}: {e} {detail.strip()}")
+                sys.exit(2)
+        try:
+            warm_up(topology.url, warmup)
+            for profile in profiles:
+                sampler = ContainerStats(containers, stats_interval)
+                sampler.start()
+                try:
+                    data = run_profile(topology.url, profile, keep_alive)
+                finally:
+                    usage = sampler.stop()
+                data["containers"] = usage
+                results["runs"][f"{topology.name}/{profile.name}"] = data
+        finally:
+            if stack is not None and not keep_up:
+                try:
+                    stack.down()
+                except (OSError, subprocess.SubprocessError) as e:
+                    print(f"⚠ Could not stop the stack: {e}")
+    return results
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reproducible gateway benchmark with regression thresholds")
+    parser.add_argument("--topologies", default="single,nginx,scaled",
+                        help="Comma-separated topologies: single (direct), nginx (1 replica), scaled (N replicas)")
+    parser.add_argument("--profiles", default=",".join(PROFILES),
+                        help=f"Comma-separated workload profiles ({', '.join(PROFILES)})")
+    parser.add_argument("--replicas", type=int, default=BENCH_REPLICAS, help="Replicas of the scaled topology")
+    parser.add_argument("--duration", type=float, help="Override the duration (seconds) of every load profile")
+    parser.add_argument("--url", help="Benchmark an already running gateway/proxy at this URL (no docker compose, "
+                                      "no container stats); results are stored as topology `external`")
+    parser.add_argument("--compose-file", default=BENCH_COMPOSE_FILE, help="Compose file of the benchmark stack")
+    parser.add_argument("--warmup", type=float, default=BENCH_WARMUP, help="Seconds of warm-up traffic per topology")
+    parser.add_argument("--no-keep-alive", action="store_true", help="New client connection for every request")
+    parser.add_argument("--keep-up", action="store_true", help="Leave each stack running after its profiles")
+    parser.add_argument("--output", default=BENCH_OUTPUT, help="Results JSON")
+    parser.add_argument("--baseline", default=BENCH_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--compare", metavar="RESULTS", help="Only compare an existing results file with the baseline")
+    for name, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--max-{name.replace('_', '-')}", dest=name, type=float,
+                            help=f"Regression threshold (default: baseline file, else {value:g})")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        try:
+            with open(args.compare, "r") as f:
+                results = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"✗ Could not read results {args.compare}: {e}")
+            sys.exit(2)
+    else:
+        profiles = []
+        for name in filter(None, args.profiles.split(",")):
+            if name not in PROFILES:
+                print(f"✗ Unknown profile {name!r} (choose from {', '.join(PROFILES)})")
+                sys.exit(2)
+            profile = PROFILES[name]
+            if args.duration and not profile.burst_size:
+                profile = profile._replace(duration=args.duration)
+            profiles.append(profile)
+        if args.url:
+            topologies = [Topology("external", "running stack", 0, (), args.url.rstrip("/"))]
+            stack = None
+        else:
+            available = default_topologies(args.replicas)
+            topologies = []
+            for name in filter(None, args.topologies.split(",")):
+                if name not in available:
+                    print(f"✗ Unknown topology {name!r} (choose from {', '.join(available)})")
+                    sys.exit(2)
+                topologies.append(available[name])
+            stack = ComposeStack(args.compose_file)
+        try:
+            results = run_suite(topologies, profiles, stack, args.warmup, not args.no_keep_alive, args.keep_up)
+        except KeyboardInterrupt:
+            print("\n\n⚠ Benchmark interrupted by user")
+            sys.exit(1)
+        write_json(args.output, results)
+        print(f"\n✓ Results saved to {args.output}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        try:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"✗ Could not read baseline {args.baseline}: {e}")
+            sys.exit(2)
+    print_summary(results, baseline)
+
+    if args.save_baseline:
+        # Thresholds tuned in the old baseline file are kept
+        results["thresholds"] = dict(DEFAULT_THRESHOLDS, **((baseline or {}).get("thresholds") or {}))
+        write_json(args.baseline, results)
+        print(f"\n✓ Baseline saved to {args.baseline} ({len(results['runs'])} run(s))")
+        return
+    if baseline is None:
+        print(f"\n⚠ No baseline at {args.baseline}: run again with --save-baseline to create one")
+        return
+
+    thresholds = dict(DEFAULT_THRESHOLDS, **(baseline.get("thresholds") or {}))
+    thresholds.update({name: getattr(args, name) for name in DEFAULT_THRESHOLDS if getattr(args, name) is not None})
+    baseline_profiles = baseline.get("settings", {}).get("profiles") or {}
+    changed = [name for name, settings in (results.get("settings", {}).get("profiles") or {}).items()
+               if name in baseline_profiles and baseline_profiles[name] != settings]
+    if changed:
+        print(f"⚠ Profile settings differ from the baseline ({', '.join(changed)}); comparison may be unfair")
+    missing = [run for run in results["runs"] if run not in baseline.get("runs", {})]
+    if missing:
+        print(f"⚠ Not in baseline (not compared): {', '.join(missing)}")
+    regressions = compare(results, baseline, thresholds)
+    print(f"\nBaseline: {args.baseline} (revision {baseline.get('revision') or '?'}, {baseline.get('created', '?')})")
+    if not regressions:
+        print("✓ No regressions past thresholds")
+        return
+    print(f"✗ {len(regressions)} regression(s):")
+    for regression in regressions:
+        print(f"  {regression.run:<24} {regression.metric:<32} {_format_value(regression.metric, regression.baseline)}"
+              f" → {_format_value(regression.metric, regression.current)} (limit {regression.limit})")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Log Classifier Benchmark
+So sánh lines/sec giữa regex cascade cũ của analyze_costs.py và log_classifier.classify_line, và giữa keyword
+checks bằng chained `in` (classify_line) với một regex alternation compile sẵn
+"""
+
+import json
+import random
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Any, List, Callable
+
+from log_classifier import classify_line, EMPTY_RECORD
+
+def generate_lines(count: int, seed: int = 42) -> List[str]:
+    """Tạo log lines giống output thực tế: nginx access log, usage JSON, errors và server chatter"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        r = rng.random()
+        if r < 0.30:
+            status = rng.choice([200, 200, 200, 200, 429, 500, 401])
+            lines.append(
+                f'172.18.0.{i % 250} - - [18/Oct/2026:10:{i % 60:02d}:00 +0000] '
+                f'"POST /gateway/chat/invocations HTTP/1.1" {status} {rng.randint(200, 4000)} '
+                f'"-" "python-requests/2.31.0" rt={rng.random():.3f} uct="0.001" '
+                f'uht="{rng.random():.3f}" urt="{rng.random():.3f}"'
+            )
+        elif r < 0.40:
+            response = {
+                "id": f"chatcmpl-{i}",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "x" * rng.randint(50, 600)}}],
+                "usage": {
+                    "prompt_tokens": rng.randint(5, 800),
+                    "completion_tokens": rng.randint(5, 800),
+                    "total_tokens": 0
+                }
+            }
+            lines.append(f"INFO:mlflow.gateway: response {json.dumps(response)}")
+        elif r < 0.44:
+            lines.append(rng.choice([
+                "ERROR:mlflow.gateway: OpenAI error: You exceeded your current quota",
+                "ERROR:mlflow.gateway: 401 Unauthorized: Incorrect API key provided",
+                "WARNING:mlflow.gateway: 429 rate limit reached for requests",
+                "ERROR:mlflow.gateway: Exception in ASGI application"
+            ]))
+        elif r < 0.47:
+            lines.append(f"DEBUG: prompt_tokens={rng.randint(5, 500)} completion_tokens={rng.randint(5, 500)}")
+        elif r < 0.60:
+            lines.append(f"INFO:     172.18.0.1:{40000 + i % 1000} - \"POST /gateway/chat/invocations HTTP/1.1\" 200 OK")
+        else:
+            lines.append(f"[2026-10-18 10:00:00 +0000] [{i % 8}] [INFO] Booting uvicorn worker with pid: {i % 8}")
+    return lines
+
+def legacy_scan(lines: List[str]) -> Dict[str, Any]:
+    """Regex cascade của analyze_docker_logs trước khi có log_classifier (giữ nguyên logic để so sánh)"""
+    stats = {"has_requests": False, "api_requests": 0, "successful": 0, "failed": 0,
+             "error_types": defaultdict(int), "usages": 0, "tokens": 0}
+    for line in lines:
+        if re.search(r'^\d+\.\d+\.\d+\.\d+.*"([A-Z]+|GET|POST|PUT|DELETE).*"', line):
+            stats["has_requests"] = True
+            method_match = re.search(r'"([A-Z]+)\s+([^\s]+)', line)
+            status_match = re.search(r'"\s+(\d{3})\s+', line)
+            if method_match:
+                path = method_match.group(2)
+                if '/gateway/chat/invocations' in path or '/invocations' in path:
+                    stats["api_requests"] += 1
+                    if status_match:
+                        status = int(status_match.group(1))
+                        if status == 200:
+                            stats["successful"] += 1
+                        elif status >= 400:
+                            stats["failed"] += 1
+        elif any(kw in line.lower() for kw in ['invocations', 'post', 'gateway/chat', 'request', 'http', 'uvicorn', 'gunicorn']):
+            if not ('uvicorn' in line.lower() or 'gunicorn' in line.lower()):
+                stats["has_requests"] = True
+
+        if any(kw in line.lower() for kw in ['error', 'failed', 'exception', 'quota', 'exceeded', '401', '429', '500']):
+            if "quota" in line.lower() or "exceeded" in line.lower():
+                stats["error_types"]["quota_exceeded"] += 1
+            elif "401" in line or "unauthorized" in line.lower():
+                stats["error_types"]["unauthorized"] += 1
+            elif "429" in line or "rate limit" in line.lower():
+                stats["error_types"]["rate_limit"] += 1
+
+        if any(kw in line.lower() for kw in ['usage', 'token', 'prompt_tokens', 'completion_tokens']):
+            json_match = re.search(r'\{.*\}', line, re.DOTALL)
+            data = None
+            if json_match:
+                try:
+                    data = json.loads(json_match.group())
+                except ValueError:
+                    data = None
+            if data:
+                if "usage" in data:
+                    stats["usages"] += 1
+                    stats["tokens"] += data["usage"].get("prompt_tokens", 0) + data["usage"].get("completion_tokens", 0)
+            else:
+                prompt_match = re.search(r'["\']?prompt_tokens["\']?\s*[:=]\s*(\d+)', line, re.IGNORECASE)
+                completion_match = re.search(r'["\']?completion_tokens["\']?\s*[:=]\s*(\d+)', line, re.IGNORECASE)
+                if prompt_match or completion_match:
+                    tokens = (int(prompt_match.group(1)) if prompt_match else 0) + \
+                             (int(completion_match.group(1)) if completion_match else 0)
+                    if tokens > 0:
+                        stats["usages"] += 1
+                        stats["tokens"] += tokens
+    return stats
+
+def classifier_scan(lines: List[str]) -> Dict[str, Any]:
+    """Cùng thống kê như legacy_scan nhưng dùng classify_line"""
+    stats = {"has_requests": False, "api_requests": 0, "successful": 0, "failed": 0,
+             "error_types": defaultdict(int), "usages": 0, "tokens": 0}
+    for line in lines:
+        record = classify_line(line)
+        if record is EMPTY_RECORD:
+            continue
+        if record.is_request:
+            stats["has_requests"] = True
+        if record.path and '/invocations' in record.path:
+            stats["api_requests"] += 1
+            if record.status == 200:
+                stats["successful"] += 1
+            elif record.status and record.status >= 400:
+                stats["failed"] += 1
+        if record.error_class:
+            stats["error_types"][record.error_class] += 1
+        if record.usage:
+            stats["usages"] += 1
+            stats["tokens"] += record.usage.get("prompt_tokens", 0) + record.usage.get("completion_tokens", 0)
+    return stats
+
+# Keyword sets of classify_line's request and error checks
+_REQUEST_ALTERNATION = re.compile(r"invocations|post|gateway/chat|request|http")
+_SERVER_ALTERNATION = re.compile(r"uvicorn|gunicorn")
+_ERROR_ALTERNATION = re.compile(r"error|failed|exception|quota|exceeded|401|429|500")
+
+def chained_keyword_scan(lines: List[str]) -> Dict[str, Any]:
+    """Keyword checks của classify_line: chained `in` trên dòng đã lowercase"""
+    stats = {"requests": 0, "errors": 0}
+    for line in lines:
+        lower = line.lower()
+        if (("invocations" in lower or "post" in lower or "gateway/chat" in lower or "request" in lower
+             or "http" in lower) and not ("uvicorn" in lower or "gunicorn" in lower)):
+            stats["requests"] += 1
+        if ("error" in lower or "failed" in lower or "exception" in lower or "quota" in lower
+                or "exceeded" in lower or "401" in lower or "429" in lower or "500" in lower):
+            stats["errors"] += 1
+    return stats
+
+def alternation_keyword_scan(lines: List[str]) -> Dict[str, Any]:
+    """Cùng keyword checks bằng regex alternation compile sẵn"""
+    stats = {"requests": 0, "errors": 0}
+    request_search = _REQUEST_ALTERNATION.search
+    server_search = _SERVER_ALTERNATION.search
+    error_search = _ERROR_ALTERNATION.search
+    for line in lines:
+        lower = line.lower()
+        if request_search(lower) and not server_search(lower):
+            stats["requests"] += 1
+        if error_search(lower):
+            stats["errors"] += 1
+    return stats
+
+def measure(name: str, scan: Callable[[List[str]], Dict[str, Any]], lines: List[str], repeat: int) -> Dict[str, Any]:
+    """Chạy scan `repeat` lần, lấy lần nhanh nhất"""
+    best = None
+    stats = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stats = scan(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rate = len(lines) / best
+    print(f"  {name:<12} {best:8.3f}s  {rate:>12,.0f} lines/sec")
+    return {"elapsed": best, "lines_per_sec": rate, "stats": stats}
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark log line classification")
+    parser.add_argument("--lines", type=int, default=200000, help="Number of synthetic log lines")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per implementation (best is reported)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for generated lines")
+
+    args = parser.parse_args()
+
+    lines = generate_lines(args.lines, args.seed)
+    print("=" * 70)
+    print("Log Classifier Benchmark")
+    print(f"Lines: {len(lines):,} (best of {args.repeat})")
+    print("=" * 70)
+
+    before = measure("legacy", legacy_scan, lines, args.repeat)
+    after = measure("classifier", classifier_scan, lines, args.repeat)
+
+    print(f"\nSpeedup: {after['lines_per_sec'] / before['lines_per_sec']:.2f}x")
+    if before["stats"] == after["stats"]:
+        print("✓ Results identical")
+    else:
+        print("✗ Results differ")
+        print(f"  legacy:     {dict(before['stats'])}")
+        print(f"  classifier: {dict(after['stats'])}")
+
+    print("\nKeyword checks (request + error keywords per line)")
+    alternation = measure("alternation", alternation_keyword_scan, lines, args.repeat)
+    chained = measure("chained in", chained_keyword_scan, lines, args.repeat)
+    print(f"\nChained `in` vs alternation: {chained['lines_per_sec'] / alternation['lines_per_sec']:.2f}x")
+    if alternation["stats"] != chained["stats"]:
+        print(f"✗ Results differ: {alternation['stats']} vs {chained['stats']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Budget Guard
+Giới hạn chi phí (USD) theo client và toàn proxy trong rolling windows (phút/giờ/ngày), kiểm tra trước khi gửi
+request: chi phí tối đa ước lượng (prompt tokens + max_tokens) được giữ chỗ, rồi điều chỉnh theo usage thật
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from admission import config_client_id, redact_client
+from cost_engine import endpoint_name, price_token_totals
+from token_estimator import TokenEstimate, estimate_tokens
+
+# Window name -> seconds; proxy.yaml limits are usd_per_<window>
+WINDOWS = {"minute": 60, "hour": 3600, "day": 86400}
+# Each window is split into this many slots (spend leaves the window one slot at a time)
+WINDOW_SLOTS = 60
+# Client spend kept in memory; only clients with nothing left in any window are dropped (same as admission.py),
+# new clients beyond that share the OVERFLOW_CLIENT budget
+MAX_CLIENTS = 10000
+OVERFLOW_CLIENT = "overflow"
+# Clients listed in /proxy/stats, by spend in the longest window
+TOP_CLIENTS = 10
+
+def parse_limits(data: Dict[str, Any], default: Dict[str, float] = None) -> Dict[str, float]:
+    """{window: USD} từ usd_per_minute/usd_per_hour/usd_per_day; field không có thì lấy từ default"""
+    limits = dict(default or {})
+    for window in WINDOWS:
+        value = (data or {}).get(f"usd_per_{window}")
+        if value is not None:
+            limits[window] = float(value)
+    return limits
+
+class RollingSpend:
+    """Tổng USD trong `window` giây gần nhất, theo slots (độ chính xác window / slots)"""
+    __slots__ = ("slot_seconds", "slot_count", "slots", "total")
+
+    def __init__(self, window: float, slots: int = WINDOW_SLOTS):
+        self.slot_seconds = window / slots
+        self.slot_count = slots
+        # [slot index, USD], oldest first
+        self.slots = deque()
+        self.total = 0.0
+
+    def _expire(self, now: float):
+        oldest = int(now // self.slot_seconds) - self.slot_count + 1
+        while self.slots and self.slots[0][0] < oldest:
+            self.total -= self.slots.popleft()[1]
+        if not self.slots:
+            # Drop float drift once nothing is left in the window
+            self.total = 0.0
+
+    def spent(self, now: float) -> float:
+        self._expire(now)
+        return self.total
+
+    def add(self, amount: float, now: float):
+        index = int(now // self.slot_seconds)
+        if self.slots and self.slots[-1][0] == index:
+            self.slots[-1][1] += amount
+        else:
+            self.slots.append([index, amount])
+        self.total += amount
+
+    def adjust(self, amount: float, at: float):
+        """Cộng/trừ vào slot của thời điểm `at` (reservation); slot đã ra khỏi window thì bỏ qua"""
+        index = int(at // self.slot_seconds)
+        for slot in reversed(self.slots):
+            if slot[0] == index:
+                slot[1] += amount
+                self.total += amount
+                return
+            if slot[0] < index:
+                return
+
+    def retry_after(self, limit: float, amount: float, now: float) -> Optional[float]:
+        """Số giây tới khi thêm `amount` không vượt limit (spend cũ ra khỏi window); None nếu không bao giờ"""
+        if amount > limit:
+            return None
+        total = self.spent(now)
+        for index, spent in self.slots:
+            total -= spent
+            if total + amount <= limit:
+                return max(0.0, (index + self.slot_count) * self.slot_seconds - now)
+        return 0.0
+
+class _Spend:
+    """RollingSpend cho mỗi window có limit"""
+    __slots__ = ("limits", "windows")
+
+    def __init__(self, limits: Dict[str, float], slots: int = WINDOW_SLOTS):
+        self.limits = limits
+        self.windows = {window: RollingSpend(WINDOWS[window], slots) for window in limits}
+
+    def exceeded(self, amount: float, now: float) -> Optional[str]:
+        """Window đầu tiên mà thêm `amount` thì vượt limit"""
+        for window, spend in self.windows.items():
+            if spend.spent(now) + amount > self.limits[window]:
+                return window
+        return None
+
+    def add(self, amount: float, now: float):
+        for spend in self.windows.values():
+            spend.add(amount, now)
+
+    def idle(self, now: float) -> bool:
+        """Không còn spend trong window nào: bỏ đi thì client không được thêm budget"""
+        # Tolerance for float drift left by reserve/settle adjustments
+        return all(spend.spent(now) < 1e-12 for spend in self.windows.values())
+
+    def adjust(self, amount: float, at: float):
+        for spend in self.windows.values():
+            spend.adjust(amount, at)
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {window: {"spent": spend.spent(now), "limit": self.limits[window]}
+                for window, spend in self.windows.items()}
+
+class Reservation(NamedTuple):
+    client: str
+    estimate: TokenEstimate
+    cost: float
+    at: float
+
+class BudgetDecision(NamedTuple):
+    allowed: bool
+    reservation: Optional[Reservation] = None
+    # "global" or "client", and the window whose limit would be exceeded
+    scope: Optional[str] = None
+    window: Optional[str] = None
+    retry_after: float = 0.0
+
+class BudgetGuard:
+    """Giữ chỗ chi phí tối đa của mỗi request trong budget của client và budget chung, từ chối (429) nếu vượt"""
+
+    def __init__(self, global_limits: Dict[str, float] = None, default_limits: Dict[str, float] = None,
+                 client_limits: Dict[str, Dict[str, float]] = None, models: Dict[str, str] = None,
+                 slots: int = WINDOW_SLOTS):
+        self.global_limits = global_limits or {}
+        self.default_limits = default_limits or {}
+        self.client_limits = client_limits or {}
+        # Endpoint -> model used for pricing before the response says which model answered
+        self.models = models or {}
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.total = _Spend(self.global_limits, slots)
+        self.clients: "OrderedDict[str, _Spend]" = OrderedDict()
+        # Counters for /proxy/stats
+        self.allowed = 0
+        self.rejected = {"global": 0, "client": 0}
+        self.rejected_windows = {window: 0 for window in WINDOWS}
+        self.estimated_usd = 0.0
+        self.actual_usd = 0.0
+        self.settled = 0
+        self.overflowed = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "BudgetGuard":
+        """Tạo từ section `budget` của proxy.yaml"""
+        default = parse_limits(config.get("default") or {})
+        clients = {config_client_id(name): parse_limits(data or {}, default)
+                   for name, data in (config.get("clients") or {}).items()}
+        return cls(parse_limits(config.get("global") or {}), default, clients,
+                   {str(name): str(model) for name, model in (config.get("models") or {}).items()},
+                   int(config.get("slots", WINDOW_SLOTS)))
+
+    def estimate(self, path: str, payload: Dict[str, Any]) -> TokenEstimate:
+        """Tokens và model để tính giá: model của endpoint trong `models`, không thì `model` của request"""
+        return estimate_tokens(payload, self.models.get(endpoint_name(path)))
+
+    def _client(self, client: str, now: float) -> Tuple[str, _Spend]:
+        """(key, spend) của client; key là OVERFLOW_CLIENT khi đã đủ MAX_CLIENTS mà không client nào idle"""
+        spend = self.clients.get(client)
+        if spend is not None:
+            self.clients.move_to_end(client)
+            return client, spend
+        while len(self.clients) >= MAX_CLIENTS:
+            oldest = next(iter(self.clients))
+            if not self.clients[oldest].idle(now):
+                break
+            del self.clients[oldest]
+        # Clients with their own limits in proxy.yaml are always tracked (bounded by the config)
+        if len(self.clients) >= MAX_CLIENTS and client not in self.client_limits:
+            self.overflowed += 1
+            client = OVERFLOW_CLIENT
+            spend = self.clients.get(client)
+            if spend is not None:
+                self.clients.move_to_end(client)
+                return client, spend
+        spend = self.clients[client] = _Spend(self.client_limits.get(client, self.default_limits), self.slots)
+        return client, spend
+
+    def reserve(self, client: str, path: str, payload: Dict[str, Any]) -> BudgetDecision:
+        """Giữ chỗ chi phí tối đa của request; mọi window của client và global phải còn đủ budget"""
+        estimate = self.estimate(path, payload)
+        cost = estimate.cost
+        now = time.time()
+        with self.lock:
+            # Settle adjusts whichever spend was charged, so the reservation keeps the resolved key
+            client, spend = self._client(client, now)
+            for scope, tracker in (("global", self.total), ("client", spend)):
+                window = tracker.exceeded(cost, now)
+                if window is not None:
+                    self.rejected[scope] += 1
+                    self.rejected_windows[window] += 1
+                    retry_after = tracker.windows[window].retry_after(tracker.limits[window], cost, now)
+                    return BudgetDecision(False, None, scope, window,
+                                          WINDOWS[window] if retry_after is None else retry_after)
+            self.total.add(cost, now)
+            spend.add(cost, now)
+            self.allowed += 1
+        return BudgetDecision(True, Reservation(client, estimate, cost, now))
+
+    def settle(self, reservation: Reservation, actual_cost: float):
+        """Thay chi phí đã giữ chỗ bằng chi phí thật (0 nếu request lỗi hoặc không gọi provider)"""
+        delta = actual_cost - reservation.cost
+        with self.lock:
+            self.settled += 1
+            self.estimated_usd += reservation.cost
+            self.actual_usd += actual_cost
+            if delta:
+                self.total.adjust(delta, reservation.at)
+                spend = self.clients.get(reservation.client)
+                if spend is not None:
+                    spend.adjust(delta, reservation.at)
+
+    def settle_usage(self, reservation: Reservation, status: int, model: Optional[str],
+                     prompt_tokens: Optional[int], completion_tokens: Optional[int], shared: bool = False):
+        """settle() theo kết quả của request: usage của response; 200 không có usage (streaming) giữ ước lượng;
+        lỗi và response dùng chung của coalescing không tốn thêm"""
+        if status != 200 or shared:
+            cost = 0.0
+        elif prompt_tokens is None and completion_tokens is None:
+            cost = reservation.cost
+        else:
+            cost = price_token_totals(prompt_tokens or 0, completion_tokens or 0, model or reservation.estimate.model)
+        self.settle(reservation, cost)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        with self.lock:
+            top: List[Tuple[float, Dict[str, Any]]] = []
+            for client, spend in self.clients.items():
+                windows = spend.to_dict(now)
+                if windows:
+                    # Ranked by spend in the longest window the client is limited on
+                    longest = max(windows, key=WINDOWS.get)
+                    top.append((windows[longest]["spent"], {"client": redact_client(client), "windows": windows}))
+            top.sort(key=lambda item: item[0], reverse=True)
+            return {
+                "global": self.total.to_dict(now),
+                "default": dict(self.default_limits),
+                "client_overrides": len(self.client_limits),
+                "models": dict(self.models),
+                "clients": len(self.clients),
+                "overflowed": self.overflowed,
+                "allowed": self.allowed,
+                "rejected": dict(self.rejected),
+                "rejected_windows": dict(self.rejected_windows),
+                "settled": self.settled,
+                "estimated_usd": self.estimated_usd,
+                "actual_usd": self.actual_usd,
+                "top_clients": [item for _, item in top[:TOP_CLIENTS]]
+            }
@@ -0,0 +1,228 @@
+"""
+Cost Engine
+Bảng giá dùng chung và tính chi phí theo batch (columnar) cho analyze_costs.py và evaluate_gateway.py
+"""
+
+import json
+import re
+from array import array
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Pricing per 1K tokens (2024-2025). Variants ("-mini", "-nano") are priced very differently from their base model,
+# so each one needs its own entry
+PRICING = {
+    "gpt-3.5-turbo": {"input": 0.0005, "output": 0.0015},
+    "gpt-4": {"input": 0.03, "output": 0.06},
+    "gpt-4-turbo": {"input": 0.01, "output": 0.03},
+    "gpt-4o": {"input": 0.005, "output": 0.015},
+    "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
+    "gpt-4.1": {"input": 0.002, "output": 0.008},
+    "gpt-4.1-mini": {"input": 0.0004, "output": 0.0016},
+    "gpt-4.1-nano": {"input": 0.0001, "output": 0.0004}
+}
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_ENDPOINT = "chat"
+
+# Snapshot suffixes of the same model: "-2024-08-06", "-0613", "-preview", "-latest"
+_VERSION_SUFFIX = re.compile(r"-(?:\d{4}-\d{2}-\d{2}|\d{4}|preview|latest)$")
+# Models priced with DEFAULT_MODEL because they are not in PRICING (reported by unknown_models())
+_unknown_models = set()
+
+def resolve_pricing_model(model: Optional[str]) -> str:
+    """Model trong PRICING dùng để tính giá: khớp chính xác, hoặc model + version suffix ("gpt-4o-2024-08-06");
+    model khác (vd. "gpt-4o-audio") được ghi lại trong unknown_models() và tính theo DEFAULT_MODEL"""
+    if not model:
+        return DEFAULT_MODEL
+    if model in PRICING:
+        return model
+    base = _VERSION_SUFFIX.sub("", model)
+    if base in PRICING:
+        return base
+    _unknown_models.add(model)
+    return DEFAULT_MODEL
+
+def unknown_models() -> List[str]:
+    """Models đã gặp mà không có trong PRICING (đã bị tính giá theo DEFAULT_MODEL)"""
+    # copy() is atomic, so proxy threads adding models meanwhile do not break the iteration
+    return sorted(_unknown_models.copy())
+
+def warn_unknown_models(file: Any = None):
+    """In cảnh báo nếu có model được tính giá theo DEFAULT_MODEL"""
+    models = unknown_models()
+    if models:
+        print(f"\n⚠ Not in the pricing table (priced as {DEFAULT_MODEL}): {', '.join(models)}. "
+              f"Add them to PRICING in cost_engine.py or pass --model.", file=file)
+
+def calculate_cost(usage: Dict[str, Any], model: str = DEFAULT_MODEL) -> Dict[str, Any]:
+    """Tính chi phí cho một usage dict"""
+    model = resolve_pricing_model(model)
+
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
+
+    input_cost = (prompt_tokens / 1000) * PRICING[model]["input"]
+    output_cost = (completion_tokens / 1000) * PRICING[model]["output"]
+    total_cost = input_cost + output_cost
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "input_cost": input_cost,
+        "output_cost": output_cost,
+        "total_cost": total_cost,
+        "model": model
+    }
+
+def response_usage(body: bytes) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(model, usage) từ response body JSON của một invocation; None nếu không parse được hoặc không có usage"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("usage"), dict):
+        return None
+    return data.get("model") or DEFAULT_MODEL, data["usage"]
+
+def endpoint_name(path: str) -> str:
+    """Tên endpoint từ path /gateway/<name>/invocations"""
+    parts = [part for part in path.split("/") if part]
+    if len(parts) >= 3 and parts[0] == "gateway":
+        return parts[1]
+    return path or DEFAULT_ENDPOINT
+
+class UsageColumns:
+    """Usage records lưu dạng cột (token arrays + model/endpoint ids đã dictionary-encode)"""
+
+    def __init__(self):
+        self.prompt_tokens = array("q")
+        self.completion_tokens = array("q")
+        self.model_ids = array("l")
+        self.endpoint_ids = array("l")
+        self.models: List[str] = []
+        self.endpoints: List[str] = []
+        self._model_index: Dict[str, int] = {}
+        self._endpoint_index: Dict[str, int] = {}
+
+    @classmethod
+    def from_arrays(cls, prompt_tokens, completion_tokens, model_ids, models: List[str], endpoint_ids,
+                    endpoints: List[str]) -> "UsageColumns":
+        """Dùng trực tiếp các cột đã có (vd. từ results_store.py), không copy từng record"""
+        columns = cls()
+        columns.prompt_tokens = prompt_tokens
+        columns.completion_tokens = completion_tokens
+        columns.model_ids = model_ids
+        columns.endpoint_ids = endpoint_ids
+        columns.models = models
+        columns.endpoints = endpoints
+        columns._model_index = {name: i for i, name in enumerate(models)}
+        columns._endpoint_index = {name: i for i, name in enumerate(endpoints)}
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.prompt_tokens)
+
+    @staticmethod
+    def _encode(value: str, names: List[str], index: Dict[str, int]) -> int:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(names)
+            names.append(value)
+        return code
+
+    def append(self, prompt_tokens: int, completion_tokens: int, model: str = DEFAULT_MODEL,
+               endpoint: str = DEFAULT_ENDPOINT):
+        self.prompt_tokens.append(int(prompt_tokens or 0))
+        self.completion_tokens.append(int(completion_tokens or 0))
+        self.model_ids.append(self._encode(model or DEFAULT_MODEL, self.models, self._model_index))
+        self.endpoint_ids.append(self._encode(endpoint or DEFAULT_ENDPOINT, self.endpoints, self._endpoint_index))
+
+    def append_usage(self, usage: Dict[str, Any], model: str = DEFAULT_MODEL, endpoint: str = DEFAULT_ENDPOINT):
+        self.append(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), model, endpoint)
+
+    def _rates(self):
+        """Giá input/output per token theo model id"""
+        input_rates = [PRICING[resolve_pricing_model(model)]["input"] / 1000 for model in self.models]
+        output_rates = [PRICING[resolve_pricing_model(model)]["output"] / 1000 for model in self.models]
+        return input_rates, output_rates
+
+    def compute_costs(self) -> Dict[str, Any]:
+        """Chi phí từng record, tính một lần cho cả batch (numpy nếu có, không thì pure Python)"""
+        input_rates, output_rates = self._rates()
+        if np is not None:
+            prompt = np.frombuffer(self.prompt_tokens, dtype=np.int64).astype(np.float64)
+            completion = np.frombuffer(self.completion_tokens, dtype=np.int64).astype(np.float64)
+            model_ids = np.frombuffer(self.model_ids, dtype=np.dtype(f"i{self.model_ids.itemsize}"))
+            input_cost = prompt * np.asarray(input_rates, dtype=np.float64)[model_ids] if len(self) else prompt
+            output_cost = completion * np.asarray(output_rates, dtype=np.float64)[model_ids] if len(self) else completion
+            return {"input_cost": input_cost, "output_cost": output_cost, "total_cost": input_cost + output_cost}
+        input_cost = [p * input_rates[m] for p, m in zip(self.prompt_tokens, self.model_ids)]
+        output_cost = [c * output_rates[m] for c, m in zip(self.completion_tokens, self.model_ids)]
+        return {
+            "input_cost": input_cost,
+            "output_cost": output_cost,
+            "total_cost": [i + o for i, o in zip(input_cost, output_cost)]
+        }
+
+    def group_by(self, column: str = "model") -> Dict[str, Dict[str, Any]]:
+        """Tổng requests/tokens/cost theo model hoặc endpoint"""
+        if column == "model":
+            ids, names = self.model_ids, self.models
+        elif column == "endpoint":
+            ids, names = self.endpoint_ids, self.endpoints
+        else:
+            raise ValueError(f"Unknown group-by column: {column}")
+        costs = self.compute_costs()
+        if np is not None and len(self):
+            keys = np.frombuffer(ids, dtype=np.dtype(f"i{ids.itemsize}"))
+            size = len(names)
+            counts = np.bincount(keys, minlength=size)
+            prompt = np.bincount(keys, weights=np.frombuffer(self.prompt_tokens, dtype=np.int64), minlength=size)
+            completion = np.bincount(keys, weights=np.frombuffer(self.completion_tokens, dtype=np.int64), minlength=size)
+            cost = np.bincount(keys, weights=costs["total_cost"], minlength=size)
+            return {
+                name: {
+                    "requests": int(counts[i]),
+                    "prompt_tokens": int(prompt[i]),
+                    "completion_tokens": int(completion[i]),
+                    "total_cost": float(cost[i])
+                }
+                for i, name in enumerate(names)
+            }
+        groups = {name: {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_cost": 0.0} for name in names}
+        for key, p, c, cost in zip(ids, self.prompt_tokens, self.completion_tokens, costs["total_cost"]):
+            group = groups[names[key]]
+            group["requests"] += 1
+            group["prompt_tokens"] += p
+            group["completion_tokens"] += c
+            group["total_cost"] += cost
+        return groups
+
+    def totals(self) -> Dict[str, Any]:
+        """Tổng toàn bộ batch"""
+        costs = self.compute_costs()
+        prompt = sum(self.prompt_tokens)
+        completion = sum(self.completion_tokens)
+        return {
+            "requests": len(self),
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "input_cost": _sum(costs["input_cost"]),
+            "output_cost": _sum(costs["output_cost"]),
+            "total_cost": _sum(costs["total_cost"])
+        }
+
+def _sum(values) -> float:
+    return float(values.sum()) if hasattr(values, "sum") else float(sum(values))
+
+def price_token_totals(prompt_tokens: int, completion_tokens: int, model: str = DEFAULT_MODEL) -> float:
+    """Chi phí của tổng tokens đã gộp theo model (chi phí tuyến tính theo tokens nên không cần từng record)"""
+    pricing = PRICING[resolve_pricing_model(model)]
+    return (prompt_tokens / 1000) * pricing["input"] + (completion_tokens / 1000) * pricing["output"]
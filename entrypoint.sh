@@ -16,6 +16,14 @@ echo "✓ OPENAI_API_KEY is set (length: ${#OPENAI_API_KEY})"
 # Export to ensure it's available
 export OPENAI_API_KEY
 
+# Optional: point the openai provider at another OpenAI-compatible base URL
+# (e.g. the local mock upstream from docker-compose.mock.yml)
+OPENAI_API_BASE_CONFIG=""
+if [ -n "$OPENAI_API_BASE" ]; then
+    OPENAI_API_BASE_CONFIG="        openai_api_base: ${OPENAI_API_BASE}"
+    echo "✓ Using OpenAI API base: ${OPENAI_API_BASE}"
+fi
+
 # Create dynamic config.yaml with actual API key value
 # This ensures MLflow can read the API key directly
 cat > /opt/mlflow/config.yaml << EOF
@@ -28,6 +36,7 @@ endpoints:
       config:
         openai_api_key: ${OPENAI_API_KEY}
         temperature: 0.7
+${OPENAI_API_BASE_CONFIG}
 EOF
 
 echo "✓ Created config.yaml with API key"
@@ -40,5 +49,5 @@ exec mlflow gateway start \
     --config-path /opt/mlflow/config.yaml \
     --host 0.0.0.0 \
     --port 5000 \
-    --workers 4
+    --workers "${GATEWAY_WORKERS:-4}"
 
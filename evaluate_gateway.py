@@ -5,28 +5,148 @@ MLflow Gateway Evaluation Script
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.retry import Retry
 import json
 import sys
 import time
 import os
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional
+
+from cost_engine import UsageColumns, calculate_cost, endpoint_name
+from latency_histogram import LatencyHistogram, ThroughputTracker, format_latency_summary
 
 # Configuration
 GATEWAY_URL = os.getenv("GATEWAY_URL", "http://localhost:5000")
 ENDPOINT = "/gateway/chat/invocations"
 TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "60"))
+# Max in-flight requests for open-loop (--rps) load when --concurrency is not set
+LOAD_MAX_IN_FLIGHT = int(os.getenv("LOAD_MAX_IN_FLIGHT", "64"))
+# HTTP session pooling
+POOL_SIZE = int(os.getenv("POOL_SIZE", "64"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "0"))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", "0.5"))
+# Only 503 (no upstream available / overloaded before processing) is retried: after a 502 or 504 nginx has
+# already sent the request upstream, and a 504 timeout is the case where the provider most likely billed it
+RETRY_STATUSES = (503,)
+# Width of the throughput time windows in the summary
+THROUGHPUT_WINDOW = float(os.getenv("THROUGHPUT_WINDOW", "1.0"))
+
+DEFAULT_TEST_CASES = [
+    {
+        "name": "Simple Question",
+        "messages": [{"role": "user", "content": "What is artificial intelligence?"}],
+        "temperature": 0.7,
+        "max_tokens": 200
+    },
+    {
+        "name": "Multi-turn Conversation",
+        "messages": [
+            {"role": "user", "content": "Explain machine learning"},
+            {"role": "assistant", "content": "Machine learning is a method of data analysis."},
+            {"role": "user", "content": "Give me a practical example"}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 300
+    }
+]
+
+# Seconds spent in connect() (TCP + TLS) by the current thread since the last reset.
+# Stays 0 when the request reuses a pooled keep-alive connection.
+_connect_timing = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter dùng connection pool có đo thời gian connect"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+def create_session(pool_size: int = POOL_SIZE, keep_alive: bool = True,
+                   retries: int = MAX_RETRIES, backoff: float = RETRY_BACKOFF) -> requests.Session:
+    """Tạo requests.Session với connection pool, keep-alive và retry"""
+    # Only retry connect errors (request never sent) and RETRY_STATUSES; a read error or a 502/504 on POST
+    # may already have been billed upstream, so it is never retried
+    retry = Retry(
+        total=retries,
+        read=0,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        raise_on_status=False
+    )
+    adapter = PooledAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+def request_not_sent(error: Exception) -> bool:
+    """Lỗi xảy ra trước khi request tới được gateway (không kết nối được): gửi lại không bị tính tiền hai lần"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError; NewConnectionError (refused, DNS) is a ConnectTimeoutError
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), ConnectTimeoutError)
 
 class GatewayEvaluator:
-    def __init__(self, gateway_url: str = GATEWAY_URL):
+    def __init__(self, gateway_url: str = GATEWAY_URL, session: requests.Session = None,
+                 timing_breakdown: bool = False, stream: bool = False, endpoint: str = ENDPOINT,
+                 keep_results: bool = True, result_sink: Callable[[Dict[str, Any]], None] = None):
         self.gateway_url = gateway_url
-        self.endpoint = f"{gateway_url}{ENDPOINT}"
+        self.endpoint_path = endpoint
+        self.endpoint = f"{gateway_url}{endpoint}"
         self.results = []
+        # Long runs (replay) stream each result to result_sink instead of keeping them in self.results
+        self.keep_results = keep_results
+        self.result_sink = result_sink
+        self.session = session or create_session()
+        self.timing_breakdown = timing_breakdown
+        self.stream = stream
+        self.histogram = LatencyHistogram()
+        self.throughput = ThroughputTracker(THROUGHPUT_WINDOW)
+        # Streaming only: time to first token and gaps between consecutive tokens
+        self.ttft_histogram = LatencyHistogram()
+        self.inter_token_histogram = LatencyHistogram()
+        # Per-request tokens/sec of streamed requests: count, sum, min, max
+        self.token_rates = [0, 0.0, None, None]
+        self._record_lock = threading.Lock()
         
     def check_health(self) -> bool:
         """Kiểm tra health endpoint"""
         try:
-            response = requests.get(f"{self.gateway_url}/health", timeout=5)
+            response = self.session.get(f"{self.gateway_url}/health", timeout=5)
             if response.status_code == 200:
                 print(f"✓ Health check passed: {response.json()}")
                 return True
@@ -37,27 +157,94 @@ class GatewayEvaluator:
             print(f"✗ Health check error: {e}")
             return False
     
-    def send_request(self, messages: list, temperature: float = 0.7, max_tokens: int = 500) -> Optional[Dict[str, Any]]:
-        """Gửi request đến gateway và trả về response với usage info"""
+    def _record_result(self, result: Dict[str, Any]):
+        """Lưu result và cập nhật histogram/throughput ngay khi request hoàn thành"""
+        latency = result["response_time"] + result.get("queue_time", 0.0)
+        with self._record_lock:
+            if self.keep_results:
+                self.results.append(result)
+            # Connection errors fail before any latency is observed; keep them out of the percentiles
+            if latency > 0:
+                self.histogram.record(latency)
+            if "ttft" in result:
+                self.ttft_histogram.record(result["ttft"])
+                for gap in result.pop("inter_token_times", ()):
+                    self.inter_token_histogram.record(gap)
+            if "tokens_per_sec" in result:
+                rate = result["tokens_per_sec"]
+                rates = self.token_rates
+                rates[0] += 1
+                rates[1] += rate
+                rates[2] = rate if rates[2] is None else min(rates[2], rate)
+                rates[3] = rate if rates[3] is None else max(rates[3], rate)
+            self.throughput.record(time.time())
+        if self.result_sink is not None:
+            self.result_sink(result)
+    
+    def send_request(self, messages: list, temperature: float = 0.7, max_tokens: int = 500,
+                     queue_time: float = None, path: str = None,
+                     extra: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """Gửi request đến gateway và trả về response với usage info; path/extra: endpoint và payload fields
+        khác (vd. khi replay traffic đã ghi)"""
         headers = {"Content-Type": "application/json"}
-        payload = {
+        payload = dict(extra or {})
+        payload.update({
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
-        }
+        })
+        # None = leave the field out and let the provider default apply
+        payload = {name: value for name, value in payload.items() if value is not None}
+        if self.stream:
+            payload["stream"] = True
+        path = path or self.endpoint_path
         
+        _connect_timing.seconds = 0.0
         start_time = time.time()
         try:
-            response = requests.post(self.endpoint, headers=headers, json=payload, timeout=TIMEOUT)
+            response = self.session.post(f"{self.gateway_url}{path}", headers=headers, json=payload,
+                                         timeout=TIMEOUT, stream=self.stream)
+            stream_data = None
+            if self.stream and response.status_code == 200:
+                stream_data = self._read_event_stream(response, start_time)
             elapsed_time = time.time() - start_time
             
             result = {
                 "status_code": response.status_code,
+                "endpoint": endpoint_name(path),
                 "response_time": elapsed_time,
                 "timestamp": datetime.now().isoformat()
             }
             
-            if response.status_code == 200:
+            # Set when the request went through gateway_proxy.py
+            if "X-Cache" in response.headers:
+                result["cache"] = response.headers["X-Cache"]
+            if "X-Coalesced" in response.headers:
+                result["coalesced"] = response.headers["X-Coalesced"] == "1"
+            if "X-Gateway-Backend" in response.headers:
+                # Logical route: attribute cost/latency to the endpoint that actually served it
+                result["route"] = result["endpoint"]
+                result["endpoint"] = response.headers["X-Gateway-Backend"]
+            if response.status_code == 429 and response.headers.get("Retry-After", "").isdigit():
+                result["retry_after"] = int(response.headers["Retry-After"])
+            
+            if self.timing_breakdown:
+                # response.elapsed covers connect + send + wait until response headers
+                connect_time = _connect_timing.seconds
+                headers_time = response.elapsed.total_seconds()
+                result["connect_time"] = connect_time
+                result["server_time"] = max(0.0, headers_time - connect_time)
+                result["transfer_time"] = max(0.0, elapsed_time - headers_time)
+            
+            if stream_data is not None:
+                data, stream_timing = stream_data
+                result["success"] = True
+                result["response"] = data
+                result.update(stream_timing)
+                if "usage" in data:
+                    result["usage"] = data["usage"]
+                result["content"] = data["choices"][0]["message"]["content"]
+            elif response.status_code == 200:
                 data = response.json()
                 result["success"] = True
                 result["response"] = data
@@ -79,56 +266,82 @@ class GatewayEvaluator:
                 result["success"] = False
                 result["error"] = response.text
                 
-            self.results.append(result)
+            if queue_time is not None:
+                result["queue_time"] = queue_time
+            self._record_result(result)
             return result
             
-        except requests.exceptions.Timeout:
+        except requests.exceptions.Timeout as e:
             result = {
                 "success": False,
                 "error": f"Request timeout after {TIMEOUT}s",
                 "status_code": 0,
+                "not_sent": request_not_sent(e),
                 "response_time": TIMEOUT,
                 "timestamp": datetime.now().isoformat()
             }
-            self.results.append(result)
+            if queue_time is not None:
+                result["queue_time"] = queue_time
+            self._record_result(result)
             return result
         except Exception as e:
             result = {
                 "success": False,
                 "error": str(e),
                 "status_code": 0,
+                "not_sent": request_not_sent(e),
                 "response_time": 0,
                 "timestamp": datetime.now().isoformat()
             }
-            self.results.append(result)
+            if queue_time is not None:
+                result["queue_time"] = queue_time
+            self._record_result(result)
             return result
     
+    def _read_event_stream(self, response: requests.Response, start_time: float):
+        """Đọc SSE stream theo từng event khi nhận được; trả về (response đã ghép, streaming timings)"""
+        content = []
+        token_times = []
+        data = {}
+        # chunk_size=None yields each chunk as it arrives instead of waiting to fill a buffer
+        for line in response.iter_lines(chunk_size=None):
+            if not line.startswith(b"data:"):
+                continue
+            event = line[5:].strip()
+            if event == b"[DONE]":
+                break
+            chunk = json.loads(event)
+            if not data:
+                data = {"id": chunk.get("id"), "object": "chat.completion", "model": chunk.get("model")}
+            if chunk.get("usage"):
+                data["usage"] = chunk["usage"]
+            for choice in chunk.get("choices") or ():
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    token_times.append(time.time())
+                    content.append(delta["content"])
+                if choice.get("finish_reason"):
+                    data["finish_reason"] = choice["finish_reason"]
+        data["choices"] = [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(content)},
+            "finish_reason": data.pop("finish_reason", None)
+        }]
+
+        timing = {"chunks": len(token_times)}
+        if token_times:
+            timing["ttft"] = token_times[0] - start_time
+            timing["inter_token_times"] = [b - a for a, b in zip(token_times, token_times[1:])]
+            # Generation rate after the first token; one content delta ≈ one token when usage is absent
+            tokens = data.get("usage", {}).get("completion_tokens") or len(token_times)
+            generation_time = token_times[-1] - token_times[0]
+            if generation_time > 0:
+                timing["tokens_per_sec"] = (tokens - 1) / generation_time
+        return data, timing
+
     def calculate_cost(self, usage: Dict[str, Any], model: str = "gpt-3.5-turbo") -> Dict[str, float]:
         """Tính toán chi phí dựa trên token usage"""
-        pricing = {
-            "gpt-3.5-turbo": {"input": 0.0005, "output": 0.0015},
-            "gpt-4": {"input": 0.03, "output": 0.06},
-            "gpt-4-turbo": {"input": 0.01, "output": 0.03},
-            "gpt-4o": {"input": 0.005, "output": 0.015}
-        }
-        
-        if model not in pricing:
-            model = "gpt-3.5-turbo"
-        
-        prompt_tokens = usage.get("prompt_tokens", 0)
-        completion_tokens = usage.get("completion_tokens", 0)
-        
-        input_cost = (prompt_tokens / 1000) * pricing[model]["input"]
-        output_cost = (completion_tokens / 1000) * pricing[model]["output"]
-        total_cost = input_cost + output_cost
-        
-        return {
-            "input_cost": input_cost,
-            "output_cost": output_cost,
-            "total_cost": total_cost,
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens
-        }
+        return calculate_cost(usage, model)
     
     def evaluate(self, test_cases: list = None):
         """Chạy evaluation với test cases"""
@@ -145,24 +358,7 @@ class GatewayEvaluator:
         
         # Default test cases
         if test_cases is None:
-            test_cases = [
-                {
-                    "name": "Simple Question",
-                    "messages": [{"role": "user", "content": "What is artificial intelligence?"}],
-                    "temperature": 0.7,
-                    "max_tokens": 200
-                },
-                {
-                    "name": "Multi-turn Conversation",
-                    "messages": [
-                        {"role": "user", "content": "Explain machine learning"},
-                        {"role": "assistant", "content": "Machine learning is a method of data analysis."},
-                        {"role": "user", "content": "Give me a practical example"}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 300
-                }
-            ]
+            test_cases = DEFAULT_TEST_CASES
         
         # Run test cases
         total_cost = 0.0
@@ -182,6 +378,12 @@ class GatewayEvaluator:
             if result["success"]:
                 successful_requests += 1
                 print(f"✓ Request successful (Status: {result['status_code']}, Time: {result['response_time']:.2f}s)")
+                if self.timing_breakdown:
+                    print(f"  Connect: {result['connect_time'] * 1000:.1f}ms, Server: {result['server_time'] * 1000:.1f}ms, "
+                          f"Transfer: {result['transfer_time'] * 1000:.1f}ms")
+                if "ttft" in result:
+                    rate = f", {result['tokens_per_sec']:.1f} tokens/s" if "tokens_per_sec" in result else ""
+                    print(f"  TTFT: {result['ttft'] * 1000:.1f}ms, {result['chunks']} chunk(s){rate}")
                 
                 if "usage" in result:
                     usage = result["usage"]
@@ -237,12 +439,272 @@ class GatewayEvaluator:
             print("  3. Rate limit exceeded - Wait and retry")
             print("  4. Network connectivity issues - Check internet connection")
             print("\nGateway is working correctly. The issue is with OpenAI API access.")
+        self.print_latency_report()
         
         return {
             "total_requests": len(test_cases),
             "successful": successful_requests,
             "failed": len(test_cases) - successful_requests,
             "total_cost": total_cost,
+            "latency": self.histogram.summary(),
+            "streaming": self.stream_summary() if self.stream else None,
+            "throughput": self.throughput.summary(),
+            "results": self.results
+        }
+
+    def stream_summary(self) -> Dict[str, Any]:
+        """TTFT, inter-token latency và tokens/sec của các streamed requests"""
+        count, total, lowest, highest = self.token_rates
+        return {
+            "ttft": self.ttft_histogram.summary(),
+            "inter_token": self.inter_token_histogram.summary(),
+            "tokens_per_sec": {
+                "count": count,
+                "mean": total / count if count else 0.0,
+                "min": lowest or 0.0,
+                "max": highest or 0.0
+            }
+        }
+
+    def print_latency_report(self):
+        """In latency percentiles và throughput theo time window"""
+        print(f"\nLatency:")
+        for line in format_latency_summary(self.histogram.summary()):
+            print(line)
+        if self.stream:
+            stream = self.stream_summary()
+            print("Time to First Token:")
+            for line in format_latency_summary(stream["ttft"]):
+                print(line)
+            print("Inter-token Latency:")
+            for line in format_latency_summary(stream["inter_token"]):
+                print(line)
+            rates = stream["tokens_per_sec"]
+            if rates["count"]:
+                print(f"Tokens/sec (per request): min: {rates['min']:.1f}, mean: {rates['mean']:.1f}, "
+                      f"max: {rates['max']:.1f}")
+        throughput = self.throughput.summary()
+        if throughput["windows"]:
+            print(f"Throughput ({throughput['window']:g}s windows):")
+            print(f"  min: {throughput['min_rps']:.2f} req/s, mean: {throughput['mean_rps']:.2f} req/s, "
+                  f"max: {throughput['max_rps']:.2f} req/s")
+
+    def _send_test_case(self, test_case: Dict[str, Any], scheduled_at: float = None) -> Dict[str, Any]:
+        """Gửi một test case; với open-loop ghi thêm queue_time (thời gian chờ slot trống)"""
+        queue_time = None
+        if scheduled_at is not None:
+            queue_time = max(0.0, time.monotonic() - scheduled_at)
+        result = self.send_request(
+            test_case["messages"],
+            test_case.get("temperature", 0.7),
+            test_case.get("max_tokens", 500),
+            queue_time
+        )
+        result["test_name"] = test_case.get("name", "")
+        return result
+
+    def run_load(self, test_cases: list = None, concurrency: int = None, rps: float = None,
+                 duration: float = 30.0) -> Dict[str, Any]:
+        """Chạy load test: closed-loop (giữ N requests in-flight) hoặc open-loop (arrival rate cố định)"""
+        if test_cases is None:
+            test_cases = DEFAULT_TEST_CASES
+
+        if rps:
+            mode = "open-loop"
+            max_in_flight = concurrency or LOAD_MAX_IN_FLIGHT
+        else:
+            mode = "closed-loop"
+            max_in_flight = concurrency or 1
+
+        print("=" * 70)
+        print("MLflow Gateway Load Test")
+        print(f"Gateway URL: {self.gateway_url}")
+        print(f"Mode: {mode}")
+        if rps:
+            print(f"Arrival rate: {rps:g} req/s (max in-flight: {max_in_flight})")
+        else:
+            print(f"Concurrency: {max_in_flight}")
+        print(f"Duration: {duration:g}s")
+        print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 70)
+
+        if not self.check_health():
+            print("\n✗ Gateway health check failed. Exiting.")
+            sys.exit(1)
+
+        first_result = len(self.results)
+        cases = itertools.cycle(test_cases)
+        cases_lock = threading.Lock()
+
+        def next_case() -> Dict[str, Any]:
+            with cases_lock:
+                return next(cases)
+
+        start = time.monotonic()
+        deadline = start + duration
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            if rps:
+                # Open-loop: arrivals follow the schedule regardless of how fast the gateway answers,
+                # so saturation shows up as growing queue_time instead of a silently lower rate
+                interval = 1.0 / rps
+                sent = 0
+                next_at = start
+                while next_at < deadline:
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    pool.submit(self._send_test_case, next_case(), next_at)
+                    sent += 1
+                    next_at = start + sent * interval
+            else:
+                # Closed-loop: each worker sends its next request as soon as the previous one returns
+                def worker():
+                    while time.monotonic() < deadline:
+                        self._send_test_case(next_case())
+
+                for _ in range(max_in_flight):
+                    pool.submit(worker)
+
+        elapsed = time.monotonic() - start
+        load_results = self.results[first_result:]
+        successful = sum(1 for r in load_results if r.get("success"))
+        status_counts = {}
+        for r in load_results:
+            status_counts[r.get("status_code", 0)] = status_counts.get(r.get("status_code", 0), 0) + 1
+
+        print(f"\n{'=' * 70}")
+        print("Load Test Summary")
+        print(f"{'=' * 70}")
+        print(f"Total Requests: {len(load_results)}")
+        print(f"Successful: {successful}")
+        print(f"Failed: {len(load_results) - successful}")
+        print(f"Elapsed: {elapsed:.2f}s")
+        print(f"Throughput: {len(load_results) / elapsed:.2f} req/s" if elapsed > 0 else "Throughput: N/A")
+        timed = [r for r in load_results if "connect_time" in r]
+        if timed:
+            new_connections = sum(1 for r in timed if r["connect_time"] > 0)
+            print(f"Mean Connect Time: {sum(r['connect_time'] for r in timed) / len(timed) * 1000:.2f}ms "
+                  f"({new_connections} new connection(s))")
+            print(f"Mean Server Time: {sum(r['server_time'] for r in timed) / len(timed) * 1000:.2f}ms")
+        print("Status Codes:")
+        for status, count in sorted(status_counts.items()):
+            print(f"  {status if status else 'error'}: {count}")
+
+        # Price all responses in one batch instead of per request
+        columns = UsageColumns()
+        for r in load_results:
+            if r.get("usage"):
+                columns.append_usage(r["usage"], r.get("response", {}).get("model"), r.get("endpoint"))
+        cost_totals = columns.totals()
+        if len(columns):
+            print(f"Total Cost: ${cost_totals['total_cost']:.6f} ({cost_totals['total_tokens']:,} tokens)")
+            by_model = columns.group_by("model")
+            if len(by_model) > 1:
+                for name, group in sorted(by_model.items()):
+                    print(f"  {name}: {group['requests']} request(s), ${group['total_cost']:.6f}")
+        self.print_latency_report()
+
+        return {
+            "mode": mode,
+            "concurrency": max_in_flight,
+            "rps": rps,
+            "duration": duration,
+            "elapsed": elapsed,
+            "total_requests": len(load_results),
+            "successful": successful,
+            "failed": len(load_results) - successful,
+            "throughput": len(load_results) / elapsed if elapsed > 0 else 0.0,
+            "total_cost": cost_totals["total_cost"],
+            "latency": self.histogram.summary(),
+            "streaming": self.stream_summary() if self.stream else None,
+            "throughput_windows": self.throughput.summary(),
+            "results": self.results
+        }
+
+    def proxy_stats(self) -> Optional[Dict[str, Any]]:
+        """Stats của gateway_proxy.py (None nếu URL không phải proxy)"""
+        try:
+            response = self.session.get(f"{self.gateway_url}/proxy/stats", timeout=5)
+            if response.status_code == 200:
+                return response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+
+    def run_burst(self, test_cases: list = None, burst_size: int = 20, rounds: int = 5) -> Dict[str, Any]:
+        """Gửi `burst_size` requests giống hệt nhau cùng lúc, `rounds` lần; đếm upstream calls qua /proxy/stats"""
+        if test_cases is None:
+            test_cases = DEFAULT_TEST_CASES
+
+        print("=" * 70)
+        print("MLflow Gateway Burst Test (identical concurrent requests)")
+        print(f"Gateway URL: {self.gateway_url}")
+        print(f"Burst size: {burst_size}, rounds: {rounds}")
+        print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 70)
+
+        if not self.check_health():
+            print("\n✗ Gateway health check failed. Exiting.")
+            sys.exit(1)
+
+        before = self.proxy_stats()
+        first_result = len(self.results)
+        run_id = datetime.now().strftime("%H%M%S")
+
+        with ThreadPoolExecutor(max_workers=burst_size) as pool:
+            for round_index in range(rounds):
+                test_case = dict(test_cases[round_index % len(test_cases)])
+                # Unique suffix per round so rounds are not answered by the response cache
+                messages = [dict(message) for message in test_case["messages"]]
+                messages[-1]["content"] = f"{messages[-1]['content']} [burst {run_id}-{round_index}]"
+                test_case["messages"] = messages
+                # Deterministic, so the proxy's default coalescing applies (sampled requests are never merged)
+                test_case["temperature"] = 0
+                barrier = threading.Barrier(burst_size)
+
+                def send():
+                    barrier.wait()
+                    return self._send_test_case(test_case)
+
+                round_results = [f.result() for f in [pool.submit(send) for _ in range(burst_size)]]
+                shared = sum(1 for r in round_results if r.get("coalesced"))
+                ok = sum(1 for r in round_results if r.get("success"))
+                print(f"  Round {round_index + 1}: {ok}/{burst_size} successful, {shared} coalesced")
+
+        after = self.proxy_stats()
+        burst_results = self.results[first_result:]
+        successful = sum(1 for r in burst_results if r.get("success"))
+        coalesced = sum(1 for r in burst_results if r.get("coalesced"))
+
+        print(f"\n{'=' * 70}")
+        print("Burst Test Summary")
+        print(f"{'=' * 70}")
+        print(f"Client Requests: {len(burst_results)}")
+        print(f"Successful: {successful}")
+        print(f"Coalesced (X-Coalesced: 1): {coalesced}")
+        upstream_calls = None
+        if before is not None and after is not None:
+            upstream_calls = after["upstream_requests"] - before["upstream_requests"]
+            print(f"Upstream Calls (from /proxy/stats): {upstream_calls}")
+            if burst_results:
+                print(f"Upstream Call Reduction: {(1 - upstream_calls / len(burst_results)) * 100:.1f}%")
+            if after.get("coalescing"):
+                print(f"Proxy Coalescing Ratio (lifetime): {after['coalescing']['coalescing_ratio'] * 100:.1f}%")
+        else:
+            print("⚠ /proxy/stats not available: point --url at gateway_proxy.py to count upstream calls")
+        self.print_latency_report()
+
+        return {
+            "mode": "burst",
+            "burst_size": burst_size,
+            "rounds": rounds,
+            "total_requests": len(burst_results),
+            "successful": successful,
+            "failed": len(burst_results) - successful,
+            "coalesced": coalesced,
+            "upstream_calls": upstream_calls,
+            "latency": self.histogram.summary(),
             "results": self.results
         }
 
@@ -251,12 +713,35 @@ def main():
     
     parser = argparse.ArgumentParser(description="Evaluate MLflow Gateway")
     parser.add_argument("--url", default=GATEWAY_URL, help="Gateway URL")
+    parser.add_argument("--endpoint", default=ENDPOINT,
+                        help="Invocation path, e.g. /gateway/chat-auto/invocations for a proxy route")
     parser.add_argument("--test-file", help="JSON file with test cases")
     parser.add_argument("--output", help="Output file for results (JSON)")
+    parser.add_argument("--concurrency", type=int, help="Load mode: number of requests kept in flight")
+    parser.add_argument("--rps", type=float, help="Load mode: open-loop arrival rate (requests/second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Load mode: test duration in seconds")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help="HTTP connection pool size")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Retries on connection errors and 503 (502/504 are not retried: may be billed)")
+    parser.add_argument("--retry-backoff", type=float, default=RETRY_BACKOFF, help="Retry backoff factor (seconds)")
+    parser.add_argument("--no-keep-alive", action="store_true", help="Open a new connection for every request")
+    parser.add_argument("--timing-breakdown", action="store_true",
+                        help="Report connect time and server time separately for each request")
+    parser.add_argument("--burst", type=int,
+                        help="Burst mode: send this many identical requests at once (shows proxy coalescing)")
+    parser.add_argument("--burst-rounds", type=int, default=5, help="Burst mode: number of bursts")
+    parser.add_argument("--stream", action="store_true",
+                        help="Send stream: true and measure time-to-first-token, inter-token latency and tokens/sec")
+    parser.add_argument("--store", help="Also append per-request metrics to this columnar results store "
+                                        "(see results_store.py)")
+    parser.add_argument("--run", help="Run label in --store (default: current date/time)")
     
     args = parser.parse_args()
     
-    evaluator = GatewayEvaluator(args.url)
+    # Pool must hold at least one connection per in-flight request or urllib3 discards the extras
+    pool_size = max(args.pool_size, args.concurrency or 0, args.burst or 0)
+    session = create_session(pool_size, not args.no_keep_alive, args.retries, args.retry_backoff)
+    evaluator = GatewayEvaluator(args.url, session=session, timing_breakdown=args.timing_breakdown,
+                                 stream=args.stream, endpoint=args.endpoint)
     
     # Load test cases from file if provided
     test_cases = None
@@ -275,7 +760,12 @@ def main():
     
     # Run evaluation
     try:
-        summary = evaluator.evaluate(test_cases)
+        if args.burst:
+            summary = evaluator.run_burst(test_cases, args.burst, args.burst_rounds)
+        elif args.concurrency or args.rps:
+            summary = evaluator.run_load(test_cases, args.concurrency, args.rps, args.duration)
+        else:
+            summary = evaluator.evaluate(test_cases)
         
         # Save results if output file specified (or auto-save if not specified)
         output_file = args.output or "gateway_results.json"
@@ -287,6 +777,15 @@ def main():
             print(f"  python3 analyze_costs.py --response-file {output_file}")
         except Exception as e:
             print(f"✗ Error saving results: {e}")
+        if args.store:
+            from results_store import ResultsStore, row_from_result
+            run = args.run or datetime.now().strftime("%Y%m%d-%H%M%S")
+            try:
+                count = ResultsStore(args.store).append_rows(
+                    (row_from_result(result) for result in summary.get("results", [])), run)
+                print(f"✓ {count} request(s) appended to {args.store} (run '{run}')")
+            except (OSError, ValueError) as e:
+                print(f"✗ Error writing results store: {e}")
     except KeyboardInterrupt:
         print("\n\n⚠ Evaluation interrupted by user")
         sys.exit(1)
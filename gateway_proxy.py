@@ -0,0 +1,695 @@
+#!/usr/bin/env python3
+"""
+Gateway Proxy (sidecar)
+Reverse proxy đặt trước MLflow Gateway: cache và gộp (coalesce) requests tới chat endpoint, forward mọi request khác
+nguyên vẹn; stats ở /proxy/stats và Prometheus metrics ở /metrics
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from admission import AdmissionController, ClientResolver, estimate_request_tokens, redact_client
+from budget import BudgetGuard, WINDOWS
+from cost_engine import response_usage, unknown_models
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, GatewayMetrics
+from request_log import RequestLog, format_timestamp
+from response_cache import ResponseCache, cache_key
+from router import Router, FAILOVER_STATUSES, QUOTA_STATUSES, is_failover
+from semantic_cache import SemanticCache, SemanticQuery
+from single_flight import SingleFlight
+
+# Configuration (CLI flags override these)
+# proxy.yaml sits next to config.yaml and holds the per-client limits
+PROXY_CONFIG = os.getenv("PROXY_CONFIG", "proxy.yaml")
+# Gateway config.yaml: its endpoint names are the only `endpoint` label values in /metrics
+GATEWAY_CONFIG = os.getenv("GATEWAY_CONFIG", "config.yaml")
+PROXY_HOST = os.getenv("PROXY_HOST", "0.0.0.0")
+PROXY_PORT = int(os.getenv("PROXY_PORT", "5100"))
+UPSTREAM_URL = os.getenv("UPSTREAM_URL", "http://localhost:5000")
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "64"))
+# Response cache
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "64"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+# Only deterministic requests are cached: temperature above this is always forwarded
+CACHE_MAX_TEMPERATURE = float(os.getenv("CACHE_MAX_TEMPERATURE", "0"))
+CACHE_DISK_DIR = os.getenv("CACHE_DISK_DIR", "")
+CACHE_DISK_MAX_MB = float(os.getenv("CACHE_DISK_MAX_MB", "1024"))
+# Request coalescing: identical concurrent chat requests share one upstream call.
+# Like the cache, only deterministic requests by default: with temperature above this each request keeps its own
+# (independently sampled) call. Raising it makes clients share one sample, so it is an explicit opt-in.
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+COALESCE_MAX_TEMPERATURE = float(os.getenv("COALESCE_MAX_TEMPERATURE", "0"))
+# Stats snapshot for analyze_costs.py --cache-stats (also served at /proxy/stats)
+STATS_FILE = os.getenv("PROXY_STATS_FILE", "")
+STATS_INTERVAL = float(os.getenv("PROXY_STATS_INTERVAL", "10"))
+# One JSON line per request (analyze_costs.py --request-log); empty = off
+REQUEST_LOG_FILE = os.getenv("REQUEST_LOG_FILE", "")
+REQUEST_LOG_MAX_MB = float(os.getenv("REQUEST_LOG_MAX_MB", "50"))
+REQUEST_LOG_BACKUPS = int(os.getenv("REQUEST_LOG_BACKUPS", "5"))
+# Also log the request payload (prompts) so replay.py can re-issue the traffic; off by default (size, privacy)
+REQUEST_LOG_PAYLOADS = os.getenv("REQUEST_LOG_PAYLOADS", "false").lower() in ("1", "true", "yes")
+
+# Compressed request bodies (Content-Encoding: gzip/deflate) are decoded up to this size to read the payload
+MAX_DECODED_BODY = int(os.getenv("PROXY_MAX_DECODED_BODY_MB", "32")) * 1024 * 1024
+# Bytes kept from the end of a streamed (SSE) response to find the final usage chunk
+STREAM_USAGE_TAIL = 16384
+
+STATS_PATH = "/proxy/stats"
+METRICS_PATH = "/metrics"
+# Headers that describe a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+    "transfer-encoding", "upgrade", "host", "content-length"
+}
+# requests decodes gzip/deflate response bodies, so the relayed body is no longer encoded
+RESPONSE_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {"content-encoding"}
+
+def is_chat_invocation(method: str, path: str) -> bool:
+    """POST /gateway/<endpoint>/invocations"""
+    return method == "POST" and path.startswith("/gateway/") and path.rstrip("/").endswith("/invocations")
+
+def is_cacheable(payload: Dict[str, Any], max_temperature: float = CACHE_MAX_TEMPERATURE) -> bool:
+    """Chỉ cache requests không streaming và có temperature <= max_temperature (mặc định: temperature 0)"""
+    if not isinstance(payload, dict) or payload.get("stream"):
+        return False
+    temperature = payload.get("temperature")
+    return isinstance(temperature, (int, float)) and temperature <= max_temperature
+
+def is_coalescable(payload: Dict[str, Any], max_temperature: float = COALESCE_MAX_TEMPERATURE) -> bool:
+    """Requests không streaming; temperature không có thì dùng default của provider (1.0)"""
+    if not isinstance(payload, dict) or payload.get("stream"):
+        return False
+    temperature = payload.get("temperature", 1.0)
+    return isinstance(temperature, (int, float)) and temperature <= max_temperature
+
+def decode_body(body: bytes, encoding: Optional[str]) -> Optional[bytes]:
+    """Body đã giải nén theo Content-Encoding (gzip/deflate); None nếu không giải nén được hoặc quá MAX_DECODED_BODY"""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding not in ("gzip", "x-gzip", "deflate"):
+        return None
+    try:
+        # wbits 47: auto-detect gzip or zlib header
+        decoder = zlib.decompressobj(47)
+        data = decoder.decompress(body, MAX_DECODED_BODY)
+    except zlib.error:
+        return None
+    return None if decoder.unconsumed_tail else data
+
+def stream_usage(tail: bytes) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(model, usage) từ event SSE cuối cùng có usage (OpenAI: stream_options.include_usage); None nếu không có"""
+    for line in reversed(tail.split(b"\n")):
+        line = line.strip()
+        if line.startswith(b"data:") and b'"usage"' in line:
+            usage = response_usage(line[5:])
+            if usage is not None:
+                return usage
+    return None
+
+def load_gateway_endpoints(path: str) -> List[str]:
+    """Tên endpoints trong config.yaml của MLflow Gateway; file không tồn tại thì trả về []"""
+    if not path or not os.path.exists(path):
+        return []
+    import yaml
+    with open(path, "r") as f:
+        config = yaml.safe_load(f) or {}
+    return [endpoint["name"] for endpoint in config.get("endpoints") or () if endpoint.get("name")]
+
+def load_proxy_config(path: str) -> Dict[str, Any]:
+    """Đọc proxy.yaml; file không tồn tại thì trả về {} (mọi section tắt)"""
+    if not path or not os.path.exists(path):
+        return {}
+    import yaml
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+class UpstreamResponse(NamedTuple):
+    """Response đã đọc hết body, để trả cho nhiều waiters"""
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    latency: float
+    usage: Optional[Tuple[str, Dict[str, Any]]] = None
+
+def response_headers(response: requests.Response) -> Dict[str, str]:
+    return {name: value for name, value in response.headers.items() if name.lower() not in RESPONSE_SKIP_HEADERS}
+
+class GatewayProxy:
+    """State dùng chung của proxy: upstream session (pooled), response cache và counters"""
+
+    def __init__(self, upstream_url: str = UPSTREAM_URL, cache: ResponseCache = None,
+                 max_temperature: float = CACHE_MAX_TEMPERATURE, timeout: float = UPSTREAM_TIMEOUT,
+                 pool_size: int = UPSTREAM_POOL_SIZE, coalesce: bool = COALESCE_ENABLED,
+                 coalesce_max_temperature: float = COALESCE_MAX_TEMPERATURE,
+                 admission: AdmissionController = None, router: Router = None, request_log: RequestLog = None,
+                 log_payloads: bool = REQUEST_LOG_PAYLOADS, semantic_cache: SemanticCache = None,
+                 budget: BudgetGuard = None, clients: ClientResolver = None, endpoints: List[str] = None):
+        self.upstream_url = upstream_url.rstrip("/")
+        # Client id for admission, budget and the request log (main() builds it from the whole proxy.yaml)
+        if clients is None:
+            configured = list(admission.client_limits if admission is not None else ()) + \
+                list(budget.client_limits if budget is not None else ())
+            clients = ClientResolver(admission.key_by if admission is not None else "api_key",
+                                     [client[4:] for client in configured if client.startswith("key:")])
+        self.clients = clients
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.admission = admission
+        self.budget = budget
+        self.router = router
+        self.request_log = request_log
+        self.log_payloads = log_payloads
+        self.max_temperature = max_temperature
+        self.flights = SingleFlight() if coalesce else None
+        self.coalesce_max_temperature = coalesce_max_temperature
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        # Metrics label values: gateway endpoints plus routes and their backends
+        known = set(endpoints or ())
+        if router is not None:
+            for route, backends in router.routes.items():
+                known.add(route)
+                known.update(backend.endpoint for backend in backends)
+        self.metrics = GatewayMetrics(self.stats, known)
+
+    def count(self, field: str):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def forward(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> requests.Response:
+        """Gửi request tới upstream (stream=True để relay SSE ngay khi nhận được)"""
+        self.count("upstream_requests")
+        return self.session.request(method, f"{self.upstream_url}{path}", headers=headers, data=body or None,
+                                    timeout=self.timeout, stream=True, allow_redirects=False)
+
+    def open_upstream(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[requests.Response, Any]:
+        """Forward; với logical route thì thử lần lượt các backends theo Router.plan() (fallback khi lỗi)"""
+        route = self.router.route_for(path) if self.router is not None else None
+        if route is None:
+            return self.forward(method, path, headers, body), None
+        attempts = self.router.plan(route)
+        last_error = None
+        for i, backend in enumerate(attempts):
+            start = time.time()
+            try:
+                response = self.forward(method, backend.path, headers, body)
+            except requests.exceptions.RequestException as e:
+                self.router.record(backend, time.time() - start, None)
+                last_error = e
+                continue
+            latency = time.time() - start
+            if response.status_code in FAILOVER_STATUSES or response.status_code in QUOTA_STATUSES:
+                # Error bodies are small; read them to tell quota errors from transient ones (and other 403s)
+                self.router.record(backend, latency, response.status_code, response.content)
+                if is_failover(response.status_code, response.content) and i < len(attempts) - 1:
+                    response.close()
+                    continue
+            else:
+                self.router.record(backend, latency, response.status_code)
+            return response, backend
+        raise last_error or requests.exceptions.ConnectionError(f"No backend available for route {route}")
+
+    def fetch(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+              store_key: str = None, semantic_query: SemanticQuery = None) -> UpstreamResponse:
+        """Forward và đọc hết response; lưu vào cache nếu có store_key (semantic cache: semantic_query) và status 200"""
+        start = time.time()
+        response, backend = self.open_upstream(method, path, headers, body)
+        try:
+            headers_out = response_headers(response)
+            if backend is not None:
+                headers_out["X-Gateway-Backend"] = backend.endpoint
+            result = UpstreamResponse(response.status_code, headers_out, response.content, time.time() - start)
+        finally:
+            response.close()
+        if result.status == 200:
+            result = result._replace(usage=self.record_usage(result.body, backend))
+            if store_key:
+                self.cache.put(store_key, result.body, result.latency)
+            if semantic_query is not None:
+                self.semantic_cache.put(semantic_query, result.body, result.latency)
+        return result
+
+    def record_usage(self, body: bytes, backend: Any = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Tokens/cost của một upstream call vào metrics (và backend của route); trả về (model, usage)"""
+        usage = response_usage(body)
+        if usage is not None:
+            self.metrics.record_usage(*usage)
+            if backend is not None:
+                self.router.record_usage(backend, *usage)
+        return usage
+
+    def record_stream(self, tail: bytes, backend: Any = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Như record_usage cho streamed response (phần cuối của SSE); đếm stream không báo usage"""
+        usage = stream_usage(tail)
+        self.metrics.streamed.inc(usage="unknown" if usage is None else "reported")
+        if usage is not None:
+            self.metrics.record_usage(*usage)
+            if backend is not None:
+                self.router.record_usage(backend, *usage)
+        return usage
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            data = {
+                "uptime": time.time() - self.started_at,
+                "upstream": self.upstream_url,
+                "requests": self.requests,
+                "upstream_requests": self.upstream_requests,
+                "upstream_errors": self.upstream_errors
+            }
+        # Response models missing from cost_engine.PRICING (their cost metrics use the default model's price)
+        data["unknown_pricing_models"] = unknown_models()
+        data["cache"] = self.cache.to_dict() if self.cache is not None else None
+        data["semantic_cache"] = self.semantic_cache.to_dict() if self.semantic_cache is not None else None
+        data["coalescing"] = self.flights.to_dict() if self.flights is not None else None
+        data["clients"] = self.clients.to_dict()
+        data["admission"] = self.admission.to_dict() if self.admission is not None else None
+        data["budget"] = self.budget.to_dict() if self.budget is not None else None
+        data["routing"] = self.router.to_dict() if self.router is not None else None
+        data["request_log"] = self.request_log.to_dict() if self.request_log is not None else None
+        return data
+
+    def write_stats(self, path: str):
+        """Ghi stats snapshot (atomic) cho analyze_costs.py --cache-stats"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+        os.replace(tmp_path, path)
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+    proxy: GatewayProxy = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_response(self, code: int, message: str = None):
+        self.status = code
+        super().send_response(code, message)
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        self._send(status, dict(headers or {}, **{"Content-Type": "application/json"}),
+                   json.dumps(body).encode())
+
+    def _request_headers(self) -> Dict[str, str]:
+        return {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+
+    def _relay(self, response: requests.Response, extra_headers: Dict[str, str] = None) -> Optional[bytes]:
+        """Trả response của upstream cho client; SSE được relay theo từng chunk (phần cuối giữ ở self.stream_tail),
+        còn lại trả về body đã đọc"""
+        headers = response_headers(response)
+        headers.update(extra_headers or {})
+        if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            self.send_response(response.status_code)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            tail = bytearray()
+            try:
+                for chunk in response.iter_content(chunk_size=None):
+                    if chunk:
+                        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                        tail += chunk
+                        if len(tail) > 2 * STREAM_USAGE_TAIL:
+                            del tail[:-STREAM_USAGE_TAIL]
+                self.wfile.write(b"0\r\n\r\n")
+            finally:
+                response.close()
+                self.stream_tail = bytes(tail)
+            return None
+        body = response.content
+        self._send(response.status_code, headers, body)
+        return body
+
+    def _log_usage(self, usage: Optional[Tuple[str, Dict[str, Any]]]):
+        if usage is not None:
+            model, data = usage
+            self.log_fields["model"] = model
+            self.log_fields["prompt_tokens"] = data.get("prompt_tokens", 0) or 0
+            self.log_fields["completion_tokens"] = data.get("completion_tokens", 0) or 0
+
+    def _handle(self):
+        """Đo request (metrics) và ghi request log quanh _dispatch"""
+        proxy = self.proxy
+        self.status = 0
+        # Filled in by _dispatch: model, usage, cache/coalescing outcome, backend, client
+        self.log_fields = {}
+        self.budget_reservation = None
+        start = time.time()
+        proxy.metrics.in_flight.inc()
+        try:
+            self._dispatch()
+        finally:
+            duration = time.time() - start
+            proxy.metrics.in_flight.dec()
+            proxy.metrics.observe_request(self.path, self.status, duration)
+            if self.budget_reservation is not None:
+                fields = self.log_fields
+                proxy.budget.settle_usage(self.budget_reservation, self.status, fields.get("model"),
+                                          fields.get("prompt_tokens"), fields.get("completion_tokens"),
+                                          bool(fields.get("coalesced")))
+            if proxy.request_log is not None and self.path not in (STATS_PATH, METRICS_PATH):
+                record = {"ts": format_timestamp(start), "method": self.command,
+                          "endpoint": proxy.metrics.endpoint(self.path), "status": self.status,
+                          "latency": round(duration, 4)}
+                record.update(self.log_fields)
+                proxy.request_log.write(record)
+
+    def _dispatch(self):
+        proxy = self.proxy
+        proxy.count("requests")
+        path = self.path
+        if self.command == "GET" and path == STATS_PATH:
+            self._send_json(200, proxy.stats())
+            return
+        if self.command == "GET" and path == METRICS_PATH:
+            self._send(200, {"Content-Type": METRICS_CONTENT_TYPE}, proxy.metrics.render().encode())
+            return
+
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length) if length else b""
+
+        key = None
+        semantic_query = None
+        flight_key = None
+        if is_chat_invocation(self.command, path):
+            decoded = decode_body(body, self.headers.get("Content-Encoding"))
+            try:
+                payload = json.loads(decoded or b"{}") if decoded is not None else None
+            except ValueError:
+                payload = None
+            client = proxy.clients.resolve(self.headers, self.client_address[0])
+            self.log_fields["client"] = redact_client(client)
+            if proxy.log_payloads and proxy.request_log is not None and isinstance(payload, dict):
+                self.log_fields["request"] = payload
+            if isinstance(payload, dict) and isinstance(payload.get("model"), str):
+                self.log_fields["model"] = payload["model"]
+            if proxy.cache is not None and is_cacheable(payload, proxy.max_temperature):
+                key = cache_key(path, payload)
+                entry = proxy.cache.get(key)
+                if entry is not None:
+                    self.log_fields.update(cache="hit", model=entry.model, prompt_tokens=entry.prompt_tokens,
+                                           completion_tokens=entry.completion_tokens)
+                    self._send(200, {"Content-Type": "application/json", "X-Cache": "HIT"}, entry.body)
+                    return
+                self.log_fields["cache"] = "miss"
+            semantic = proxy.semantic_cache
+            if (semantic is not None and semantic.enabled_for(path)
+                    and is_cacheable(payload, semantic.max_temperature)):
+                semantic_query = semantic.query(path, payload)
+                match = semantic.get(semantic_query) if semantic_query is not None else None
+                if match is not None:
+                    entry, similarity = match
+                    self.log_fields.update(cache="semantic_hit", similarity=round(similarity, 4), model=entry.model,
+                                           prompt_tokens=entry.prompt_tokens,
+                                           completion_tokens=entry.completion_tokens)
+                    self._send(200, {"Content-Type": "application/json", "X-Cache": "SEMANTIC-HIT",
+                                     "X-Cache-Similarity": f"{similarity:.4f}"}, entry.body)
+                    return
+                self.log_fields["cache"] = "miss"
+            # Cache hits never reach the provider, so only budget and admit what would go upstream
+            if proxy.budget is not None:
+                verdict = proxy.budget.reserve(client, path, payload)
+                if not verdict.allowed:
+                    retry_after = max(1, math.ceil(verdict.retry_after))
+                    self.log_fields["budget"] = f"{verdict.scope}:{verdict.window}"
+                    self._send_json(429, {"error": {
+                        "message": f"Spend budget exceeded ({verdict.scope}, per {verdict.window}). "
+                                   f"Retry after {retry_after}s.",
+                        "type": "budget_exceeded", "code": f"{verdict.scope}_{verdict.window}"}},
+                        {"Retry-After": str(retry_after)})
+                    return
+                # Settled in _handle once the response (and its usage) is known; a 429 below releases it
+                self.budget_reservation = verdict.reservation
+            if proxy.admission is not None:
+                decision = proxy.admission.admit(client, estimate_request_tokens(payload))
+                if not decision.admitted:
+                    retry_after = max(1, math.ceil(decision.retry_after))
+                    self._send_json(429, {"error": {
+                        "message": f"Rate limit exceeded ({decision.reason}). Retry after {retry_after}s.",
+                        "type": "rate_limit_exceeded", "code": decision.reason}},
+                        {"Retry-After": str(retry_after)})
+                    return
+            if proxy.flights is not None and is_coalescable(payload, proxy.coalesce_max_temperature):
+                flight_key = key or cache_key(path, payload)
+
+        headers = self._request_headers()
+        try:
+            if flight_key:
+                result, shared = proxy.flights.do(
+                    flight_key, lambda: proxy.fetch(self.command, path, headers, body, key, semantic_query))
+                extra = {"X-Coalesced": "1" if shared else "0"}
+                if key or semantic_query is not None:
+                    extra["X-Cache"] = "MISS"
+                self._log_usage(result.usage)
+                self.log_fields["coalesced"] = shared
+                if "X-Gateway-Backend" in result.headers:
+                    self.log_fields["backend"] = result.headers["X-Gateway-Backend"]
+                self._send(result.status, dict(result.headers, **extra), result.body)
+                return
+            start = time.time()
+            response, backend = proxy.open_upstream(self.command, path, headers, body)
+        except requests.exceptions.RequestException as e:
+            proxy.count("upstream_errors")
+            self._send_json(502, {"error": {"message": f"Upstream error: {e}", "type": "proxy_error"}})
+            return
+        extra = {"X-Cache": "MISS"} if key or semantic_query is not None else {}
+        if backend is not None:
+            extra["X-Gateway-Backend"] = backend.endpoint
+            self.log_fields["backend"] = backend.endpoint
+        response_body = self._relay(response, extra)
+        if response_body is None:
+            # Streamed: usage is only known if the provider sent it in the last chunk
+            self.log_fields["streamed"] = True
+            usage = proxy.record_stream(self.stream_tail, backend)
+            if usage is None:
+                self.log_fields["usage"] = "unknown"
+            self._log_usage(usage)
+        elif response.status_code == 200:
+            self._log_usage(proxy.record_usage(response_body, backend))
+            if key:
+                proxy.cache.put(key, response_body, time.time() - start)
+            if semantic_query is not None:
+                proxy.semantic_cache.put(semantic_query, response_body, time.time() - start)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _handle
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Default backlog (5) drops connections under load-test bursts
+    request_queue_size = 256
+
+def create_server(proxy: GatewayProxy, host: str = PROXY_HOST, port: int = PROXY_PORT) -> ProxyServer:
+    """Tạo proxy server (chưa start)"""
+    handler = type("ConfiguredProxyHandler", (ProxyHandler,), {"proxy": proxy})
+    return ProxyServer((host, port), handler)
+
+def start_stats_writer(proxy: GatewayProxy, path: str, interval: float = STATS_INTERVAL) -> threading.Thread:
+    """Ghi stats file định kỳ trong background thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                proxy.write_stats(path)
+            except OSError as e:
+                print(f"⚠ Could not write stats file {path}: {e}")
+
+    thread = threading.Thread(target=run, name="proxy-stats-writer", daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Caching reverse proxy in front of MLflow Gateway")
+    parser.add_argument("--config", default=PROXY_CONFIG,
+                        help="proxy.yaml with admission limits (missing file = admission control off)")
+    parser.add_argument("--gateway-config", default=GATEWAY_CONFIG,
+                        help="Gateway config.yaml; its endpoint names label /metrics (others count as 'other')")
+    parser.add_argument("--host", default=PROXY_HOST, help="Bind address")
+    parser.add_argument("--port", type=int, default=PROXY_PORT, help="Port")
+    parser.add_argument("--upstream", default=UPSTREAM_URL, help="Gateway (or nginx) URL")
+    parser.add_argument("--timeout", type=float, default=UPSTREAM_TIMEOUT, help="Upstream timeout in seconds")
+    parser.add_argument("--no-cache", action="store_true", default=not CACHE_ENABLED, help="Disable the response cache")
+    parser.add_argument("--cache-max-entries", type=int, default=CACHE_MAX_ENTRIES, help="Max cached responses in memory")
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_MB, help="Memory cap for cached bodies, in MB")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL, help="Seconds a cached response stays valid")
+    parser.add_argument("--cache-max-temperature", type=float, default=CACHE_MAX_TEMPERATURE,
+                        help="Only cache requests with temperature <= this value")
+    parser.add_argument("--cache-disk-dir", default=CACHE_DISK_DIR, help="Enable the on-disk tier in this directory")
+    parser.add_argument("--cache-disk-max-mb", type=float, default=CACHE_DISK_MAX_MB, help="Disk tier cap, in MB")
+    parser.add_argument("--no-coalesce", action="store_true", default=not COALESCE_ENABLED,
+                        help="Disable coalescing of identical concurrent chat requests")
+    parser.add_argument("--coalesce-max-temperature", type=float, default=COALESCE_MAX_TEMPERATURE,
+                        help="Only coalesce requests with temperature <= this value (default 0; higher values make "
+                             "sampled requests share one completion)")
+    parser.add_argument("--stats-file", default=STATS_FILE,
+                        help="Write stats JSON here periodically (for analyze_costs.py --cache-stats)")
+    parser.add_argument("--request-log", default=REQUEST_LOG_FILE,
+                        help="Append one JSON line per request here (for analyze_costs.py --request-log)")
+    parser.add_argument("--request-log-max-mb", type=float, default=REQUEST_LOG_MAX_MB,
+                        help="Rotate the request log at this size, in MB")
+    parser.add_argument("--request-log-backups", type=int, default=REQUEST_LOG_BACKUPS,
+                        help="Rotated request log files to keep")
+    parser.add_argument("--request-log-payloads", action="store_true", default=REQUEST_LOG_PAYLOADS,
+                        help="Include request payloads (prompts) in the request log, for replay.py")
+
+    args = parser.parse_args()
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(
+            max_entries=args.cache_max_entries,
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            ttl=args.cache_ttl,
+            disk_dir=args.cache_disk_dir or None,
+            disk_max_bytes=int(args.cache_disk_max_mb * 1024 * 1024)
+        )
+    try:
+        config = load_proxy_config(args.config)
+    except Exception as e:
+        print(f"✗ Could not load {args.config}: {e}")
+        sys.exit(1)
+    try:
+        endpoints = load_gateway_endpoints(args.gateway_config)
+    except Exception as e:
+        print(f"✗ Could not load {args.gateway_config}: {e}")
+        sys.exit(1)
+    try:
+        clients = ClientResolver.from_config(config)
+    except ValueError as e:
+        print(f"✗ Invalid trusted_proxies in {args.config}: {e}")
+        sys.exit(1)
+    admission_config = config.get("admission") or {}
+    admission = None
+    if admission_config.get("enabled", True) and admission_config:
+        admission = AdmissionController.from_config(admission_config)
+
+    semantic_config = config.get("semantic_cache") or {}
+    semantic_cache = None
+    if semantic_config.get("enabled", False):
+        try:
+            semantic_cache = SemanticCache.from_config(semantic_config, args.cache_max_temperature)
+        except ValueError as e:
+            print(f"✗ Invalid semantic_cache section in {args.config}: {e}")
+            sys.exit(1)
+
+    budget_config = config.get("budget") or {}
+    budget = None
+    if budget_config.get("enabled", False):
+        try:
+            budget = BudgetGuard.from_config(budget_config)
+        except (TypeError, ValueError) as e:
+            print(f"✗ Invalid budget section in {args.config}: {e}")
+            sys.exit(1)
+
+    routing_config = config.get("routing") or {}
+    router = None
+    if routing_config.get("enabled", True) and routing_config.get("routes"):
+        router = Router.from_config(routing_config)
+
+    request_log = None
+    if args.request_log:
+        try:
+            request_log = RequestLog(args.request_log, int(args.request_log_max_mb * 1024 * 1024),
+                                     args.request_log_backups)
+        except OSError as e:
+            print(f"✗ Could not open request log {args.request_log}: {e}")
+            sys.exit(1)
+        request_log.start_flusher()
+
+    proxy = GatewayProxy(args.upstream, cache, args.cache_max_temperature, args.timeout,
+                         coalesce=not args.no_coalesce, coalesce_max_temperature=args.coalesce_max_temperature,
+                         admission=admission, router=router, request_log=request_log,
+                         log_payloads=args.request_log_payloads, semantic_cache=semantic_cache, budget=budget,
+                         clients=clients, endpoints=endpoints)
+    server = create_server(proxy, args.host, args.port)
+    if args.stats_file:
+        start_stats_writer(proxy, args.stats_file)
+
+    print(f"✓ Gateway proxy listening on http://{args.host}:{args.port} → {proxy.upstream_url}")
+    if cache is not None:
+        disk = f", disk tier: {args.cache_disk_dir} ({args.cache_disk_max_mb:g}MB)" if args.cache_disk_dir else ""
+        print(f"  Cache: {args.cache_max_entries} entries / {args.cache_max_mb:g}MB, TTL {args.cache_ttl:g}s, "
+              f"temperature <= {args.cache_max_temperature:g}{disk}")
+    else:
+        print("  Cache: disabled")
+    if semantic_cache is not None:
+        endpoints = ", ".join(sorted(semantic_cache.endpoints)) if semantic_cache.endpoints is not None else "all"
+        print(f"  Semantic cache ({args.config}): endpoints {endpoints}, similarity >= {semantic_cache.threshold:g}, "
+              f"{semantic_cache.max_entries} entries / {semantic_cache.max_bytes / 1024 / 1024:g}MB, "
+              f"TTL {semantic_cache.ttl:g}s")
+    if proxy.flights is not None:
+        print(f"  Coalescing: temperature <= {args.coalesce_max_temperature:g}")
+    else:
+        print("  Coalescing: disabled")
+    trusted = ", ".join(str(network) for network in clients.trusted_proxies) or "none (X-Forwarded-For ignored)"
+    print(f"  Clients: per {clients.key_by} ({len(clients.known_keys)} known key(s), other traffic per IP), "
+          f"trusted proxies: {trusted}")
+    if admission is not None:
+        limits = admission.default_limits
+        print(f"  Admission ({args.config}): per {admission.key_by}, {limits.requests_per_minute:g} req/min, "
+              f"{limits.tokens_per_minute:g} tokens/min, {len(admission.client_limits)} client override(s), "
+              f"queue {admission.max_queue} / {admission.max_wait:g}s")
+    else:
+        print("  Admission: disabled")
+    if budget is not None:
+        def describe(limits):
+            return ", ".join(f"${limits[window]:g}/{window}" for window in WINDOWS if window in limits) or "none"
+
+        print(f"  Budget ({args.config}): global {describe(budget.global_limits)}, per client "
+              f"{describe(budget.default_limits)}, {len(budget.client_limits)} client override(s)")
+    if router is not None:
+        for route, backends in router.routes.items():
+            print(f"  Route /gateway/{route}/invocations → {', '.join(b.endpoint for b in backends)}")
+    if request_log is not None:
+        print(f"  Request log: {args.request_log} (rotate at {args.request_log_max_mb:g}MB, "
+              f"keep {args.request_log_backups}{', with payloads' if args.request_log_payloads else ''})")
+    print(f"  Stats: http://{args.host}:{args.port}{STATS_PATH}, metrics: http://{args.host}:{args.port}{METRICS_PATH}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if request_log is not None:
+            request_log.close()
+        if args.stats_file:
+            proxy.write_stats(args.stats_file)
+
+if __name__ == "__main__":
+    main()
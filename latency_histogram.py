@@ -0,0 +1,143 @@
+"""
+Latency Histogram
+HDR-style histogram (sai số tương đối cố định) cho latency percentiles và throughput theo time window
+"""
+
+import math
+from typing import Dict, Any, List, Optional
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+class LatencyHistogram:
+    """Histogram log-linear: mỗi bucket rộng `precision` (tương đối), bộ nhớ không phụ thuộc số samples"""
+
+    def __init__(self, precision: float = 0.01, min_value: float = 1e-6):
+        self.precision = precision
+        self.min_value = min_value
+        self._log_base = math.log1p(precision)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value: float) -> int:
+        return int(math.log(max(value, self.min_value) / self.min_value) / self._log_base)
+
+    def _bucket_value(self, index: int) -> float:
+        # Upper edge of the bucket, so reported percentiles never understate latency
+        return self.min_value * math.exp((index + 1) * self._log_base)
+
+    def record(self, value: float, count: int = 1):
+        """Ghi một latency (giây)"""
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """Gộp histogram khác (cùng precision) vào histogram này"""
+        if other.precision != self.precision or other.min_value != self.min_value:
+            raise ValueError("Cannot merge histograms with different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Giá trị tại percentile p (0-100)"""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, min, max và các percentiles chuẩn"""
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max
+        }
+        for p in PERCENTILES:
+            result[f"p{p:g}"] = self.percentile(p)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "precision": self.precision,
+            "min_value": self.min_value,
+            "counts": {str(index): count for index, count in self.counts.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data.get("precision", 0.01), data.get("min_value", 1e-6))
+        histogram.counts = {int(index): count for index, count in data.get("counts", {}).items()}
+        histogram.count = data.get("count", 0)
+        histogram.total = data.get("total", 0.0)
+        histogram.min = data.get("min")
+        histogram.max = data.get("max")
+        return histogram
+
+class ThroughputTracker:
+    """Đếm số requests hoàn thành theo time window cố định"""
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self.counts: Dict[int, int] = {}
+
+    def record(self, timestamp: float, count: int = 1):
+        slot = int(timestamp // self.window)
+        self.counts[slot] = self.counts.get(slot, 0) + count
+
+    def windows(self) -> List[Dict[str, Any]]:
+        """Danh sách windows liên tục (kể cả window rỗng) từ request đầu đến request cuối"""
+        if not self.counts:
+            return []
+        first, last = min(self.counts), max(self.counts)
+        return [
+            {
+                "start": slot * self.window,
+                "requests": self.counts.get(slot, 0),
+                "rps": self.counts.get(slot, 0) / self.window
+            }
+            for slot in range(first, last + 1)
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        windows = self.windows()
+        rates = [w["rps"] for w in windows]
+        return {
+            "window": self.window,
+            "min_rps": min(rates) if rates else None,
+            "mean_rps": sum(rates) / len(rates) if rates else None,
+            "max_rps": max(rates) if rates else None,
+            "windows": windows
+        }
+
+def format_latency_summary(summary: Dict[str, Any]) -> List[str]:
+    """Format summary() thành các dòng để print"""
+    if not summary.get("count"):
+        return ["  No latency samples"]
+    lines = [f"  Samples: {summary['count']}"]
+    for key in ["mean"] + [f"p{p:g}" for p in PERCENTILES] + ["max"]:
+        lines.append(f"  {key}: {summary[key] * 1000:.1f}ms")
+    return lines
@@ -0,0 +1,248 @@
+"""
+Prometheus Metrics
+Counters/gauges/histograms (text exposition format, không cần prometheus_client) cho traffic đi qua gateway_proxy.py
+"""
+
+import threading
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+from cost_engine import DEFAULT_ENDPOINT, endpoint_name, price_token_totals
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Request duration buckets (seconds): LLM calls range from cache hits to long completions
+DURATION_BUCKETS = (0.005, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base: một metric family với label names cố định, values theo tuple label values"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self.values.items())]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DURATION_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    """Các metrics đăng ký + collectors (callbacks tạo metrics từ state hiện tại lúc scrape)"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def request_endpoint(path: str, known: Iterable[str] = (DEFAULT_ENDPOINT,)) -> str:
+    """Label endpoint giới hạn cardinality: tên gateway endpoint nằm trong known (config.yaml, routes), còn lại 'other'"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/gateway/"):
+        name = endpoint_name(path)
+        return name if name in known else "other"
+    if path in ("/health", "/metrics", "/proxy/stats"):
+        return path.lstrip("/")
+    return "other"
+
+class GatewayMetrics:
+    """Metrics của proxy: requests theo endpoint/status, latency, tokens và cost theo model (giá từ PRICING)"""
+
+    def __init__(self, stats_source: Callable[[], Dict[str, Any]] = None, endpoints: Iterable[str] = None):
+        # Any client can send /gateway/<anything>/...: only these names become label values
+        self.endpoints = frozenset(endpoints) if endpoints else frozenset((DEFAULT_ENDPOINT,))
+        self.registry = Registry()
+        self.requests = self.registry.register(Counter(
+            "gateway_requests_total", "Requests handled by the proxy", ("endpoint", "status")))
+        self.duration = self.registry.register(Histogram(
+            "gateway_request_duration_seconds", "Time from request received to response sent", ("endpoint",)))
+        self.in_flight = self.registry.register(Gauge(
+            "gateway_requests_in_flight", "Requests currently being handled"))
+        self.prompt_tokens = self.registry.register(Counter(
+            "gateway_prompt_tokens_total", "Prompt tokens reported by upstream responses", ("model",)))
+        self.completion_tokens = self.registry.register(Counter(
+            "gateway_completion_tokens_total", "Completion tokens reported by upstream responses", ("model",)))
+        self.cost = self.registry.register(Counter(
+            "gateway_cost_usd_total", "Running upstream cost in USD (cost_engine.PRICING)", ("model",)))
+        self.streamed = self.registry.register(Counter(
+            "gateway_streamed_responses_total", "Streamed (SSE) upstream responses, by whether the last chunk "
+            "reported usage (unknown: tokens and cost not counted)", ("usage",)))
+        if stats_source is not None:
+            self.registry.add_collector(lambda: proxy_stats_metrics(stats_source()))
+
+    def endpoint(self, path: str) -> str:
+        return request_endpoint(path, self.endpoints)
+
+    def observe_request(self, path: str, status: int, duration: float):
+        endpoint = self.endpoint(path)
+        self.requests.inc(endpoint=endpoint, status=str(status))
+        self.duration.observe(duration, endpoint=endpoint)
+
+    def record_usage(self, model: str, usage: Dict[str, Any]):
+        """Tokens và cost của một upstream call (usage từ cost_engine.response_usage)"""
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+        self.prompt_tokens.inc(prompt_tokens, model=model)
+        self.completion_tokens.inc(completion_tokens, model=model)
+        self.cost.inc(price_token_totals(prompt_tokens, completion_tokens, model), model=model)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+def proxy_stats_metrics(stats: Dict[str, Any]) -> List[Metric]:
+    """Cache, coalescing, admission, budget và routing counters từ GatewayProxy.stats() lúc scrape"""
+    metrics = []
+
+    def add(metric: Metric, value: Optional[float], **labels):
+        if value is not None:
+            metric.values[metric._key(labels)] = value
+        if metric not in metrics:
+            metrics.append(metric)
+
+    cache = stats.get("cache")
+    if cache:
+        lookups = Counter("gateway_cache_lookups_total", "Response cache lookups", ("result",))
+        add(lookups, cache["memory_hits"], result="memory_hit")
+        add(lookups, cache["disk_hits"], result="disk_hit")
+        add(lookups, cache["misses"], result="miss")
+        add(Gauge("gateway_cache_bytes", "Bytes held by the memory tier"), cache["bytes"])
+        add(Gauge("gateway_cache_entries", "Entries in the memory tier"), cache["entries"])
+    semantic = stats.get("semantic_cache")
+    if semantic:
+        lookups = Counter("gateway_semantic_cache_lookups_total", "Semantic cache lookups", ("result",))
+        add(lookups, semantic["hits"], result="hit")
+        add(lookups, semantic["misses"], result="miss")
+        add(Gauge("gateway_semantic_cache_bytes", "Bytes held by the semantic cache"), semantic["bytes"])
+        add(Gauge("gateway_semantic_cache_entries", "Entries in the semantic cache"), semantic["entries"])
+    coalescing = stats.get("coalescing")
+    if coalescing:
+        add(Counter("gateway_coalesced_requests_total", "Requests answered from another request's upstream call"),
+            coalescing["coalesced"])
+    admission = stats.get("admission")
+    if admission:
+        rejected = Counter("gateway_admission_rejected_total", "Requests rejected with 429 by admission control",
+                           ("reason",))
+        for reason, count in admission["rejected"].items():
+            add(rejected, count, reason=reason)
+        add(Counter("gateway_admission_delayed_total", "Requests that waited in the admission queue"),
+            admission["delayed"])
+        add(Gauge("gateway_admission_queued", "Requests waiting in the admission queue"), admission["queued"])
+    budget = stats.get("budget")
+    if budget:
+        rejected = Counter("gateway_budget_rejected_total", "Requests rejected with 429 by the spend budget",
+                           ("scope",))
+        for scope, count in budget["rejected"].items():
+            add(rejected, count, scope=scope)
+        spend = Gauge("gateway_budget_spend_usd", "Estimated + settled spend in the rolling window (all clients)",
+                      ("window",))
+        limit = Gauge("gateway_budget_limit_usd", "Global spend limit of the rolling window", ("window",))
+        for window, data in budget["global"].items():
+            add(spend, data["spent"], window=window)
+            add(limit, data["limit"], window=window)
+    routing = stats.get("routing")
+    if routing:
+        backend_requests = Counter("gateway_backend_requests_total", "Upstream attempts per routed backend",
+                                   ("route", "backend"))
+        backend_errors = Counter("gateway_backend_errors_total", "Failed upstream attempts per routed backend",
+                                 ("route", "backend"))
+        backend_latency = Gauge("gateway_backend_ewma_latency_seconds", "EWMA latency per routed backend",
+                                ("route", "backend"))
+        for route, backends in routing["routes"].items():
+            for backend in backends:
+                add(backend_requests, backend["requests"], route=route, backend=backend["endpoint"])
+                add(backend_errors, backend["errors"], route=route, backend=backend["endpoint"])
+                add(backend_latency, backend["ewma_latency"], route=route, backend=backend["endpoint"])
+    return metrics
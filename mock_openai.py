@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible Upstream
+Provider giả lập chat-completions API (latency, token usage, error rate cấu hình được) để benchmark gateway offline
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List
+
+# Configuration (CLI flags override these)
+MOCK_HOST = os.getenv("MOCK_HOST", "0.0.0.0")
+MOCK_PORT = int(os.getenv("MOCK_PORT", "8080"))
+MOCK_MODEL = os.getenv("MOCK_MODEL", "gpt-3.5-turbo")
+
+class MockConfig:
+    """Latency distribution, token counts và error rates của mock provider"""
+
+    def __init__(self, latency_dist: str = "lognormal", latency_ms: float = 300.0, latency_sigma: float = 0.5,
+                 latency_max_ms: float = 30000.0, token_latency_ms: float = 0.0,
+                 completion_tokens_min: int = 20, completion_tokens_max: int = 200,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, quota_error_rate: float = 0.0,
+                 seed: int = None):
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.latency_max_ms = latency_max_ms
+        self.token_latency_ms = token_latency_ms
+        self.completion_tokens_min = completion_tokens_min
+        self.completion_tokens_max = completion_tokens_max
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.quota_error_rate = quota_error_rate
+        self.rng = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """Thời gian trước token đầu tiên (giây)"""
+        if self.latency_dist == "fixed":
+            latency_ms = self.latency_ms
+        elif self.latency_dist == "uniform":
+            latency_ms = self.rng.uniform(0, 2 * self.latency_ms)
+        elif self.latency_dist == "exponential":
+            latency_ms = self.rng.expovariate(1.0 / self.latency_ms) if self.latency_ms > 0 else 0.0
+        else:
+            # lognormal with median latency_ms: heavy right tail like real providers
+            latency_ms = self.latency_ms * self.rng.lognormvariate(0.0, self.latency_sigma)
+        return min(latency_ms, self.latency_max_ms) / 1000.0
+
+    def sample_completion_tokens(self, max_tokens: int = None) -> int:
+        tokens = self.rng.randint(self.completion_tokens_min, max(self.completion_tokens_min, self.completion_tokens_max))
+        if max_tokens:
+            tokens = min(tokens, max_tokens)
+        return max(1, tokens)
+
+    def sample_error(self):
+        """(status, error body) hoặc None nếu request thành công"""
+        r = self.rng.random()
+        if r < self.quota_error_rate:
+            return 429, {"error": {
+                "message": "You exceeded your current quota, please check your plan and billing details.",
+                "type": "insufficient_quota", "param": None, "code": "insufficient_quota"}}
+        r -= self.quota_error_rate
+        if r < self.rate_limit_rate:
+            return 429, {"error": {
+                "message": "Rate limit reached for requests. Please try again in 1s.",
+                "type": "requests", "param": None, "code": "rate_limit_exceeded"}}
+        r -= self.rate_limit_rate
+        if r < self.error_rate:
+            return 500, {"error": {
+                "message": "The server had an error while processing your request.",
+                "type": "server_error", "param": None, "code": None}}
+        return None
+
+class MockStats:
+    """Đếm requests đã nhận, để đối chiếu số upstream calls (vd. khi test cache/coalescing)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streamed = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, stream: bool = False, error: bool = False, prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.streamed += int(stream)
+            self.errors += int(error)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "streamed": self.streamed,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens
+            }
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Ước lượng prompt tokens như tiktoken cho chat format (~4 ký tự/token + overhead mỗi message)"""
+    tokens = 3
+    for message in messages:
+        tokens += 4 + len(str(message.get("content", ""))) // 4
+    return tokens
+
+WORDS = ("the gateway model token request latency response stream provider cache "
+         "quick brown fox jumps over lazy dog data learning example system").split()
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+    config: MockConfig = None
+    stats: MockStats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path in ("/health", "/v1/health"):
+            self._send_json(200, {"status": "OK"})
+        elif self.path == "/mock/stats":
+            self._send_json(200, self.stats.to_dict())
+        elif self.path in ("/v1/models", "/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": MOCK_MODEL, "object": "model", "owned_by": "mock"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        if self.path not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        config = self.config
+        latency = config.sample_latency()
+        error = config.sample_error()
+        stream = bool(payload.get("stream"))
+        if error:
+            time.sleep(latency)
+            self.stats.record(stream=stream, error=True)
+            self._send_json(*error)
+            return
+
+        messages = payload.get("messages", [])
+        prompt_tokens = estimate_prompt_tokens(messages)
+        completion_tokens = config.sample_completion_tokens(payload.get("max_tokens"))
+        words = [config.rng.choice(WORDS) for _ in range(completion_tokens)]
+        model = payload.get("model") or MOCK_MODEL
+        self.stats.record(stream=stream, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+        time.sleep(latency)
+        if stream:
+            self._stream_completion(model, words, prompt_tokens, payload)
+            return
+
+        if config.token_latency_ms:
+            time.sleep(completion_tokens * config.token_latency_ms / 1000.0)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "length" if completion_tokens == payload.get("max_tokens") else "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def _stream_completion(self, model: str, words: List[str], prompt_tokens: int, payload: Dict[str, Any]):
+        """Server-sent events theo format chat.completion.chunk của OpenAI"""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data: str):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+
+        def chunk(delta: Dict[str, Any], finish_reason: str = None) -> str:
+            return json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+
+        send_event(chunk({"role": "assistant", "content": ""}))
+        for i, word in enumerate(words):
+            if self.config.token_latency_ms:
+                time.sleep(self.config.token_latency_ms / 1000.0)
+            send_event(chunk({"content": word if i == 0 else f" {word}"}))
+        send_event(chunk({}, "stop"))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words)
+                }
+            }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Default backlog (5) drops connections under load-test bursts
+    request_queue_size = 256
+
+def create_server(config: MockConfig, host: str = MOCK_HOST, port: int = MOCK_PORT) -> MockServer:
+    """Tạo mock server (chưa start); dùng cho scripts khác chạy mock trong cùng process"""
+    handler = type("ConfiguredMockOpenAIHandler", (MockOpenAIHandler,), {"config": config, "stats": MockStats()})
+    return MockServer((host, port), handler)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions upstream")
+    parser.add_argument("--host", default=MOCK_HOST, help="Bind address")
+    parser.add_argument("--port", type=int, default=MOCK_PORT, help="Port")
+    parser.add_argument("--latency-dist", default=os.getenv("MOCK_LATENCY_DIST", "lognormal"),
+                        choices=["fixed", "uniform", "exponential", "lognormal"], help="Latency distribution")
+    parser.add_argument("--latency-ms", type=float, default=float(os.getenv("MOCK_LATENCY_MS", "300")),
+                        help="Median (lognormal) or mean latency before the first token, in ms")
+    parser.add_argument("--latency-sigma", type=float, default=float(os.getenv("MOCK_LATENCY_SIGMA", "0.5")),
+                        help="Lognormal shape parameter (higher = heavier tail)")
+    parser.add_argument("--latency-max-ms", type=float, default=float(os.getenv("MOCK_LATENCY_MAX_MS", "30000")),
+                        help="Cap for sampled latency, in ms")
+    parser.add_argument("--token-latency-ms", type=float, default=float(os.getenv("MOCK_TOKEN_LATENCY_MS", "0")),
+                        help="Extra latency per completion token, in ms")
+    parser.add_argument("--completion-tokens-min", type=int, default=int(os.getenv("MOCK_COMPLETION_TOKENS_MIN", "20")))
+    parser.add_argument("--completion-tokens-max", type=int, default=int(os.getenv("MOCK_COMPLETION_TOKENS_MAX", "200")))
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("MOCK_ERROR_RATE", "0")),
+                        help="Fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")),
+                        help="Fraction of requests answered with 429 rate_limit_exceeded")
+    parser.add_argument("--quota-error-rate", type=float, default=float(os.getenv("MOCK_QUOTA_ERROR_RATE", "0")),
+                        help="Fraction of requests answered with 429 insufficient_quota")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        latency_max_ms=args.latency_max_ms,
+        token_latency_ms=args.token_latency_ms,
+        completion_tokens_min=args.completion_tokens_min,
+        completion_tokens_max=args.completion_tokens_max,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        quota_error_rate=args.quota_error_rate,
+        seed=args.seed
+    )
+    server = create_server(config, args.host, args.port)
+    print(f"✓ Mock OpenAI upstream listening on http://{args.host}:{args.port}/v1")
+    print(f"  Latency: {args.latency_dist} {args.latency_ms:g}ms (+{args.token_latency_ms:g}ms/token)")
+    print(f"  Errors: 500={args.error_rate:g}, 429 rate limit={args.rate_limit_rate:g}, 429 quota={args.quota_error_rate:g}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Traffic Replay
+Phát lại traffic đã ghi (request log của gateway_proxy.py với --request-log-payloads) tới một gateway:
+giữ (hoặc scale) khoảng cách giữa các arrivals, giới hạn số requests in-flight, ghi results ra file ngay khi có
+"""
+
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, NamedTuple, Optional
+
+from cost_engine import DEFAULT_MODEL, price_token_totals
+from evaluate_gateway import GATEWAY_URL, POOL_SIZE, GatewayEvaluator, create_session
+from latency_histogram import LatencyHistogram, format_latency_summary
+from request_log import iter_records
+from response_cache import CACHE_HIT_VALUES
+from results_store import parse_timestamp
+
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "32"))
+# The proxy writes a record when the request finishes, stamped with its start time, so the log is only
+# roughly ordered; records are re-sorted within this many lines
+REORDER_WINDOW = 1000
+# Chat-completions params copied from a recorded payload besides messages/temperature/max_tokens (stream is set
+# by --stream). An allow-list, because flat records (`ts` + `messages`) also carry log fields (ts, endpoint,
+# status, latency, ...) that must not be sent upstream
+CHAT_PARAMS = (
+    "model", "top_p", "n", "stop", "presence_penalty", "frequency_penalty", "logit_bias", "logprobs",
+    "top_logprobs", "seed", "user", "max_completion_tokens", "response_format", "tools", "tool_choice",
+    "parallel_tool_calls", "functions", "function_call"
+)
+
+class ReplayRequest(NamedTuple):
+    ts: float
+    path: str
+    payload: Dict[str, Any]
+
+def request_path(record: Dict[str, Any]) -> Optional[str]:
+    """Path của request đã ghi: `path`, hoặc /gateway/<endpoint>/invocations"""
+    if record.get("path"):
+        return record["path"]
+    endpoint = record.get("endpoint")
+    if endpoint and endpoint not in ("other", "health", "metrics", "proxy/stats"):
+        return f"/gateway/{endpoint}/invocations"
+    return None
+
+def iter_replay_requests(records: Iterable[Dict[str, Any]], endpoint: str = None) -> Iterator[ReplayRequest]:
+    """Requests có prompt từ records (request log: `request`; hoặc `messages` trực tiếp), theo thứ tự thời gian"""
+    heap = []
+    sequence = 0
+    for record in records:
+        payload = record.get("request") if isinstance(record.get("request"), dict) else record
+        if not isinstance(payload.get("messages"), list) or record.get("method", "POST") != "POST":
+            continue
+        path = endpoint or request_path(record)
+        ts = parse_timestamp(record.get("ts") or record.get("timestamp"))
+        if not path or ts <= 0:
+            continue
+        # sequence keeps the heap from comparing payload dicts on equal timestamps
+        heapq.heappush(heap, (ts, sequence, ReplayRequest(ts, path, payload)))
+        sequence += 1
+        if len(heap) > REORDER_WINDOW:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+class ResultWriter:
+    """Ghi mỗi result một dòng JSON ngay khi request xong (không giữ results trong memory);
+    append + keep_content cho batch_client.py (output resume được, giữ completion)"""
+
+    def __init__(self, path: str, flush_every: int = 100, append: bool = False, keep_content: bool = False):
+        self.path = path
+        self.flush_every = flush_every
+        self.keep_content = keep_content
+        self.lock = threading.Lock()
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+        # A run killed mid-write leaves a partial last line; start on a fresh one
+        if append and self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+        self.lines = 0
+
+    def write(self, result: Dict[str, Any]):
+        record = dict(result)
+        # Response bodies dominate the size; keep only the model for cost attribution
+        response = record.pop("response", None)
+        if not self.keep_content:
+            record.pop("content", None)
+        if isinstance(response, dict) and response.get("model"):
+            record["model"] = response["model"]
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.lines += 1
+            if self.lines % self.flush_every == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class ReplayStats:
+    """Tổng của replay, cập nhật theo từng result (memory không phụ thuộc số requests)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.successful = 0
+        self.statuses: Dict[int, int] = {}
+        self.tokens_by_model: Dict[str, list] = {}
+        # How far behind the recorded schedule requests started (concurrency cap reached)
+        self.lag = LatencyHistogram()
+        self.late = 0
+
+    def add(self, result: Dict[str, Any], lag: float):
+        with self.lock:
+            self.sent += 1
+            status = result.get("status_code", 0)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if result.get("success"):
+                self.successful += 1
+            usage = result.get("usage")
+            if usage and result.get("cache") not in CACHE_HIT_VALUES and not result.get("coalesced"):
+                model = (result.get("response") or {}).get("model") or DEFAULT_MODEL
+                totals = self.tokens_by_model.setdefault(model, [0, 0, 0])
+                totals[0] += 1
+                totals[1] += usage.get("prompt_tokens", 0) or 0
+                totals[2] += usage.get("completion_tokens", 0) or 0
+            self.lag.record(lag)
+            if lag > 0.1:
+                self.late += 1
+
+    @property
+    def total_cost(self) -> float:
+        return sum(price_token_totals(prompt, completion, model)
+                   for model, (_, prompt, completion) in self.tokens_by_model.items())
+
+def replay(evaluator: GatewayEvaluator, requests_iter: Iterable[ReplayRequest], speed: float = 1.0,
+           concurrency: int = REPLAY_CONCURRENCY, limit: int = None,
+           writer: ResultWriter = None) -> Dict[str, Any]:
+    """Gửi requests theo lịch đã ghi chia cho speed (speed 0 = nhanh nhất có thể), tối đa `concurrency` in-flight"""
+    stats = ReplayStats()
+    slots = threading.BoundedSemaphore(concurrency)
+    first_ts = None
+    last_ts = None
+    submitted = 0
+    start = time.monotonic()
+
+    def send(request: ReplayRequest, scheduled_at: float):
+        try:
+            lag = max(0.0, time.monotonic() - scheduled_at)
+            payload = request.payload
+            extra = {name: payload[name] for name in CHAT_PARAMS if name in payload}
+            result = evaluator.send_request(payload["messages"], payload.get("temperature"),
+                                            payload.get("max_tokens"), lag, request.path, extra)
+            result["replay_offset"] = round(request.ts - first_ts, 3)
+            stats.add(result, lag)
+            if writer is not None:
+                writer.write(result)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for request in requests_iter:
+            if limit and submitted >= limit:
+                break
+            if first_ts is None:
+                first_ts = request.ts
+            last_ts = request.ts
+            scheduled_at = start + (request.ts - first_ts) / speed if speed > 0 else start
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # Blocks while `concurrency` requests are in flight; the wait shows up as schedule lag
+            slots.acquire()
+            pool.submit(send, request, scheduled_at)
+            submitted += 1
+
+    elapsed = time.monotonic() - start
+    recorded_span = (last_ts - first_ts) if first_ts is not None else 0.0
+    return {
+        "speed": speed,
+        "concurrency": concurrency,
+        "total_requests": stats.sent,
+        "successful": stats.successful,
+        "failed": stats.sent - stats.successful,
+        "status_codes": stats.statuses,
+        "recorded_span": recorded_span,
+        "elapsed": elapsed,
+        "throughput": stats.sent / elapsed if elapsed > 0 else 0.0,
+        "late_requests": stats.late,
+        "schedule_lag": stats.lag.summary(),
+        "total_cost": stats.total_cost,
+        "latency": evaluator.histogram.summary(),
+        "streaming": evaluator.stream_summary() if evaluator.stream else None,
+        "throughput_windows": evaluator.throughput.summary()
+    }
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded gateway traffic with its original timing")
+    parser.add_argument("--log", required=True,
+                        help="Recorded traffic: gateway_proxy.py request log with --request-log-payloads "
+                             "(rotated files included), or JSON lines with ts + messages")
+    parser.add_argument("--url", default=GATEWAY_URL, help="Target gateway URL")
+    parser.add_argument("--endpoint", help="Send every request to this path instead of the recorded endpoint")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time scale: 2 = twice as fast, 0.5 = half speed, 0 = no pacing (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=REPLAY_CONCURRENCY, help="Max requests in flight")
+    parser.add_argument("--limit", type=int, help="Stop after this many requests")
+    parser.add_argument("--stream", action="store_true", help="Replay with stream: true (TTFT metrics)")
+    parser.add_argument("--output", default="replay_results.jsonl",
+                        help="Results, one JSON line per request, written as they complete")
+
+    args = parser.parse_args()
+    if args.speed < 0 or args.concurrency < 1:
+        print("✗ --speed must be >= 0 and --concurrency >= 1")
+        sys.exit(1)
+
+    session = create_session(max(POOL_SIZE, args.concurrency))
+    evaluator = GatewayEvaluator(args.url, session=session, stream=args.stream, keep_results=False)
+
+    print("=" * 70)
+    print("MLflow Gateway Traffic Replay")
+    print(f"Recording: {args.log}")
+    print(f"Gateway URL: {args.url}")
+    print(f"Speed: {f'{args.speed:g}x' if args.speed > 0 else 'unpaced'}, max in-flight: {args.concurrency}")
+    print(f"Output: {args.output}")
+    print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 70)
+
+    if not evaluator.check_health():
+        print("\n✗ Gateway health check failed. Exiting.")
+        sys.exit(1)
+
+    try:
+        writer = ResultWriter(args.output)
+    except OSError as e:
+        print(f"✗ Could not open {args.output}: {e}")
+        sys.exit(1)
+    try:
+        summary = replay(evaluator, iter_replay_requests(iter_records(args.log), args.endpoint), args.speed,
+                         args.concurrency, args.limit, writer)
+    except FileNotFoundError:
+        print(f"✗ File not found: {args.log}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n\n⚠ Replay interrupted by user")
+        sys.exit(1)
+    finally:
+        writer.close()
+
+    if not summary["total_requests"]:
+        print("\n⚠ No replayable requests (record with gateway_proxy.py --request-log-payloads)")
+        sys.exit(1)
+
+    print(f"\n{'=' * 70}")
+    print("Replay Summary")
+    print(f"{'=' * 70}")
+    print(f"Total Requests: {summary['total_requests']}")
+    print(f"Successful: {summary['successful']}")
+    print(f"Failed: {summary['failed']}")
+    print(f"Recorded span: {summary['recorded_span']:.2f}s, replayed in {summary['elapsed']:.2f}s")
+    print(f"Throughput: {summary['throughput']:.2f} req/s")
+    print("Status Codes:")
+    for status, count in sorted(summary["status_codes"].items()):
+        print(f"  {status if status else 'error'}: {count}")
+    print(f"Total Cost: ${summary['total_cost']:.6f}")
+    print(f"Behind schedule (>100ms): {summary['late_requests']} request(s)")
+    print("Schedule lag:")
+    for line in format_latency_summary(summary["schedule_lag"]):
+        print(line)
+    evaluator.print_latency_report()
+    print(f"\n✓ Results saved to {args.output}")
+    print(f"  python3 results_store.py convert {args.output} --store results_store")
+
+if __name__ == "__main__":
+    main()
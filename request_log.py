@@ -0,0 +1,166 @@
+"""
+Request Log
+Mỗi request qua gateway_proxy.py một dòng JSON gọn (timestamp, endpoint, model, status, latency, usage);
+ghi theo batch (buffer) và rotate theo kích thước, để analyze_costs.py --request-log đọc trực tiếp
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterator, List
+
+# Lines kept in memory before a write; the flusher thread also writes at least every FLUSH_INTERVAL seconds
+BUFFER_LINES = 256
+FLUSH_INTERVAL = 1.0
+
+def format_timestamp(ts: float) -> str:
+    """ISO 8601 UTC với milliseconds (sắp xếp được dạng string)"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(ts * 1000) % 1000:03d}Z"
+
+def rotated_paths(path: str) -> List[str]:
+    """Log file và các bản đã rotate (path.N ... path.1, path), cũ nhất trước"""
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(path) + "."
+    backups = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        names = []
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and suffix.isdigit():
+            backups.append((int(suffix), os.path.join(directory, name)))
+    paths = [backup for _, backup in sorted(backups, reverse=True)]
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+def iter_records(path: str, include_rotated: bool = True) -> Iterator[Dict[str, Any]]:
+    """Đọc records theo thứ tự thời gian; bỏ qua dòng hỏng (vd. dòng cuối đang ghi dở)"""
+    paths = rotated_paths(path) if include_rotated else [path]
+    if not paths:
+        raise FileNotFoundError(path)
+    for file_path in paths:
+        with open(file_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    yield record
+
+class RequestLog:
+    """JSON-lines writer: buffer trong memory, ghi một lần mỗi batch, rotate khi file vượt max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 5,
+                 buffer_lines: int = BUFFER_LINES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_lines = buffer_lines
+        self.lock = threading.Lock()
+        self.buffer: List[str] = []
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.closed = False
+        self.file = None
+        self._open()
+        self.records = 0
+        self.rotations = 0
+        self.rotation_errors = 0
+        self.write_errors = 0
+
+    def _open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            self.records += 1
+            if len(self.buffer) >= self.buffer_lines:
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.buffer or self.closed:
+            return
+        data = "".join(self.buffer)
+        self.buffer = []
+        # max_bytes is a file size: count encoded bytes, not characters
+        size = len(data.encode("utf-8"))
+        try:
+            if self.file is None:
+                # Reopening failed after an earlier rotation; try again
+                self._open()
+            if self.size and self.size + size > self.max_bytes:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+            self.size += size
+        except OSError as e:
+            # A full or read-only log volume must not take the proxy down; drop the batch
+            self.write_errors += 1
+            print(f"⚠ Could not write request log {self.path}: {e}")
+
+    def _rotate(self):
+        """requests.jsonl → requests.jsonl.1 → ... → requests.jsonl.<backups> (bản cũ nhất bị xóa).
+        Rotate lỗi thì đếm vào rotation_errors và tiếp tục ghi vào file hiện tại"""
+        self.file.close()
+        self.file = None
+        try:
+            for i in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+            self.rotations += 1
+        except OSError as e:
+            self.rotation_errors += 1
+            print(f"⚠ Could not rotate request log {self.path}: {e}; still writing to it")
+        finally:
+            # The new file after a rotation, the current one if it failed; if this raises too, the caller counts a
+            # write error and the next flush reopens
+            self._open()
+
+    def start_flusher(self, interval: float = FLUSH_INTERVAL) -> threading.Thread:
+        """Background thread ghi buffer định kỳ để log không bị trễ khi traffic thấp"""
+        def run():
+            while not self.closed:
+                time.sleep(interval)
+                self.flush()
+
+        thread = threading.Thread(target=run, name="request-log-flusher", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        with self.lock:
+            self._flush_locked()
+            self.closed = True
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "path": self.path,
+                "records": self.records,
+                "buffered": len(self.buffer),
+                "bytes": self.size,
+                "rotations": self.rotations,
+                "rotation_errors": self.rotation_errors,
+                "write_errors": self.write_errors
+            }
@@ -0,0 +1,281 @@
+"""
+Response Cache
+Cache responses của chat endpoint theo hash của request đã normalize: LRU + TTL, giới hạn bytes, disk tier tùy chọn
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, NamedTuple
+
+from cost_engine import DEFAULT_MODEL
+
+# Request log `cache` field and X-Cache header values of responses served without an upstream call
+CACHE_HIT_VALUES = ("hit", "semantic_hit", "HIT", "SEMANTIC-HIT")
+# Fields that never change the completion, so they stay out of the key
+_KEY_IGNORED_FIELDS = ("stream", "stream_options", "user")
+
+def normalize_messages(messages: Any) -> Any:
+    """Bỏ whitespace thừa ở đầu/cuối content để prompt giống nhau cho cùng key"""
+    if not isinstance(messages, list):
+        return messages
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict):
+            message = dict(message)
+            if isinstance(message.get("content"), str):
+                message["content"] = message["content"].strip()
+        normalized.append(message)
+    return normalized
+
+def cache_key(path: str, payload: Dict[str, Any]) -> str:
+    """SHA-256 của endpoint + messages/temperature/max_tokens (và các params khác nếu có), JSON canonical"""
+    fields = {key: value for key, value in payload.items() if key not in _KEY_IGNORED_FIELDS}
+    fields["messages"] = normalize_messages(payload.get("messages"))
+    canonical = json.dumps({"path": path, "payload": fields}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    expires_at: float
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    # Upstream latency of the original request: what every hit avoids
+    latency: float
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+def make_entry(body: bytes, ttl: float, latency: float) -> CacheEntry:
+    """Tạo entry từ response body (JSON), lấy model và usage để tính tokens/cost tiết kiệm được"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    usage = data.get("usage") or {}
+    model = data.get("model")
+    return CacheEntry(body, time.time() + ttl, model or DEFAULT_MODEL,
+                      int(usage.get("prompt_tokens", 0) or 0), int(usage.get("completion_tokens", 0) or 0), latency)
+
+class CacheStats:
+    """Hit/miss counts và tokens/latency tiết kiệm được (theo model để tính cost bằng cost_engine)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.latency_saved = 0.0
+        # model -> [hits, prompt_tokens, completion_tokens], same shape as LogAggregate.tokens_by_model
+        self.saved_by_model = {}
+
+    def record_hit(self, entry: CacheEntry, tier: str):
+        with self.lock:
+            self.hits += 1
+            if tier == "disk":
+                self.disk_hits += 1
+            else:
+                self.memory_hits += 1
+            self.latency_saved += entry.latency
+            saved = self.saved_by_model.setdefault(entry.model, [0, 0, 0])
+            saved[0] += 1
+            saved[1] += entry.prompt_tokens
+            saved[2] += entry.completion_tokens
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def count(self, field: str, amount: int = 1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "latency_saved": self.latency_saved,
+                "saved_by_model": {model: list(saved) for model, saved in self.saved_by_model.items()}
+            }
+
+class DiskTier:
+    """Entries lưu thành file <key>.json trong directory, LRU theo thời gian truy cập, giới hạn tổng bytes"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Rebuild the index from files left by a previous run, oldest access first
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-5], stat.st_size))
+        self.index = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.bytes = sum(self.index.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        try:
+            with open(self._path(key), "r") as f:
+                data = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            self.delete(key)
+            return None
+        return CacheEntry(data["body"].encode("utf-8"), data["expires_at"], data["model"],
+                          data["prompt_tokens"], data["completion_tokens"], data["latency"])
+
+    def put(self, key: str, entry: CacheEntry) -> int:
+        """Ghi entry (atomic); trả về số entries bị evict để giữ dưới max_bytes"""
+        data = entry._asdict()
+        try:
+            data["body"] = entry.body.decode("utf-8")
+        except UnicodeDecodeError:
+            # Non-UTF-8 bodies stay in the memory tier only; the disk format stores text
+            return 0
+        path = self._path(key)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return 0
+        evicted = []
+        with self.lock:
+            self.bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            while self.bytes > self.max_bytes and len(self.index) > 1:
+                old_key, old_size = self.index.popitem(last=False)
+                self.bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+        return len(evicted)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.bytes -= self.index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+class ResponseCache:
+    """LRU cache trong memory (giới hạn entries và bytes) với TTL, cộng disk tier tùy chọn"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0,
+                 disk_dir: str = None, disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+        self.disk = DiskTier(disk_dir, disk_max_bytes) if disk_dir else None
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.stats.record_hit(entry, "memory")
+                    return entry
+                self._remove(key)
+                self.stats.count("expirations")
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    with self.lock:
+                        self._insert(key, entry)
+                    self.stats.record_hit(entry, "disk")
+                    return entry
+                self.disk.delete(key)
+                self.stats.count("expirations")
+        self.stats.record_miss()
+        return None
+
+    def put(self, key: str, body: bytes, latency: float = 0.0) -> Optional[CacheEntry]:
+        """Lưu response body; bỏ qua nếu một entry đã lớn hơn max_bytes"""
+        entry = make_entry(body, self.ttl, latency)
+        if entry.size > self.max_bytes:
+            return None
+        with self.lock:
+            self._insert(key, entry)
+        self.stats.count("stores")
+        if self.disk is not None:
+            evicted = self.disk.put(key, entry)
+            if evicted:
+                self.stats.count("evictions", evicted)
+        return entry
+
+    def _insert(self, key: str, entry: CacheEntry):
+        """Thêm entry rồi evict LRU đến khi dưới cả hai giới hạn (gọi khi đang giữ lock)"""
+        self._remove(key)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.bytes -= old_entry.size
+            # With a disk tier the entry is still on disk, so only count real evictions
+            if self.disk is None:
+                self.stats.count("evictions")
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            data = {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl
+            }
+        if self.disk is not None:
+            data["disk_entries"] = len(self.disk.index)
+            data["disk_bytes"] = self.disk.bytes
+        data.update(self.stats.to_dict())
+        return data
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Results Store
+Lưu per-request metrics (evaluate_gateway.py results, request log của gateway_proxy.py) dạng cột, append-only:
+mỗi cột một file binary được mmap khi đọc, nên query chỉ đọc các cột cần thiết
+"""
+
+import json
+import mmap
+import os
+import sys
+from array import array
+from datetime import datetime, timezone
+from itertools import compress
+from typing import Dict, Any, Iterable, List
+
+from cost_engine import DEFAULT_MODEL, UsageColumns, endpoint_name
+from response_cache import CACHE_HIT_VALUES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+STORE_VERSION = 1
+# Column name -> array typecode; model/endpoint/run are ids into the dictionaries in meta.json
+COLUMNS = {
+    "ts": "d",
+    "latency": "d",
+    "ttft": "d",
+    "status": "i",
+    "success": "b",
+    "cache_hit": "b",
+    "coalesced": "b",
+    "prompt_tokens": "q",
+    "completion_tokens": "q",
+    "model": "i",
+    "endpoint": "i",
+    "run": "i"
+}
+DICTIONARY_COLUMNS = ("model", "endpoint", "run")
+# Rows written per batch by append_rows()
+APPEND_BATCH = 10000
+
+def parse_timestamp(value: Any) -> float:
+    """Epoch seconds từ ISO string (naive = giờ local như evaluate_gateway.py, 'Z' = UTC) hoặc số"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+def parse_since(value: str) -> float:
+    """--since (UTC, vd. 2024-06-01 hoặc 2024-06-01T12:00) → epoch seconds"""
+    since = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since.timestamp()
+
+def row_from_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Một row từ result của evaluate_gateway.py (bỏ response body và content)"""
+    usage = result.get("usage") or {}
+    response = result.get("response") if isinstance(result.get("response"), dict) else {}
+    return {
+        "ts": parse_timestamp(result.get("timestamp")),
+        "latency": result.get("response_time") or 0.0,
+        "ttft": result.get("ttft", float("nan")),
+        "status": result.get("status_code") or 0,
+        "success": bool(result.get("success")),
+        "cache_hit": result.get("cache") in CACHE_HIT_VALUES,
+        "coalesced": bool(result.get("coalesced")),
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "model": result.get("model") or response.get("model") or DEFAULT_MODEL,
+        "endpoint": result.get("endpoint") or endpoint_name(result.get("path", ""))
+    }
+
+def row_from_log_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Một row từ request log (request_log.py) của gateway_proxy.py"""
+    status = record.get("status") or 0
+    return {
+        "ts": parse_timestamp(record.get("ts")),
+        "latency": record.get("latency") or 0.0,
+        "ttft": float("nan"),
+        "status": status,
+        "success": status == 200,
+        "cache_hit": record.get("cache") in CACHE_HIT_VALUES,
+        "coalesced": bool(record.get("coalesced")),
+        "prompt_tokens": record.get("prompt_tokens", 0) or 0,
+        "completion_tokens": record.get("completion_tokens", 0) or 0,
+        "model": record.get("model") or DEFAULT_MODEL,
+        "endpoint": record.get("backend") or record.get("endpoint") or "other"
+    }
+
+class ResultsStore:
+    """Thư mục chứa <column>.col (native binary, fixed width) và meta.json (số rows, dictionaries).
+    Một writer tại một thời điểm; readers chỉ thấy rows đã được ghi vào meta.json"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+        self._maps: List[mmap.mmap] = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+            if self.meta.get("version") != STORE_VERSION:
+                raise ValueError(f"Unsupported results store version: {self.meta.get('version')}")
+        else:
+            self.meta = {
+                "version": STORE_VERSION,
+                "rows": 0,
+                "columns": dict(COLUMNS),
+                "dictionaries": {name: [] for name in DICTIONARY_COLUMNS}
+            }
+        self._index = {name: {value: i for i, value in enumerate(values)}
+                       for name, values in self.meta["dictionaries"].items()}
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.col")
+
+    def _encode(self, column: str, value: str) -> int:
+        index = self._index[column]
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(self.meta["dictionaries"][column])
+            self.meta["dictionaries"][column].append(value)
+        return code
+
+    def _save_meta(self):
+        self.meta["updated_at"] = datetime.now().isoformat()
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _write_batch(self, batch: Dict[str, array], count: int):
+        rows = self.meta["rows"]
+        for name, values in batch.items():
+            with open(self._column_path(name), "ab") as f:
+                # Drop bytes left by an append that died before meta.json was updated
+                expected = rows * values.itemsize
+                if f.tell() != expected:
+                    f.truncate(expected)
+                    f.seek(expected)
+                values.tofile(f)
+        self.meta["rows"] = rows + count
+        self._save_meta()
+
+    def append_rows(self, rows: Iterable[Dict[str, Any]], run: str = "") -> int:
+        """Append rows (dict theo COLUMNS; model/endpoint là string) với run label; trả về số rows đã ghi"""
+        os.makedirs(self.path, exist_ok=True)
+        run_id = self._encode("run", run)
+        written = 0
+        batch = {name: array(code) for name, code in COLUMNS.items()}
+        count = 0
+        for row in rows:
+            for name, code in COLUMNS.items():
+                if name == "run":
+                    value = run_id
+                elif name in DICTIONARY_COLUMNS:
+                    value = self._encode(name, row.get(name) or "")
+                else:
+                    value = row.get(name, 0)
+                    value = float(value) if code == "d" else int(value)
+                batch[name].append(value)
+            count += 1
+            if count >= APPEND_BATCH:
+                self._write_batch(batch, count)
+                written += count
+                batch = {name: array(code) for name, code in COLUMNS.items()}
+                count = 0
+        if count or not os.path.exists(self.meta_path):
+            self._write_batch(batch, count)
+            written += count
+        return written
+
+    def column(self, name: str):
+        """Cột `name` (mmap, không copy): numpy array nếu có numpy, không thì memoryview typed"""
+        code = self.meta["columns"][name]
+        itemsize = array(code).itemsize
+        rows = self.meta["rows"]
+        if not rows:
+            return np.zeros(0, dtype=code) if np is not None else array(code)
+        with open(self._column_path(name), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        if np is not None:
+            return np.frombuffer(mapped, dtype=code, count=rows)
+        return memoryview(mapped)[:rows * itemsize].cast(code)
+
+    def select(self, columns: Iterable[str], run: str = None, since: float = None,
+               success_only: bool = False) -> Dict[str, Any]:
+        """Đọc các cột cần thiết, lọc theo run label / timestamp / success (chỉ map thêm cột dùng để lọc)"""
+        columns = list(columns)
+        mask = None
+        filters = []
+        if run is not None:
+            run_id = self._index["run"].get(run, -1)
+            filters.append(("run", lambda values: values == run_id))
+        if since is not None:
+            filters.append(("ts", lambda values: values >= since))
+        if success_only:
+            filters.append(("success", lambda values: values != 0))
+        for name, predicate in filters:
+            values = self.column(name)
+            if np is not None:
+                current = predicate(values)
+                mask = current if mask is None else mask & current
+            else:
+                current = [predicate(value) for value in values]
+                mask = current if mask is None else [a and b for a, b in zip(mask, current)]
+        data = {}
+        for name in columns:
+            values = self.column(name)
+            if mask is not None:
+                values = values[mask] if np is not None else array(self.meta["columns"][name], compress(values, mask))
+            data[name] = values
+        return data
+
+    def usage_columns(self, run: str = None, since: float = None, model: str = None) -> UsageColumns:
+        """UsageColumns (cost_engine) cho requests thành công có usage, bỏ cache hits/coalesced (không gọi upstream)"""
+        data = self.select(("prompt_tokens", "completion_tokens", "model", "endpoint", "cache_hit", "coalesced"),
+                           run, since, success_only=True)
+        if np is not None:
+            billed = ((data["cache_hit"] == 0) & (data["coalesced"] == 0)
+                      & ((data["prompt_tokens"] > 0) | (data["completion_tokens"] > 0)))
+            prompt, completion = data["prompt_tokens"][billed], data["completion_tokens"][billed]
+            model_ids, endpoint_ids = data["model"][billed], data["endpoint"][billed]
+        else:
+            billed = [not (hit or shared) and (prompt or completion) for hit, shared, prompt, completion
+                      in zip(data["cache_hit"], data["coalesced"], data["prompt_tokens"], data["completion_tokens"])]
+            prompt, completion, model_ids, endpoint_ids = (
+                array(COLUMNS[name], compress(data[name], billed))
+                for name in ("prompt_tokens", "completion_tokens", "model", "endpoint"))
+        models = list(self.meta["dictionaries"]["model"])
+        if model:
+            # Price everything as one model (--model override)
+            models = [model] * len(models)
+        return UsageColumns.from_arrays(prompt, completion, model_ids, models, endpoint_ids,
+                                        list(self.meta["dictionaries"]["endpoint"]))
+
+    def runs(self) -> List[str]:
+        return list(self.meta["dictionaries"]["run"])
+
+    def decode(self, column: str) -> List[str]:
+        return list(self.meta["dictionaries"][column])
+
+    def close(self):
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # Still referenced by an array handed out by column(); released with it
+                pass
+        self._maps = []
+
+    def info(self) -> Dict[str, Any]:
+        sizes = {}
+        for name in self.meta["columns"]:
+            path = self._column_path(name)
+            sizes[name] = os.path.getsize(path) if os.path.exists(path) else 0
+        return {"path": self.path, "rows": len(self), "runs": self.runs(), "column_bytes": sizes,
+                "updated_at": self.meta.get("updated_at")}
+
+def iter_source_rows(source: str) -> Iterable[Dict[str, Any]]:
+    """Rows từ evaluate_gateway.py results (JSON), request log hoặc replay.py results (JSON lines)"""
+    # JSON lines: request logs (requests.jsonl, requests.jsonl.1, ...) or replay.py results
+    if ".jsonl" in os.path.basename(source):
+        from request_log import iter_records
+        for record in iter_records(source, include_rotated=False):
+            yield row_from_result(record) if "status_code" in record else row_from_log_record(record)
+        return
+    with open(source, "r") as f:
+        data = json.load(f)
+    results = data.get("results", []) if isinstance(data, dict) else data
+    for result in results:
+        if isinstance(result, dict):
+            yield row_from_result(result)
+
+def convert(sources: List[str], store_path: str, run: str = None) -> int:
+    """Import results/log files vào store; mỗi file là một run (mặc định: tên file)"""
+    store = ResultsStore(store_path)
+    total = 0
+    for source in sources:
+        label = run or os.path.basename(source)
+        count = store.append_rows(iter_source_rows(source), label)
+        print(f"✓ {source}: {count:,} rows → run '{label}'")
+        total += count
+    print(f"  Store: {store_path} ({len(store):,} rows)")
+    return total
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Columnar store for per-request gateway metrics")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Import evaluate_gateway.py results or a request log")
+    convert_parser.add_argument("sources", nargs="+", help="gateway_results.json / requests.jsonl files")
+    convert_parser.add_argument("--store", required=True, help="Store directory (created if missing)")
+    convert_parser.add_argument("--run", help="Run label (default: file name)")
+    info_parser = subparsers.add_parser("info", help="Rows, runs and column sizes")
+    info_parser.add_argument("--store", required=True, help="Store directory")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "convert":
+            convert(args.sources, args.store, args.run)
+        else:
+            if not os.path.exists(os.path.join(args.store, "meta.json")):
+                print(f"✗ No results store at {args.store}")
+                sys.exit(1)
+            info = ResultsStore(args.store).info()
+            print(f"Store: {info['path']}")
+            print(f"Rows: {info['rows']:,}")
+            print(f"Runs: {', '.join(info['runs']) or '-'}")
+            print(f"Updated: {info['updated_at']}")
+            for name, size in info["column_bytes"].items():
+                print(f"  {name:<18} {size:>12,} bytes")
+    except FileNotFoundError as e:
+        print(f"✗ File not found: {e.filename}")
+        sys.exit(1)
+    except (ValueError, OSError) as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
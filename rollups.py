@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Time-windowed Rollups
+Tổng hợp sẵn requests, tokens, cost, error classes và latency theo phút/giờ/ngày, cập nhật incremental từ
+request log của gateway_proxy.py, results store và nginx access log; `query` trả lời range queries chỉ từ rollups
+"""
+
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from cost_engine import DEFAULT_MODEL, price_token_totals, warn_unknown_models
+from latency_histogram import LatencyHistogram
+from response_cache import CACHE_HIT_VALUES
+
+ROLLUP_FILE = os.getenv("ROLLUP_FILE", "rollups.json")
+ROLLUP_VERSION = 1
+# Bucket width (seconds) and how long buckets are kept (seconds, None = forever)
+RESOLUTIONS = {
+    "minute": (60, float(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48")) * 3600),
+    "hour": (3600, float(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90")) * 86400),
+    "day": (86400, None)
+}
+# Coarser than the evaluator's histograms: thousands of buckets are kept, ~5% error is enough for planning
+HISTOGRAM_PRECISION = 0.05
+
+def error_class(status: int) -> Optional[str]:
+    """Error class theo HTTP status (None nếu thành công)"""
+    if not status:
+        return "connection"
+    if status == 429:
+        return "rate_limited"
+    if status >= 500:
+        return "server_error"
+    if status >= 400:
+        return "client_error"
+    return None
+
+class RollupBucket:
+    """Tổng của một time bucket; cost tính lúc query từ tokens theo model (giá mới nhất của cost_engine)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.error_classes: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.coalesced = 0
+        # model -> [requests, prompt_tokens, completion_tokens] (billed upstream calls only)
+        self.tokens_by_model: Dict[str, List[int]] = {}
+        self.latency = LatencyHistogram(HISTOGRAM_PRECISION)
+
+    def add(self, status: int, latency: Optional[float], model: str = None, prompt_tokens: int = 0,
+            completion_tokens: int = 0, cache_hit: bool = False, coalesced: bool = False):
+        self.requests += 1
+        failure = error_class(status)
+        if failure:
+            self.errors += 1
+            self.error_classes[failure] = self.error_classes.get(failure, 0) + 1
+        elif latency is not None:
+            self.latency.record(latency)
+        if cache_hit:
+            self.cache_hits += 1
+        elif coalesced:
+            self.coalesced += 1
+        elif prompt_tokens or completion_tokens:
+            totals = self.tokens_by_model.setdefault(model or DEFAULT_MODEL, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+
+    def merge(self, other: "RollupBucket"):
+        self.requests += other.requests
+        self.errors += other.errors
+        for name, count in other.error_classes.items():
+            self.error_classes[name] = self.error_classes.get(name, 0) + count
+        self.cache_hits += other.cache_hits
+        self.coalesced += other.coalesced
+        for model, (requests, prompt, completion) in other.tokens_by_model.items():
+            totals = self.tokens_by_model.setdefault(model, [0, 0, 0])
+            totals[0] += requests
+            totals[1] += prompt
+            totals[2] += completion
+        self.latency.merge(other.latency)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(totals[1] for totals in self.tokens_by_model.values())
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(totals[2] for totals in self.tokens_by_model.values())
+
+    @property
+    def cost(self) -> float:
+        return sum(price_token_totals(prompt, completion, model)
+                   for model, (_, prompt, completion) in self.tokens_by_model.items())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_classes": self.error_classes,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "tokens_by_model": self.tokens_by_model,
+            "latency": self.latency.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RollupBucket":
+        bucket = cls()
+        bucket.requests = data.get("requests", 0)
+        bucket.errors = data.get("errors", 0)
+        bucket.error_classes = dict(data.get("error_classes", {}))
+        bucket.cache_hits = data.get("cache_hits", 0)
+        bucket.coalesced = data.get("coalesced", 0)
+        bucket.tokens_by_model = {model: list(totals) for model, totals in data.get("tokens_by_model", {}).items()}
+        bucket.latency = LatencyHistogram.from_dict(data.get("latency", {"precision": HISTOGRAM_PRECISION}))
+        return bucket
+
+class Rollups:
+    """Buckets theo mọi resolution + checkpoint của từng source, lưu trong một JSON state file"""
+
+    def __init__(self):
+        self.buckets: Dict[str, Dict[int, RollupBucket]] = {name: {} for name in RESOLUTIONS}
+        self.sources: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, ts: float, status: int, latency: Optional[float], **fields):
+        """Thêm một request vào bucket phút, giờ và ngày chứa ts"""
+        if ts <= 0:
+            # Record without a usable timestamp
+            return
+        for name, (width, _) in RESOLUTIONS.items():
+            start = int(ts // width * width)
+            bucket = self.buckets[name].get(start)
+            if bucket is None:
+                bucket = self.buckets[name][start] = RollupBucket()
+            bucket.add(status, latency, **fields)
+
+    def prune(self, now: float = None):
+        """Bỏ buckets quá retention của từng resolution"""
+        now = now or datetime.now(timezone.utc).timestamp()
+        for name, (_, retention) in RESOLUTIONS.items():
+            if retention is None:
+                continue
+            cutoff = now - retention
+            for start in [start for start in self.buckets[name] if start < cutoff]:
+                del self.buckets[name][start]
+
+    def query(self, start: float, end: float, resolution: str) -> List[Tuple[int, RollupBucket]]:
+        """Buckets của resolution nằm trong [start, end), theo thời gian"""
+        width = RESOLUTIONS[resolution][0]
+        return sorted((ts, bucket) for ts, bucket in self.buckets[resolution].items()
+                      if ts + width > start and ts < end)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": ROLLUP_VERSION,
+            "updated_at": datetime.now().isoformat(),
+            "sources": self.sources,
+            "buckets": {name: {str(ts): bucket.to_dict() for ts, bucket in sorted(buckets.items())}
+                        for name, buckets in self.buckets.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Rollups":
+        if data.get("version") != ROLLUP_VERSION:
+            raise ValueError(f"Unsupported rollup file version: {data.get('version')}")
+        rollups = cls()
+        rollups.sources = data.get("sources", {})
+        for name, buckets in data.get("buckets", {}).items():
+            if name in rollups.buckets:
+                rollups.buckets[name] = {int(ts): RollupBucket.from_dict(bucket) for ts, bucket in buckets.items()}
+        return rollups
+
+def load_rollups(path: str) -> Rollups:
+    if not os.path.exists(path):
+        return Rollups()
+    with open(path, "r") as f:
+        return Rollups.from_dict(json.load(f))
+
+def save_rollups(rollups: Rollups, path: str):
+    """Ghi atomically để cron job bị kill giữa chừng không làm hỏng rollups"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(rollups.to_dict(), f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def iter_new_log_lines(path: str, checkpoint: Dict[str, Any]) -> Iterator[bytes]:
+    """Dòng mới của file từ byte offset đã lưu. Nếu file đã rotate (có thể nhiều lần) thì đọc nốt file cũ
+    (tìm theo inode trong path.N ... path.1) rồi các file mới hơn; lần đầu đọc cả các file đã rotate"""
+    from request_log import rotated_paths
+    stat = os.stat(path)
+    if not checkpoint:
+        # First run: start from the oldest rotated file so the rollups cover everything still on disk
+        pending = [(file_path, 0) for file_path in rotated_paths(path)]
+    elif checkpoint.get("inode") != stat.st_ino:
+        paths = rotated_paths(path)
+        inodes = [os.stat(file_path).st_ino for file_path in paths]
+        if checkpoint.get("inode") in inodes:
+            first = inodes.index(checkpoint["inode"])
+            pending = [(paths[first], checkpoint.get("offset", 0))] + [(file_path, 0) for file_path in paths[first + 1:]]
+        else:
+            # Checkpointed file is gone (rotated out or recreated): only the current file is left
+            pending = [(path, 0)]
+    else:
+        offset = checkpoint.get("offset", 0)
+        pending = [(path, offset if stat.st_size >= offset else 0)]
+    for file_path, offset in pending:
+        checkpoint["inode"] = os.stat(file_path).st_ino
+        checkpoint["offset"] = offset
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Line still being written; pick it up on the next run
+                    break
+                checkpoint["offset"] += len(line)
+                yield line
+    checkpoint["inode"] = stat.st_ino
+
+def update_from_request_log(rollups: Rollups, path: str) -> int:
+    """Request log (JSON lines) của gateway_proxy.py"""
+    from results_store import parse_timestamp
+    checkpoint = rollups.sources.setdefault(f"request_log:{os.path.abspath(path)}", {})
+    count = 0
+    for line in iter_new_log_lines(path, checkpoint):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or not record.get("ts"):
+            continue
+        rollups.add(parse_timestamp(record["ts"]), record.get("status") or 0, record.get("latency"),
+                    model=record.get("model"), prompt_tokens=record.get("prompt_tokens", 0) or 0,
+                    completion_tokens=record.get("completion_tokens", 0) or 0,
+                    cache_hit=record.get("cache") in CACHE_HIT_VALUES, coalesced=bool(record.get("coalesced")))
+        count += 1
+    return count
+
+def update_from_store(rollups: Rollups, store_path: str) -> int:
+    """Results store (results_store.py) là append-only nên checkpoint chỉ là số rows đã đọc"""
+    from results_store import ResultsStore
+    store = ResultsStore(store_path)
+    checkpoint = rollups.sources.setdefault(f"store:{os.path.abspath(store_path)}", {})
+    start = checkpoint.get("rows", 0)
+    if start > len(store):
+        # Store was recreated; start over
+        start = 0
+    names = ("ts", "status", "latency", "model", "prompt_tokens", "completion_tokens", "cache_hit", "coalesced")
+    columns = [store.column(name)[start:] for name in names]
+    models = store.decode("model")
+    count = 0
+    for ts, status, latency, model, prompt, completion, cache_hit, coalesced in zip(*columns):
+        rollups.add(float(ts), int(status), float(latency), model=models[model], prompt_tokens=int(prompt),
+                    completion_tokens=int(completion), cache_hit=bool(cache_hit), coalesced=bool(coalesced))
+        count += 1
+    checkpoint["rows"] = start + count
+    return count
+
+def update_from_nginx(rollups: Rollups, lines: Iterable[str]) -> int:
+    """Nginx access log (format `detailed`): requests, errors và latency (không có tokens)"""
+    from log_classifier import parse_nginx_line
+    count = 0
+    for line in lines:
+        record = parse_nginx_line(line)
+        if record is None:
+            continue
+        try:
+            ts = datetime.strptime(record.time_local, "%d/%b/%Y:%H:%M:%S %z").timestamp()
+        except ValueError:
+            continue
+        rollups.add(ts, record.status, record.request_time)
+        count += 1
+    return count
+
+def parse_time(value: str, now: float) -> float:
+    """Thời điểm: 'now', khoảng lùi ('30m', '24h', '7d') hoặc ISO (UTC nếu không có timezone)"""
+    if value == "now":
+        return now
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return now - float(value[:-1]) * units[value[-1]]
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def pick_resolution(start: float, end: float) -> str:
+    """Resolution mặc định: phút cho ≤ 6h, giờ cho ≤ 14 ngày, còn lại theo ngày"""
+    span = end - start
+    if span <= 6 * 3600:
+        return "minute"
+    if span <= 14 * 86400:
+        return "hour"
+    return "day"
+
+def format_bucket_time(ts: int, resolution: str) -> str:
+    formats = {"minute": "%Y-%m-%d %H:%M", "hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+    return datetime.fromtimestamp(ts, timezone.utc).strftime(formats[resolution])
+
+def _format_ms(value: Optional[float]) -> str:
+    return f"{value * 1000:.0f}ms" if value is not None else "-"
+
+def print_query(rows: List[Tuple[int, RollupBucket]], resolution: str, start: float, end: float):
+    """Bảng theo bucket + tổng của range"""
+    width = RESOLUTIONS[resolution][0]
+    print(f"\n{'=' * 70}")
+    print(f"Rollups by {resolution}: {format_bucket_time(int(start // 60 * 60), 'minute')} → "
+          f"{format_bucket_time(int(end // 60 * 60), 'minute')} UTC")
+    print(f"{'=' * 70}")
+    print(f"{'Time (UTC)':<17} {'Requests':>9} {'Errors':>7} {'Tokens':>10} {'Cost':>11} {'p50':>7} {'p95':>7} {'p99':>7}")
+    total = RollupBucket()
+    for ts, bucket in rows:
+        total.merge(bucket)
+        tokens = bucket.prompt_tokens + bucket.completion_tokens
+        print(f"{format_bucket_time(ts, resolution):<17} {bucket.requests:>9,} {bucket.errors:>7,} {tokens:>10,} "
+              f"{'$' + format(bucket.cost, '.4f'):>11} {_format_ms(bucket.latency.percentile(50)):>7} "
+              f"{_format_ms(bucket.latency.percentile(95)):>7} {_format_ms(bucket.latency.percentile(99)):>7}")
+
+    print(f"\n{'=' * 70}")
+    print("Range Totals")
+    print(f"{'=' * 70}")
+    print(f"Requests: {total.requests:,} (errors: {total.errors:,}"
+          f"{f', {total.errors / total.requests:.2%}' if total.requests else ''})")
+    if total.cache_hits or total.coalesced:
+        print(f"Served without upstream call: cache hits {total.cache_hits:,}, coalesced {total.coalesced:,}")
+    print(f"Prompt Tokens: {total.prompt_tokens:,}")
+    print(f"Completion Tokens: {total.completion_tokens:,}")
+    print(f"Total Cost: ${total.cost:.6f}")
+    if rows:
+        peak_ts, peak = max(rows, key=lambda row: row[1].requests)
+        print(f"Peak: {peak.requests:,} requests in {resolution} {format_bucket_time(peak_ts, resolution)} "
+              f"({peak.requests / width:.2f} req/s)")
+    summary = total.latency.summary()
+    if summary["count"]:
+        print(f"Latency: p50 {_format_ms(summary['p50'])}, p90 {_format_ms(summary['p90'])}, "
+              f"p99 {_format_ms(summary['p99'])}, max {_format_ms(summary['max'])}")
+    if total.error_classes:
+        print("Error classes: " + ", ".join(f"{name} {count:,}" for name, count in
+                                            sorted(total.error_classes.items(), key=lambda item: -item[1])))
+    if len(total.tokens_by_model) > 1:
+        print("Cost by model: " + ", ".join(
+            f"{model} ${price_token_totals(prompt, completion, model):.6f}"
+            for model, (_, prompt, completion) in sorted(total.tokens_by_model.items())))
+    return total
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-minute/hour/day rollups of gateway traffic and cost")
+    parser.add_argument("--file", default=ROLLUP_FILE, help="Rollup state file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    update_parser = subparsers.add_parser("update", help="Add new requests from the sources (run from cron)")
+    update_parser.add_argument("--request-log", action="append", default=[],
+                               help="gateway_proxy.py request log (repeatable)")
+    update_parser.add_argument("--store", action="append", default=[], help="Results store directory (repeatable)")
+    update_parser.add_argument("--nginx-log", help="Nginx access log file (format `detailed`)")
+    update_parser.add_argument("--nginx-container", help="Nginx container name (docker logs)")
+    query_parser = subparsers.add_parser("query", help="Range query answered from the rollups")
+    query_parser.add_argument("--from", dest="start", default="24h",
+                              help="Range start: ISO time (UTC) or look-back like 30m, 24h, 7d (default: 24h)")
+    query_parser.add_argument("--to", dest="end", default="now", help="Range end (default: now)")
+    query_parser.add_argument("--resolution", choices=list(RESOLUTIONS), help="Bucket size (default: by range)")
+    query_parser.add_argument("--json", action="store_true", help="Print buckets and totals as JSON")
+    query_parser.add_argument("--max-cost", type=float,
+                              help="Budget alert: exit with code 2 if the range cost exceeds this (USD)")
+    query_parser.add_argument("--max-error-rate", type=float,
+                              help="Alert: exit with code 2 if the range error rate exceeds this (0-1)")
+
+    args = parser.parse_args()
+    try:
+        rollups = load_rollups(args.file)
+    except (ValueError, OSError) as e:
+        print(f"✗ Error reading rollup file: {e}")
+        sys.exit(1)
+
+    if args.command == "update":
+        if not (args.request_log or args.store or args.nginx_log or args.nginx_container):
+            print("✗ No sources: use --request-log, --store, --nginx-log or --nginx-container")
+            sys.exit(1)
+        try:
+            for path in args.request_log:
+                print(f"✓ {path}: {update_from_request_log(rollups, path):,} new request(s)")
+            for path in args.store:
+                print(f"✓ {path}: {update_from_store(rollups, path):,} new row(s)")
+            if args.nginx_log or args.nginx_container:
+                from analyze_costs import iter_new_docker_lines, iter_new_file_lines
+                if args.nginx_log:
+                    source = f"nginx:{os.path.abspath(args.nginx_log)}"
+                    checkpoint = rollups.sources.setdefault(source, {})
+                    lines = iter_new_file_lines(args.nginx_log, checkpoint)
+                else:
+                    source = f"nginx-container:{args.nginx_container}"
+                    checkpoint = rollups.sources.setdefault(source, {})
+                    lines = iter_new_docker_lines(args.nginx_container, checkpoint)
+                print(f"✓ {source}: {update_from_nginx(rollups, lines):,} new request(s)")
+        except FileNotFoundError as e:
+            print(f"✗ File not found: {e.filename or e}")
+            sys.exit(1)
+        except Exception as e:
+            print(f"✗ Error: {e}")
+            sys.exit(1)
+        rollups.prune()
+        save_rollups(rollups, args.file)
+        print(f"  Rollups: {args.file} ({', '.join(f'{len(b):,} {name}' for name, b in rollups.buckets.items())} buckets)")
+        return
+
+    now = datetime.now(timezone.utc).timestamp()
+    try:
+        start, end = parse_time(args.start, now), parse_time(args.end, now)
+    except ValueError as e:
+        print(f"✗ Invalid time: {e}")
+        sys.exit(1)
+    resolution = args.resolution or pick_resolution(start, end)
+    retention = RESOLUTIONS[resolution][1]
+    rows = rollups.query(start, end, resolution)
+    if args.json:
+        total = RollupBucket()
+        for _, bucket in rows:
+            total.merge(bucket)
+        print(json.dumps({
+            "resolution": resolution,
+            "start": start,
+            "end": end,
+            "buckets": [dict(bucket.to_dict(), ts=ts, cost=bucket.cost) for ts, bucket in rows],
+            "total": dict(total.to_dict(), cost=total.cost)
+        }, indent=2))
+    else:
+        if retention is not None and start < now - retention:
+            print(f"⚠ {resolution} buckets are kept for {retention / 3600:g}h; use a coarser --resolution for older data")
+        total = print_query(rows, resolution, start, end)
+    # Keeps --json output parseable
+    warn_unknown_models(sys.stderr if args.json else None)
+
+    alerts = []
+    if args.max_cost is not None and total.cost > args.max_cost:
+        alerts.append(f"cost ${total.cost:.4f} > budget ${args.max_cost:.4f}")
+    if args.max_error_rate is not None and total.requests and total.errors / total.requests > args.max_error_rate:
+        alerts.append(f"error rate {total.errors / total.requests:.2%} > {args.max_error_rate:.2%}")
+    if alerts:
+        for alert in alerts:
+            print(f"⚠ ALERT: {alert}", file=sys.stderr)
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Latency-aware Router
+Một logical chat route trên nhiều gateway endpoints (chat, chat-anthropic, chat-azure, ...): chọn backend có
+EWMA latency/error rate thấp nhất, fallback có trọng số khi backend lỗi hoặc hết quota
+"""
+
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from cost_engine import price_token_totals
+from latency_histogram import LatencyHistogram
+
+# Statuses that make the router try the next backend: missing endpoint, rate limit/quota, server errors
+FAILOVER_STATUSES = (404, 429, 500, 502, 503, 504)
+# Statuses whose (small) error body is read to tell quota errors apart. 403 only fails over when it is a quota error:
+# other 403s (bad key, forbidden model) would fail the same way on every backend
+QUOTA_STATUSES = (403, 429)
+# Latency assumed for a backend that has only ever failed (seconds)
+UNMEASURED_LATENCY = 1.0
+
+def invocation_path(endpoint: str) -> str:
+    return f"/gateway/{endpoint}/invocations"
+
+def is_quota_error(status: Optional[int], body: Optional[bytes]) -> bool:
+    """429/403 do hết quota (insufficient_quota) chứ không phải rate limit tạm thời"""
+    return status in QUOTA_STATUSES and body is not None and b"quota" in body.lower()
+
+def is_failover(status: Optional[int], body: Optional[bytes] = None) -> bool:
+    """Thử backend tiếp theo: lỗi kết nối (status None), FAILOVER_STATUSES, hoặc 403 do hết quota"""
+    return status is None or status in FAILOVER_STATUSES or is_quota_error(status, body)
+
+class Backend:
+    """Một gateway endpoint phía sau route, với EWMA latency/error rate và counters cho reports"""
+
+    def __init__(self, endpoint: str, weight: float = 1.0):
+        self.endpoint = endpoint
+        self.path = invocation_path(endpoint)
+        self.weight = max(weight, 1e-6)
+        self.ewma_latency = None
+        self.ewma_error = 0.0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.histogram = LatencyHistogram()
+        # model -> [requests, prompt_tokens, completion_tokens]
+        self.tokens_by_model = {}
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        cost = sum(price_token_totals(prompt, completion, model)
+                   for model, (_, prompt, completion) in self.tokens_by_model.items())
+        return {
+            "endpoint": self.endpoint,
+            "weight": self.weight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "quota_errors": self.quota_errors,
+            "ewma_latency": self.ewma_latency,
+            "ewma_error_rate": self.ewma_error,
+            "cooling_down": self.cooldown_until > now,
+            "latency": self.histogram.summary(),
+            "tokens_by_model": {model: list(totals) for model, totals in self.tokens_by_model.items()},
+            "total_cost": cost
+        }
+
+class Router:
+    """Chọn thứ tự backends cho mỗi request và cập nhật EWMA sau mỗi response"""
+
+    def __init__(self, routes: Dict[str, List[Backend]], alpha: float = 0.3, error_penalty: float = 10.0,
+                 cooldown: float = 30.0, explore: float = 0.05, seed: int = None):
+        self.routes = routes
+        self.paths = {invocation_path(name): name for name in routes}
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.cooldown = cooldown
+        self.explore = explore
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "Router":
+        """Tạo từ section `routing` của proxy.yaml"""
+        routes = {}
+        for route in config.get("routes") or ():
+            routes[route["name"]] = [
+                Backend(backend["endpoint"], float(backend.get("weight", 1.0)))
+                for backend in route.get("backends") or ()
+            ]
+        return cls(routes, float(config.get("ewma_alpha", 0.3)), float(config.get("error_penalty", 10.0)),
+                   float(config.get("cooldown_seconds", 30.0)), float(config.get("explore", 0.05)))
+
+    def route_for(self, path: str) -> Optional[str]:
+        return self.paths.get(path.rstrip("/"))
+
+    def _score(self, backend: Backend) -> float:
+        # Untried backends score 0 so each one gets tried at least once
+        if backend.ewma_latency is not None:
+            latency = backend.ewma_latency
+        else:
+            latency = UNMEASURED_LATENCY if backend.requests else 0.0
+        return latency * (1.0 + self.error_penalty * backend.ewma_error) / backend.weight
+
+    def plan(self, route: str) -> List[Backend]:
+        """Backend tốt nhất trước, các backend còn lại theo thứ tự ngẫu nhiên có trọng số (fallback)"""
+        now = time.time()
+        with self.lock:
+            backends = self.routes[route]
+            healthy = [b for b in backends if b.cooldown_until <= now]
+            cooling = sorted((b for b in backends if b.cooldown_until > now), key=lambda b: b.cooldown_until)
+            if not healthy:
+                return cooling
+            # Occasionally lead with another backend so a recovered one can win back traffic
+            if len(healthy) > 1 and self.rng.random() < self.explore:
+                best = self.rng.choice(healthy)
+            else:
+                best = min(healthy, key=self._score)
+            remaining = [b for b in healthy if b is not best]
+            ordered = [best]
+            while remaining:
+                # Fallback weight: configured weight over current score, so fast healthy backends go first
+                weights = [b.weight / (1.0 + self._score(b) * 1000.0) for b in remaining]
+                pick = self.rng.choices(range(len(remaining)), weights=weights)[0]
+                ordered.append(remaining.pop(pick))
+            # Backends in cooldown stay as a last resort
+            return ordered + cooling
+
+    def record(self, backend: Backend, latency: float, status: Optional[int], body: bytes = None):
+        """Cập nhật EWMA latency/error rate; lỗi kết nối (status None) hoặc hết quota → cooldown"""
+        failed = is_failover(status, body)
+        quota = is_quota_error(status, body)
+        with self.lock:
+            backend.requests += 1
+            backend.ewma_error = (1 - self.alpha) * backend.ewma_error + self.alpha * (1.0 if failed else 0.0)
+            if failed:
+                backend.errors += 1
+                if quota:
+                    backend.quota_errors += 1
+                if quota or status is None or status == 404:
+                    backend.cooldown_until = time.time() + self.cooldown
+            else:
+                backend.histogram.record(latency)
+                backend.ewma_latency = latency if backend.ewma_latency is None else \
+                    (1 - self.alpha) * backend.ewma_latency + self.alpha * latency
+
+    def record_usage(self, backend: Backend, model: str, usage: Dict[str, Any]):
+        """Cộng tokens của response vào backend để tính cost theo backend"""
+        with self.lock:
+            totals = backend.tokens_by_model.setdefault(model, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += usage.get("prompt_tokens", 0) or 0
+            totals[2] += usage.get("completion_tokens", 0) or 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        with self.lock:
+            return {
+                "alpha": self.alpha,
+                "error_penalty": self.error_penalty,
+                "cooldown": self.cooldown,
+                "explore": self.explore,
+                "routes": {name: [b.to_dict(now) for b in backends] for name, backends in self.routes.items()}
+            }
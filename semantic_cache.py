@@ -0,0 +1,364 @@
+"""
+Semantic Cache
+Cache theo độ tương đồng của prompt (không cần khớp chính xác): hashing vectorizer chạy trên CPU, index LSH (SimHash)
+trong memory, cosine similarity >= threshold thì trả response đã cache; LRU + TTL, giới hạn entries và bytes
+"""
+
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from response_cache import CacheEntry, CacheStats, make_entry
+
+# Long prompts that differ in one decisive word ("... in English" / "... in Spanish") are still ~0.95 similar, so
+# besides the threshold, key terms must match (see terms_match)
+SIMILARITY_THRESHOLD = 0.95
+# Signature bits split into bands: two prompts become candidates when any band matches exactly
+SIGNATURE_BITS = 64
+LSH_BANDS = 8
+# Candidates compared exactly per lookup (most recently used first)
+MAX_CANDIDATES = 32
+CHAR_NGRAM = 3
+# Fields that never change the completion (same as the exact cache key)
+_PARTITION_IGNORED_FIELDS = ("messages", "stream", "stream_options", "user")
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_MASK64 = (1 << 64) - 1
+# Filler words that may be added, dropped or changed without changing the question. Negations, prepositions and
+# question words are not here: "safe"/"not safe", "to"/"from", "how"/"why" need different answers
+STOPWORDS = frozenset((
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "am", "i", "me", "my", "we", "us", "our", "you",
+    "your", "it", "its", "this", "that", "please", "pls", "can", "could", "would", "will", "do", "does", "did",
+    "s", "m", "re", "ve", "ll", "d", "and", "just", "hi", "hello", "hey", "thanks", "thank"
+))
+# Word endings treated as the same term ("list"/"lists", "install"/"installing")
+_INFLECTIONS = ("s", "es", "ed", "d", "ing", "er", "ers", "ly")
+# Pure-Python simhash: a feature's hash bits are spread into one big int, one counter lane per bit, so adding the
+# lanes of many features counts set bits for all 64 positions at once (lanes hold up to 16M features)
+_LANE_BITS = 24
+_LANE_MASK = (1 << _LANE_BITS) - 1
+# _BYTE_LANES[i][value]: lanes of byte i of a 64-bit hash, so a feature's lanes take 8 lookups
+_BYTE_LANES = [[sum((value >> bit & 1) << ((8 * i + bit) * _LANE_BITS) for bit in range(8)) for value in range(256)]
+               for i in range(8)]
+
+def normalize_text(text: str) -> str:
+    """NFKC, lowercase, bỏ dấu câu và whitespace thừa"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+def _feature_id(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8"))
+
+def vectorize(text: str) -> Dict[int, float]:
+    """Sparse vector (feature hash -> weight, chuẩn hóa L2) từ words, word bigrams và char trigrams"""
+    normalized = normalize_text(text)
+    words = normalized.split()
+    counts: Dict[int, float] = {}
+    for word in words:
+        key = _feature_id("w:" + word)
+        counts[key] = counts.get(key, 0.0) + 1.0
+    for first, second in zip(words, words[1:]):
+        key = _feature_id(f"b:{first} {second}")
+        counts[key] = counts.get(key, 0.0) + 1.0
+    # Character n-grams keep typos and inflections close; weighted down so whole words dominate
+    padded = f" {normalized} "
+    for i in range(len(padded) - CHAR_NGRAM + 1):
+        key = _feature_id("c:" + padded[i:i + CHAR_NGRAM])
+        counts[key] = counts.get(key, 0.0) + 0.5
+    norm = math.sqrt(sum(weight * weight for weight in counts.values()))
+    if not norm:
+        return {}
+    return {key: weight / norm for key, weight in counts.items()}
+
+def key_terms(text: str) -> Tuple[str, ...]:
+    """Các từ của prompt theo thứ tự, bỏ STOPWORDS"""
+    return tuple(word for word in normalize_text(text).split() if word not in STOPWORDS)
+
+def _same_term(a: str, b: str) -> bool:
+    """Cùng từ, biến thể (số nhiều, -ing, ...) hoặc lỗi gõ (thêm/thiếu một ký tự, đảo hai ký tự kề nhau)"""
+    if a == b:
+        return True
+    short, long = (a, b) if len(a) <= len(b) else (b, a)
+    # Prefixes ("unsafe", "uninstall") change the meaning, so only endings count as inflections
+    if len(short) >= 3 and long.startswith(short) and long[len(short):] in _INFLECTIONS:
+        return True
+    if len(short) < 5 or len(long) - len(short) > 1:
+        return False
+    if len(short) == len(long):
+        # Substitutions are not typos here: "stock"/"stack" are both real words
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    i = 0
+    while i < len(short) and short[i] == long[i]:
+        i += 1
+    return short[i:] == long[i + 1:]
+
+def terms_match(a: Tuple[str, ...], b: Tuple[str, ...]) -> bool:
+    """Key terms giống nhau theo thứ tự (cho phép biến thể/lỗi gõ): một từ thêm, bớt, đổi hoặc đảo chỗ
+    ("not", "English"/"Spanish", "celsius to fahrenheit") là câu hỏi khác dù cosine vẫn cao"""
+    return len(a) == len(b) and all(_same_term(x, y) for x, y in zip(a, b))
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """Cosine similarity của hai vectors đã chuẩn hóa L2"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(key, 0.0) for key, weight in a.items())
+
+def _mix64(value: int) -> int:
+    """splitmix64: trải đều bits của feature hash 32-bit thành 64 bits"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+@lru_cache(maxsize=16384)
+def _feature_lanes(key: int) -> int:
+    """Bits của _mix64(key), mỗi bit trong một lane _LANE_BITS bits"""
+    hashed = _mix64(key)
+    lanes = 0
+    for i, table in enumerate(_BYTE_LANES):
+        lanes |= table[hashed >> (8 * i) & 255]
+    return lanes
+
+def _simhash_numpy(vector: Dict[int, float], bits: int) -> int:
+    keys = np.fromiter(vector.keys(), dtype=np.uint64, count=len(vector))
+    weights = np.fromiter(vector.values(), dtype=np.float64, count=len(vector))
+    # _mix64 on the whole array (uint64 arithmetic wraps like & _MASK64)
+    hashed = keys + np.uint64(0x9E3779B97F4A7C15)
+    hashed = (hashed ^ (hashed >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashed = (hashed ^ (hashed >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    hashed ^= hashed >> np.uint64(31)
+    set_bits = np.unpackbits(hashed.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    totals = 2 * (weights @ set_bits[:, :bits]) - weights.sum()
+    signature = 0
+    for bit in np.flatnonzero(totals > 0).tolist():
+        signature |= 1 << bit
+    return signature
+
+def _simhash_python(vector: Dict[int, float], bits: int) -> int:
+    # Weights come from small counts, so features share few distinct weights: count set bits per weight
+    groups: Dict[float, int] = {}
+    for key, weight in vector.items():
+        groups[weight] = groups.get(weight, 0) + _feature_lanes(key)
+    set_weight = [0.0] * bits
+    for weight, lanes in groups.items():
+        for bit in range(bits):
+            count = lanes >> (bit * _LANE_BITS) & _LANE_MASK
+            if count:
+                set_weight[bit] += weight * count
+    # Weight of features with the bit set minus weight of those without
+    total = sum(vector.values())
+    signature = 0
+    for bit, weight in enumerate(set_weight):
+        if 2 * weight > total:
+            signature |= 1 << bit
+    return signature
+
+def simhash(vector: Dict[int, float], bits: int = SIGNATURE_BITS) -> int:
+    """Signature theo random hyperplanes (hướng của mỗi feature lấy từ hash): vectors gần nhau khác ít bits.
+    numpy nếu có, không thì pure Python (bits của mỗi feature được cache)"""
+    if not vector:
+        return 0
+    if np is not None:
+        return _simhash_numpy(vector, bits)
+    return _simhash_python(vector, bits)
+
+class SemanticQuery(NamedTuple):
+    """Phần của request dùng để tìm/lưu: partition (khớp chính xác), vector, các số và key terms trong prompt"""
+    partition: str
+    vector: Dict[int, float]
+    numbers: Tuple[str, ...]
+    signature: int
+    terms: Tuple[str, ...] = ()
+
+class SemanticEntry(NamedTuple):
+    query: SemanticQuery
+    entry: CacheEntry
+
+class SemanticCache:
+    """Index LSH (SimHash chia bands) trên câu hỏi cuối của user, trong partition của endpoint + params + context"""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0, endpoints: List[str] = None,
+                 max_temperature: float = 0.0, bands: int = LSH_BANDS, bits: int = SIGNATURE_BITS):
+        if bits % bands:
+            raise ValueError(f"bits ({bits}) must be a multiple of bands ({bands})")
+        if bits > 64:
+            raise ValueError(f"bits ({bits}) must be at most 64")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # None = every /gateway/<endpoint>/invocations
+        self.endpoints = set(endpoints) if endpoints else None
+        self.max_temperature = max_temperature
+        self.bands = bands
+        self.bits = bits
+        self.band_bits = bits // bands
+        self.entries: "OrderedDict[int, SemanticEntry]" = OrderedDict()
+        # (partition, band index, band value) -> entry ids
+        self.buckets: Dict[Tuple[str, int, int], set] = {}
+        self.next_id = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+        self.similarity_sum = 0.0
+        # Lookups that found LSH candidates but none passed the threshold (or the number/key term checks)
+        self.near_misses = 0
+        # Candidates above the threshold rejected because their key terms differ
+        self.term_rejections = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], max_temperature: float = 0.0) -> "SemanticCache":
+        """Tạo từ section `semantic_cache` của proxy.yaml"""
+        return cls(float(config.get("threshold", SIMILARITY_THRESHOLD)),
+                   int(config.get("max_entries", 10000)),
+                   int(float(config.get("max_mb", 64)) * 1024 * 1024),
+                   float(config.get("ttl", 3600)),
+                   config.get("endpoints") or None,
+                   float(config.get("max_temperature", max_temperature)),
+                   int(config.get("bands", LSH_BANDS)),
+                   int(config.get("bits", SIGNATURE_BITS)))
+
+    def enabled_for(self, path: str) -> bool:
+        """/gateway/<endpoint>/invocations có trong `endpoints` không"""
+        if self.endpoints is None:
+            return True
+        parts = path.strip("/").split("/")
+        return len(parts) == 3 and parts[1] in self.endpoints
+
+    def query(self, path: str, payload: Dict[str, Any]) -> Optional[SemanticQuery]:
+        """Chỉ message cuối (user) được so theo similarity; system prompt, history và params phải khớp chính xác,
+        để một system prompt dài chung không làm các câu hỏi khác nhau trông giống nhau"""
+        messages = payload.get("messages")
+        if not isinstance(messages, list) or not messages or not isinstance(messages[-1], dict):
+            return None
+        text = messages[-1].get("content")
+        if not isinstance(text, str) or not text.strip():
+            return None
+        fields = {key: value for key, value in payload.items() if key not in _PARTITION_IGNORED_FIELDS}
+        context = [
+            {key: normalize_text(value) if key == "content" and isinstance(value, str) else value
+             for key, value in message.items()} if isinstance(message, dict) else message
+            for message in messages[:-1]
+        ]
+        canonical = json.dumps({"path": path, "payload": fields, "context": context,
+                                "role": messages[-1].get("role")},
+                               sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        partition = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        vector = vectorize(text)
+        if not vector:
+            return None
+        # "2+2" and "2+3" are close in n-gram space but need different answers
+        numbers = tuple(_NUMBER.findall(text))
+        return SemanticQuery(partition, vector, numbers, simhash(vector, self.bits), key_terms(text))
+
+    def _bands(self, query: SemanticQuery):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            yield (query.partition, band, query.signature >> (band * self.band_bits) & mask)
+
+    def get(self, query: SemanticQuery) -> Optional[Tuple[CacheEntry, float]]:
+        """Entry gần nhất với similarity >= threshold, cùng similarity"""
+        now = time.time()
+        with self.lock:
+            candidates = set()
+            for bucket in self._bands(query):
+                candidates.update(self.buckets.get(bucket, ()))
+            best_id, best_similarity = None, 0.0
+            # Newest ids first, so a bounded comparison favors recent entries
+            for entry_id in sorted(candidates, reverse=True)[:MAX_CANDIDATES]:
+                cached = self.entries[entry_id]
+                if cached.entry.expires_at <= now:
+                    self._remove(entry_id)
+                    self.stats.count("expirations")
+                    continue
+                if cached.query.numbers != query.numbers:
+                    continue
+                similarity = cosine(query.vector, cached.query.vector)
+                if similarity <= best_similarity or similarity < self.threshold:
+                    continue
+                if not terms_match(query.terms, cached.query.terms):
+                    self.term_rejections += 1
+                    continue
+                best_id, best_similarity = entry_id, similarity
+            if best_id is not None and best_similarity >= self.threshold:
+                self.entries.move_to_end(best_id)
+                entry = self.entries[best_id].entry
+                self.similarity_sum += best_similarity
+            else:
+                if candidates:
+                    self.near_misses += 1
+                entry = None
+        if entry is None:
+            self.stats.record_miss()
+            return None
+        self.stats.record_hit(entry, "memory")
+        return entry, best_similarity
+
+    def put(self, query: SemanticQuery, body: bytes, latency: float = 0.0) -> Optional[CacheEntry]:
+        """Lưu response cho query (thay entry cũ của cùng prompt); bỏ qua nếu body lớn hơn max_bytes"""
+        entry = make_entry(body, self.ttl, latency)
+        if entry.size > self.max_bytes:
+            return None
+        with self.lock:
+            # The same prompt (after normalization) has the same signature, so it is in the first band's bucket
+            for entry_id in list(self.buckets.get(next(self._bands(query)), ())):
+                cached = self.entries[entry_id].query
+                if cached.vector == query.vector and cached.numbers == query.numbers:
+                    self._remove(entry_id)
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = SemanticEntry(query, entry)
+            self.bytes += entry.size
+            for bucket in self._bands(query):
+                self.buckets.setdefault(bucket, set()).add(entry_id)
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.stats.count("evictions")
+        self.stats.count("stores")
+        return entry
+
+    def _remove(self, entry_id: int):
+        """Xóa entry khỏi LRU và các LSH buckets (gọi khi đang giữ lock)"""
+        cached = self.entries.pop(entry_id, None)
+        if cached is None:
+            return
+        self.bytes -= cached.entry.size
+        for bucket in self._bands(cached.query):
+            ids = self.buckets.get(bucket)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.buckets[bucket]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            data = {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "endpoints": sorted(self.endpoints) if self.endpoints is not None else None,
+                "near_misses": self.near_misses,
+                "term_rejections": self.term_rejections
+            }
+            similarity_sum = self.similarity_sum
+        data.update(self.stats.to_dict())
+        data["mean_similarity"] = similarity_sum / data["hits"] if data["hits"] else None
+        return data
@@ -0,0 +1,71 @@
+"""
+Single-flight Request Coalescing
+Các requests giống nhau đang in-flight dùng chung một upstream call; kết quả (hoặc exception) được trả cho mọi waiter
+"""
+
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Gộp các call cùng key đang chạy đồng thời thành một call"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights: Dict[str, _Flight] = {}
+        # leaders: upstream calls made; followers: requests answered from another request's call
+        self.leaders = 0
+        self.followers = 0
+        self.max_waiters = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Chạy fn() nếu chưa có call nào cho key, không thì chờ call đó; trả về (result, shared)"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.followers += 1
+                self.max_waiters = max(self.max_waiters, flight.waiters)
+                leader = False
+            else:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            # Remove before waking waiters so requests arriving afterwards start a fresh call
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.leaders + self.followers
+            return {
+                "requests": total,
+                "upstream_calls": self.leaders,
+                "coalesced": self.followers,
+                "coalescing_ratio": self.followers / total if total else 0.0,
+                "in_flight": len(self.flights),
+                "max_waiters": self.max_waiters
+            }
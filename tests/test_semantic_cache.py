@@ -0,0 +1,138 @@
+"""
+Semantic cache: các cặp prompt có cosine cao nhưng cần câu trả lời khác (false positives đã biết) không được hit,
+prompt chỉ khác định dạng/lỗi gõ vẫn hit; simhash (numpy / pure Python) khớp cách tính gốc
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import semantic_cache
+from semantic_cache import SemanticCache, cosine, terms_match, key_terms, vectorize, _mix64
+
+ARTICLE = (
+    "The city council approved a new budget for public transport on Tuesday. The plan adds forty electric buses, "
+    "extends night service on the three busiest lines and funds a study of a tram connection to the airport. "
+    "Critics said the fare increase that pays for part of the plan will hit low income riders hardest, while "
+    "supporters argued that faster and more frequent service will bring back passengers lost during the pandemic. "
+    "The first new buses are expected to enter service next spring, and the council will review ridership figures "
+    "after twelve months before deciding whether to expand the program to suburban routes."
+)
+
+# (cached prompt, new prompt): similar wording, different question
+FALSE_POSITIVES = [
+    (f"Summarize the following article in English: {ARTICLE}", f"Summarize the following article in Spanish: {ARTICLE}"),
+    (f"{ARTICLE} Is the plan safe for the city budget?", f"{ARTICLE} Is the plan not safe for the city budget?"),
+    (f"{ARTICLE} Is the plan safe for the city budget?", f"{ARTICLE} Is the plan unsafe for the city budget?"),
+    (f"{ARTICLE} Explain how to install the app.", f"{ARTICLE} Explain how to uninstall the app."),
+    (f"{ARTICLE} Convert the fares from euros to dollars.", f"{ARTICLE} Convert the fares from dollars to euros."),
+    (f"{ARTICLE} Why was the budget approved?", f"{ARTICLE} How was the budget approved?"),
+    ("Is it safe to eat raw chicken?", "Is it not safe to eat raw chicken?"),
+    ("Reply in English", "Reply in Spanish"),
+]
+
+# (cached prompt, new prompt): same question
+TRUE_POSITIVES = [
+    (f"Summarize the following article: {ARTICLE}", f"summarize the following article:\n\n{ARTICLE.upper()}"),
+    (f"Summarize the following article in English: {ARTICLE}",
+     f"Please summarize the following article in english. {ARTICLE}"),
+    (f"{ARTICLE} Give me a recipe for the council meeting.", f"{ARTICLE} Give me a recipie for the council meeting."),
+    ("What are the benefits of exercise?", "what are the benefits of exercise"),
+]
+
+PAYLOAD = {"temperature": 0, "max_tokens": 100}
+
+def request(text):
+    return dict(PAYLOAD, messages=[{"role": "user", "content": text}])
+
+def reference_simhash(vector, bits=64):
+    """Cách tính gốc (64 phép cộng mỗi feature), trả về cả tổng của từng bit"""
+    totals = [0.0] * bits
+    for key, weight in vector.items():
+        hashed = _mix64(key)
+        for bit in range(bits):
+            totals[bit] += weight if hashed >> bit & 1 else -weight
+    return totals
+
+class FalsePositiveTest(unittest.TestCase):
+    def test_known_pairs_are_misses(self):
+        for cached_text, text in FALSE_POSITIVES:
+            with self.subTest(text=text[-60:]):
+                cache = SemanticCache()
+                cache.put(cache.query("/gateway/chat/invocations", request(cached_text)), b'{"cached": true}')
+                query = cache.query("/gateway/chat/invocations", request(text))
+                self.assertIsNone(cache.get(query))
+
+    def test_long_pairs_are_above_threshold(self):
+        # The guard is what rejects these, not the threshold
+        for cached_text, text in FALSE_POSITIVES[:4]:
+            with self.subTest(text=text[-60:]):
+                self.assertGreaterEqual(cosine(vectorize(cached_text), vectorize(text)), 0.95)
+
+    def test_rejections_are_counted(self):
+        cache = SemanticCache()
+        cached_text, text = FALSE_POSITIVES[0]
+        cache.put(cache.query("/gateway/chat/invocations", request(cached_text)), b"{}")
+        cache.get(cache.query("/gateway/chat/invocations", request(text)))
+        self.assertEqual(cache.to_dict()["term_rejections"], 1)
+
+class TruePositiveTest(unittest.TestCase):
+    def test_same_question_hits(self):
+        for cached_text, text in TRUE_POSITIVES:
+            with self.subTest(text=text[-60:]):
+                cache = SemanticCache()
+                cache.put(cache.query("/gateway/chat/invocations", request(cached_text)), b'{"cached": true}')
+                match = cache.get(cache.query("/gateway/chat/invocations", request(text)))
+                self.assertIsNotNone(match)
+                self.assertEqual(match[0].body, b'{"cached": true}')
+
+class TermsMatchTest(unittest.TestCase):
+    def test_variants(self):
+        self.assertTrue(terms_match(key_terms("sort a list in Python"), key_terms("Please sort lists in python")))
+        self.assertTrue(terms_match(key_terms("python decorators"), key_terms("pyhton decorators")))
+        self.assertTrue(terms_match(key_terms("colour palette"), key_terms("color palette")))
+
+    def test_different_terms(self):
+        self.assertFalse(terms_match(key_terms("stock prices"), key_terms("stack prices")))
+        self.assertFalse(terms_match(key_terms("is it safe"), key_terms("is it not safe")))
+        self.assertFalse(terms_match(key_terms("celsius to fahrenheit"), key_terms("fahrenheit to celsius")))
+
+class PutTest(unittest.TestCase):
+    def test_identical_query_replaces_entry(self):
+        cache = SemanticCache()
+        for body in (b'{"n": 1}', b'{"n": 2}'):
+            cache.put(cache.query("/gateway/chat/invocations", request("What is the capital of France?")), body)
+        self.assertEqual(len(cache.entries), 1)
+        match = cache.get(cache.query("/gateway/chat/invocations", request("what is the capital of france")))
+        self.assertEqual(match[0].body, b'{"n": 2}')
+
+    def test_different_numbers_are_kept(self):
+        cache = SemanticCache()
+        for text in ("What is 3.5 times 2?", "What is 3,5 times 2?"):
+            cache.put(cache.query("/gateway/chat/invocations", request(text)), b"{}")
+        self.assertEqual(len(cache.entries), 2)
+
+class SimhashTest(unittest.TestCase):
+    def assert_matches_reference(self, simhash_impl):
+        for text in (ARTICLE, "Reply in English", ARTICLE * 5, "x"):
+            vector = vectorize(text)
+            signature = simhash_impl(vector, 64)
+            for bit, total in enumerate(reference_simhash(vector)):
+                # Ties (total ~ 0) may go either way with float rounding
+                if abs(total) > 1e-9:
+                    self.assertEqual(signature >> bit & 1, int(total > 0), f"bit {bit} of {text[:20]!r}")
+
+    def test_python(self):
+        self.assert_matches_reference(semantic_cache._simhash_python)
+
+    @unittest.skipIf(semantic_cache.np is None, "numpy not installed")
+    def test_numpy(self):
+        self.assert_matches_reference(semantic_cache._simhash_numpy)
+
+    def test_empty(self):
+        self.assertEqual(semantic_cache.simhash({}), 0)
+
+if __name__ == "__main__":
+    unittest.main()
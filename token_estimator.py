@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Token Estimator
+Ước lượng prompt tokens (+ max_tokens) và chi phí của một request trước khi gửi: tiktoken nếu có, không thì
+tokenizer heuristic theo cách pre-tokenize của BPE; encoder load một lần, kết quả theo text được cache
+"""
+
+import hashlib
+import json
+import math
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, NamedTuple, Optional, Tuple
+
+from cost_engine import DEFAULT_MODEL, price_token_totals, resolve_pricing_model
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Completion budget reserved when the request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+# Chat format overhead (OpenAI): tokens per message, per `name` field, and priming the assistant reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+# Token counts of recent message texts (system prompts and few-shot examples repeat), keyed by a digest of the text
+# so long prompts are not kept alive; bounded by the approximate memory of the entries
+TEXT_CACHE_MAX_BYTES = 2 * 1024 * 1024
+# Digest, key tuple, int and OrderedDict link of one entry (the model name is added per entry)
+_CACHE_ENTRY_BYTES = 200
+FALLBACK_ENCODING = "cl100k_base"
+# Same split as cl100k's pre-tokenizer: contractions, letter runs (with one leading space), up to 3 digits,
+# punctuation runs, newlines; plain spaces before words cost nothing extra
+_PRETOKEN_RE = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s*\n|\s+", re.IGNORECASE)
+# ASCII fast path, one token per match: words, 8-letter pieces of long words, digit groups, punctuation pairs,
+# line breaks (counted by the regex engine instead of a Python loop over pieces)
+_ASCII_TOKEN_PATTERNS = tuple(re.compile(pattern) for pattern in
+                              (r"[A-Za-z]+", r"[A-Za-z]{8}", r"\d{1,3}", r"[^\w\s]{1,2}", r"\n\s*"))
+# Heuristic cost is linear in text length (~0.15-0.3µs/char): longer texts are estimated from evenly spaced
+# samples scaled by length, which keeps an estimate under ~0.5ms at any size (usually within ~3% of the full
+# count, up to ~8% on indented code)
+HEURISTIC_EXACT_CHARS = 1536
+HEURISTIC_SAMPLES = 8
+HEURISTIC_SAMPLE_CHARS = 192
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+class TokenEstimate(NamedTuple):
+    prompt_tokens: int
+    completion_tokens: int
+    model: str
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cost(self) -> float:
+        """Chi phí tối đa (completion dùng hết max_tokens) theo PRICING"""
+        return price_token_totals(self.prompt_tokens, self.completion_tokens, self.model)
+
+def heuristic_token_count(text: str) -> int:
+    """Số tokens gần đúng (thường lệch ±15% so với cl100k với tiếng Anh, nghiêng về phía cao cho text khác)"""
+    if len(text) <= HEURISTIC_EXACT_CHARS:
+        return _count_pieces(text)
+    step = len(text) / HEURISTIC_SAMPLES
+    tokens = chars = 0
+    for i in range(HEURISTIC_SAMPLES):
+        start = int(i * step)
+        end = start + HEURISTIC_SAMPLE_CHARS
+        # Cut at spaces so samples do not split words (text without nearby spaces keeps the raw cut)
+        first = text.find(" ", start, end)
+        last = text.find(" ", end, end + 64)
+        sample = text[start if first < 0 else first:end if last < 0 else last]
+        tokens += _count_pieces(sample)
+        chars += len(sample)
+    return round(tokens * len(text) / chars)
+
+def _count_pieces(text: str) -> int:
+    if text.isascii():
+        return sum(len(pattern.findall(text)) for pattern in _ASCII_TOKEN_PATTERNS)
+    count = 0
+    for piece in _PRETOKEN_RE.findall(text):
+        word = piece.strip()
+        if not word:
+            # Whitespace runs: one token per line break group
+            count += 1 if "\n" in piece else 0
+        elif word.isascii():
+            if word[0].isalpha():
+                # Common words are single tokens; long or rare ones split into ~8-character pieces
+                count += 1 + len(word) // 8
+            else:
+                count += math.ceil(len(word) / 2) if not word[0].isdigit() else 1
+        else:
+            # Accented and non-Latin scripts split much finer than English
+            count += max(1, len(word.encode("utf-8", "surrogatepass")) // 3)
+    return count
+
+def get_encoder(model: str = DEFAULT_MODEL) -> Any:
+    """Encoder tiktoken của model (load một lần cho mỗi encoding), None nếu không có tiktoken"""
+    if tiktoken is None:
+        return None
+    encoder = _encoders.get(model)
+    if encoder is None:
+        with _encoders_lock:
+            encoder = _encoders.get(model)
+            if encoder is None:
+                try:
+                    encoder = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoder = tiktoken.get_encoding(FALLBACK_ENCODING)
+                _encoders[model] = encoder
+    return encoder
+
+class TextTokenCache:
+    """LRU: (digest của text, model) -> số tokens, giới hạn theo bytes ước lượng của entries"""
+
+    def __init__(self, max_bytes: int = TEXT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries: "OrderedDict[Tuple[bytes, str], int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str, model: str) -> Tuple[bytes, str]:
+        # surrogatepass: JSON bodies may carry lone surrogates ("\ud800")
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), model
+
+    def get(self, key: Tuple[bytes, str]) -> Optional[int]:
+        with self.lock:
+            count = self.entries.get(key)
+            if count is not None:
+                self.entries.move_to_end(key)
+            return count
+
+    def put(self, key: Tuple[bytes, str], count: int):
+        size = _CACHE_ENTRY_BYTES + len(key[1])
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = count
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, model = self.entries.popitem(last=False)[0]
+                self.bytes -= _CACHE_ENTRY_BYTES + len(model)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+_text_cache = TextTokenCache()
+
+def clear_text_cache():
+    """Xóa cache token counts (vd. để đo tokenizer không có cache)"""
+    _text_cache.clear()
+
+def count_text_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Tokens của một đoạn text (tiktoken, hoặc heuristic); count của text đã gặp lấy từ cache"""
+    encoder = get_encoder(model)
+    if encoder is None and len(text) > HEURISTIC_EXACT_CHARS:
+        # Sampled estimate costs less than hashing the whole text for a cache key
+        return heuristic_token_count(text)
+    key = TextTokenCache.key(text, model)
+    count = _text_cache.get(key)
+    if count is None:
+        if encoder is None:
+            count = heuristic_token_count(text)
+        else:
+            count = len(encoder.encode(text, disallowed_special=()))
+        _text_cache.put(key, count)
+    return count
+
+def count_message_tokens(messages: Any, model: str = DEFAULT_MODEL) -> int:
+    """Prompt tokens của chat messages, gồm overhead của chat format"""
+    if not isinstance(messages, list):
+        return 0
+    tokens = REPLY_PRIMING_TOKENS
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        tokens += TOKENS_PER_MESSAGE
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += count_text_tokens(content, model)
+        elif isinstance(content, list):
+            # Content parts: only text parts are counted
+            for part in content:
+                if isinstance(part, dict) and isinstance(part.get("text"), str):
+                    tokens += count_text_tokens(part["text"], model)
+        if isinstance(message.get("role"), str):
+            tokens += 1
+        if message.get("name"):
+            tokens += TOKENS_PER_NAME
+    return tokens
+
+def estimate_tokens(payload: Dict[str, Any], model: Optional[str] = None) -> TokenEstimate:
+    """Prompt tokens + max_tokens (hoặc DEFAULT_COMPLETION_TOKENS) của một chat request"""
+    if not isinstance(payload, dict):
+        return TokenEstimate(0, DEFAULT_COMPLETION_TOKENS, resolve_pricing_model(model))
+    model = resolve_pricing_model(model or payload.get("model"))
+    max_tokens = payload.get("max_tokens")
+    completion = max_tokens if isinstance(max_tokens, int) and max_tokens > 0 else DEFAULT_COMPLETION_TOKENS
+    return TokenEstimate(count_message_tokens(payload.get("messages"), model), completion, model)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Estimate prompt tokens and worst-case cost of a chat request")
+    parser.add_argument("request", help="Request JSON file ({\"messages\": [...], \"max_tokens\": ...}), '-' = stdin")
+    parser.add_argument("--model", help="Model for tokenizer and pricing (default: request `model` or gpt-3.5-turbo)")
+    parser.add_argument("--bench", type=int, default=0, help="Also time this many estimates")
+
+    args = parser.parse_args()
+    try:
+        payload = json.load(sys.stdin if args.request == "-" else open(args.request, "r", encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"✗ Could not read request: {e}")
+        sys.exit(1)
+
+    estimate = estimate_tokens(payload, args.model)
+    print(f"Tokenizer: {'tiktoken' if tiktoken is not None else 'heuristic (pip install tiktoken for exact counts)'}")
+    print(f"Model: {estimate.model}")
+    print(f"Prompt tokens: {estimate.prompt_tokens:,}")
+    print(f"Completion tokens (max): {estimate.completion_tokens:,}")
+    print(f"Max cost: ${estimate.cost:.6f}")
+    if args.bench:
+        start = time.perf_counter()
+        for _ in range(args.bench):
+            # Cleared each time so the text cache does not hide the tokenizer cost
+            clear_text_cache()
+            estimate_tokens(payload, args.model)
+        uncached = (time.perf_counter() - start) / args.bench
+        start = time.perf_counter()
+        for _ in range(args.bench):
+            estimate_tokens(payload, args.model)
+        cached = (time.perf_counter() - start) / args.bench
+        print(f"Estimate time: {uncached * 1e6:.1f}µs (new text), {cached * 1e6:.1f}µs (cached text)")
+
+if __name__ == "__main__":
+    main()